@@ -2,4 +2,13 @@ import asyncpg
 
 LOCKPARSER = None
 LOCKFUNCS = dict()
-PGPOOL: asyncpg.Pool = None
\ No newline at end of file
+PGPOOL: asyncpg.Pool = None
+METRICS = None
+TRACER = None
+REPLICA = None
+EVENTS = None
+NAMES = None
+PRESENCE = None
+CHANNELS = None
+REVOCATIONS = None
+THROTTLE = None
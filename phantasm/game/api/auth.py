@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional
 
+import asyncio
+import math
 import mudpy
 import jwt
 import phantasm
@@ -8,6 +10,8 @@ import typing
 import uuid
 import pydantic
 
+import asyncpg
+from asyncpg import exceptions
 from asyncpg.exceptions import UniqueViolationError
 
 from pydantic import BaseModel
@@ -15,7 +19,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 
 from .models import UserModel, CharacterModel
-from .utils import crypt_context, oauth2_scheme, get_real_ip, get_current_user, ActiveAs
+from .utils import crypt_context, oauth2_scheme, get_real_ip, get_current_user, RequestConnection, ActiveAs
+from phantasm.game.events import publish
 
 router = APIRouter()
 
@@ -30,6 +35,7 @@ def _create_token(sub: str, expires: datetime, refresh: bool = False):
         "sub": sub,
         "exp": expires,
         "iat": datetime.now(tz=timezone.utc),
+        "jti": str(uuid.uuid4()),
     }
     if refresh:
         data["refresh"] = True
@@ -69,14 +75,32 @@ class TokenResponse(BaseModel):
         return cls(access_token=token, refresh_token=refresh, token_type="bearer")
 
 
+def check_throttle(*keys: str):
+    """
+    Refuse the login outright if any key has failed too often lately.
+    """
+    if (wait := phantasm.THROTTLE.retry_after(*keys)) > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed logins. Try again later.",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
 async def handle_login(
-    request: Request, password: str, user: uuid.UUID
+    request: Request, password: str, user: uuid.UUID, keys: tuple[str, ...] = ()
 ) -> TokenResponse:
+    """
+    Verify a user's password. keys are the throttle keys the caller already checked;
+    the user's own key is added to them here, still before anything is hashed.
+    """
     ip = get_real_ip(request)
-    user_agent = request.headers.get("User-Agent", None)
+    user_agent = request.headers.get("User-Agent", "")
+    keys = (*keys, f"user:{user}")
+    check_throttle(*keys)
 
-    async with phantasm.PGPOOL.acquire() as conn:
-        async with conn.transaction():
+    with phantasm.THROTTLE.attempt(*keys):
+        async with phantasm.PGPOOL.acquire() as conn:
             # Retrieve the latest password row for this user.
             password_row = await conn.fetchrow(
                 """
@@ -86,24 +110,14 @@ async def handle_login(
                 """,
                 user,
             )
-            if not (
+            # Hashed off the event loop, which argon2 would otherwise stall.
+            success = bool(
                 password_row
                 and password_row["password"]
-                and crypt_context.verify(password, password_row["password"])
-            ):
-                await conn.execute(
-                    """
-                    INSERT INTO loginrecords (user_id, ip_address, success, user_agent)
-                    VALUES ($1, $2, $3, $4)
-                    """,
-                    user,
-                    ip,
-                    False,
-                    user_agent,
+                and await asyncio.to_thread(
+                    crypt_context.verify, password, password_row["password"]
                 )
-                raise HTTPException(status_code=400, detail="Invalid credentials.")
-
-            # Record successful login.
+            )
             await conn.execute(
                 """
                 INSERT INTO loginrecords (user_id, ip_address, success, user_agent)
@@ -111,9 +125,15 @@ async def handle_login(
                 """,
                 user,
                 ip,
-                True,
+                success,
                 user_agent,
             )
+            if not success:
+                await phantasm.THROTTLE.record_failure(conn, *keys)
+                raise HTTPException(status_code=400, detail="Invalid credentials.")
+            await phantasm.THROTTLE.record_success(
+                conn, *(k for k in keys if not k.startswith("ip:"))
+            )
 
     # Create tokens based on the user's email.
     return TokenResponse.from_uuid(user)
@@ -164,10 +184,10 @@ async def register_user(email: str, hashed_password: str) -> uuid.UUID:
 async def register(request: Request, data: Annotated[UserLogin, Depends()]):
     data.password = data.password.strip()
     ip = get_real_ip(request)
-    user_agent = request.headers.get("User-Agent", None)
+    user_agent = request.headers.get("User-Agent", "")
 
     try:
-        hashed = crypt_context.hash(data.password)
+        hashed = await asyncio.to_thread(crypt_context.hash, data.password)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Error hashing password."
@@ -183,6 +203,8 @@ async def login(
     request: Request, data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ):
     data.password = data.password.strip()
+    keys = (f"ip:{get_real_ip(request)}", f"email:{data.username.lower().strip()}")
+    check_throttle(*keys)
 
     async with phantasm.PGPOOL.acquire() as conn:
         if not (
@@ -190,9 +212,10 @@ async def login(
                 "SELECT id FROM users WHERE email = $1", data.username
             )
         ):
+            await phantasm.THROTTLE.record_failure(conn, *keys)
             raise HTTPException(status_code=400, detail="Invalid credentials.")
 
-    return await handle_login(request, data.password, user["id"])
+    return await handle_login(request, data.password, user["id"], keys)
 
 
 class CharacterLogin(BaseModel):
@@ -208,25 +231,25 @@ class CharacterTokenResponse(TokenResponse):
 async def login(request: Request, data: Annotated[CharacterLogin, Depends()]):
     data.name = data.name.lower().strip()
     data.password = data.password.strip()
+    ip_key = f"ip:{get_real_ip(request)}"
+    check_throttle(ip_key)
 
-    async with phantasm.PGPOOL.acquire() as conn:
-        character_row = await conn.fetchrow(
-            """
-            SELECT c.id,c.user_id
-            FROM characters c
-            WHERE c.name = $1
-            """,
-            data.name,
-        )
-    if not character_row:
+    if not (character := phantasm.NAMES.find(data.name)):
+        async with phantasm.PGPOOL.acquire() as conn:
+            await phantasm.THROTTLE.record_failure(conn, ip_key)
         raise HTTPException(status_code=400, detail="Invalid credentials.")
 
-    result = await handle_login(request, data.password, character_row["user_id"])
-    return CharacterTokenResponse(character=character_row["id"], **result.dict())
+    result = await handle_login(request, data.password, character.user_id, (ip_key,))
+    return CharacterTokenResponse(character=character.id, **result.dict())
 
 
 @router.post("/refresh", response_model=TokenResponse)
 async def refresh_token(ref: str):
+    """
+    Trade a refresh token for a new access and refresh token. Each refresh token works
+    once. Presenting one that was already used means it leaked, so every token of
+    that user is revoked.
+    """
     jwt_settings = mudpy.SETTINGS["JWT"]
     try:
         payload = jwt.decode(
@@ -237,21 +260,70 @@ async def refresh_token(ref: str):
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token."
         )
         # Get user identifier from token. For example:
-    if not payload.get("refresh", False):
+    if not payload.get("refresh", False) or phantasm.REVOCATIONS.logged_out(payload):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token."
         )
-    if (sub := payload.get("sub", None)) is None:
+    # Reuse of a rotated token is caught by the insert below, so that it still logs the
+    # user out everywhere even if this worker already knows the token is revoked.
+    if (sub := payload.get("sub", None)) is None or (
+        jti := payload.get("jti", None)
+    ) is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload."
         )
     async with phantasm.PGPOOL.acquire() as conn:
-        if not (
-            user_row := await conn.fetchrow("SELECT id FROM users WHERE id = $1", sub)
-        ):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token payload.",
-            )
+        async with conn.transaction():
+            try:
+                rotated = await conn.fetchval(
+                    """
+                    INSERT INTO refresh_tokens_revoked (jti, user_id, expires_at)
+                    VALUES ($1, $2, to_timestamp($3))
+                    ON CONFLICT (jti) DO NOTHING
+                    RETURNING jti
+                    """,
+                    uuid.UUID(jti),
+                    uuid.UUID(sub),
+                    payload["exp"],
+                )
+            except (ValueError, exceptions.ForeignKeyViolationError):
+                # Not a UUID, or the user no longer exists.
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid token payload.",
+                )
+            if rotated is None:
+                await logout_everywhere(conn, sub)
+            else:
+                await publish(conn, "token.revoked", jti=jti, expires=payload["exp"])
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token."
+        )
 
     return TokenResponse.from_uuid(sub)
+
+
+async def logout_everywhere(conn: asyncpg.Connection, user_id: str):
+    after = await conn.fetchval(
+        """
+        UPDATE users SET tokens_valid_after = now()
+        WHERE id = $1
+        RETURNING EXTRACT(EPOCH FROM tokens_valid_after)
+        """,
+        uuid.UUID(user_id),
+    )
+    await publish(conn, "token.logout_all", user_id=user_id, after=float(after))
+
+
+@router.post("/logout_all")
+async def logout_all(
+    user: Annotated[UserModel, Depends(get_current_user)], db: RequestConnection
+):
+    """
+    Revoke every access and refresh token issued to this user so far.
+    """
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            await logout_everywhere(conn, str(user.id))
+    return {"logged_out": True}
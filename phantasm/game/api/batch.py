@@ -0,0 +1,179 @@
+import inspect
+import logging
+import typing
+from typing import Annotated, Optional
+from urllib.parse import urlencode
+
+import mudpy
+import orjson
+import pydantic
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+from .utils import get_current_user, RequestConnection, RequestDB, BATCH_USER, BATCH_DB
+from .models import UserModel
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Route-specific keys of the batch request's own scope, which sub-requests must not inherit.
+ROUTE_SCOPE_KEYS = (
+    "router",
+    "endpoint",
+    "route",
+    "path_params",
+    "fastapi_inner_astack",
+    "fastapi_function_astack",
+)
+
+# Headers which describe the batch request's own body or encoding.
+BODY_HEADERS = (b"content-length", b"content-type", b"accept-encoding")
+
+
+class BatchOperation(pydantic.BaseModel):
+    method: str = "GET"
+    # A path as the routers serve it, like "/boards/new". It may carry a query string.
+    path: str
+    query: dict[str, typing.Any] = pydantic.Field(default_factory=dict)
+    body: Optional[typing.Any] = None
+
+
+class BatchRequest(pydantic.BaseModel):
+    operations: list[BatchOperation]
+    # Run every operation in one transaction, stopping and rolling back at the first
+    # operation which fails.
+    atomic: bool = False
+
+
+class BatchResult(pydantic.BaseModel):
+    status: int
+    body: typing.Any = None
+
+
+def max_operations() -> int:
+    return mudpy.SETTINGS["GAME"].get("batch", dict()).get("max_operations", 100)
+
+
+def exception_handler(request: Request, err: Exception) -> Optional[typing.Callable]:
+    """
+    The app's handler for err, looked up the way Starlette's ExceptionMiddleware does:
+    by status code for HTTP errors, then by the exception's class and its bases.
+    """
+    handlers = request.app.exception_handlers
+    if isinstance(err, StarletteHTTPException) and err.status_code in handlers:
+        return handlers[err.status_code]
+    for cls in type(err).__mro__:
+        if cls in handlers:
+            return handlers[cls]
+    return None
+
+
+async def dispatch(
+    request: Request, op: BatchOperation, user: UserModel, db: RequestDB
+) -> BatchResult:
+    """
+    Run one operation through the app's router, skipping middleware. The sub-request
+    is handed the batch's user and RequestDB through its scope, so it neither decodes
+    the token again nor takes another connection.
+    """
+    path, _, query_string = op.path.partition("?")
+    if op.query:
+        extra = urlencode(op.query, doseq=True)
+        query_string = f"{query_string}&{extra}" if query_string else extra
+    body = b"" if op.body is None else orjson.dumps(op.body)
+    headers = [(k, v) for k, v in request.scope["headers"] if k not in BODY_HEADERS]
+    if op.body is not None:
+        headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {k: v for k, v in request.scope.items() if k not in ROUTE_SCOPE_KEYS}
+    scope.update(
+        {
+            "method": op.method.upper(),
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string.encode(),
+            "headers": headers,
+            BATCH_USER: user,
+            BATCH_DB: db,
+        }
+    )
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    result = {"status": status.HTTP_500_INTERNAL_SERVER_ERROR}
+    chunks = list()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+            result["content_type"] = dict(message.get("headers", ())).get(b"content-type", b"")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await request.app.router(scope, receive, send)
+    except Exception as err:
+        # Errors the router raises itself, like unknown paths and methods or requests
+        # which fail validation, are turned into responses by the app's exception
+        # handlers, the same ones the middleware the batch skips would have used.
+        if (handler := exception_handler(request, err)) is None:
+            logger.exception("Batch operation %s %s failed.", op.method, op.path)
+            return BatchResult(
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                body={"detail": "Internal Server Error"},
+            )
+        sub_request = Request(scope, receive)
+        if inspect.iscoroutinefunction(handler):
+            response = await handler(sub_request, err)
+        else:
+            response = await run_in_threadpool(handler, sub_request, err)
+        chunks.clear()
+        await response(scope, receive, send)
+    data = b"".join(chunks)
+    if not data:
+        out = None
+    elif result.get("content_type", b"").startswith(b"application/json"):
+        out = orjson.loads(data)
+    else:
+        out = data.decode("utf-8", errors="replace")
+    return BatchResult(status=result["status"], body=out)
+
+
+@router.post("/", response_model=list[BatchResult])
+async def run_batch(
+    request: Request,
+    batch: BatchRequest,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    """
+    Run many API operations in one request: the token is checked once, each acting
+    character is resolved once, and every operation shares one database connection.
+    Results come back in order, each with its status and JSON body.
+
+    Without atomic, operations run one after another and each commits on its own. With
+    atomic, they run in one transaction; the first to fail rolls everything back and
+    the batch fails with that operation's status, and a detail holding its index and
+    the results so far.
+    """
+    if len(batch.operations) > max_operations():
+        raise HTTPException(status_code=400, detail="Too many operations in one batch.")
+    for op in batch.operations:
+        if not op.path.startswith("/") or op.path.split("?")[0].rstrip("/") == "/batch":
+            raise HTTPException(status_code=400, detail=f"Invalid batch path: {op.path}")
+    if batch.atomic:
+        await db.begin()
+    results = list()
+    for index, op in enumerate(batch.operations):
+        result = await dispatch(request, op, user, db)
+        results.append(result)
+        if batch.atomic and result.status >= 400:
+            raise HTTPException(
+                status_code=result.status,
+                detail={"failed": index, "results": [r.model_dump() for r in results]},
+            )
+    return results
@@ -10,6 +10,7 @@ import jwt
 import uuid
 import phantasm
 import pydantic
+import asyncpg
 
 from tortoise.expressions import RawSQL
 from tortoise.transactions import in_transaction
@@ -25,10 +26,15 @@ from .utils import (
     get_real_ip,
     get_current_user,
     get_acting_character,
+    get_acting_read_pool,
+    mark_write,
+    RequestConnection,
 )
+from phantasm.game.events import publish, event_filter, Subscription
 from .models import (
     BoardModel,
     PostModel,
+    NewPostModel,
     FactionModel,
     ActiveAs,
     UserModel,
@@ -39,6 +45,99 @@ router = APIRouter()
 
 RE_BOARD_ID = re.compile(r"^(?P<abbr>[a-zA-Z]+)?(?P<order>\d+)$")
 
+POST_SELECT = """
+SELECT p.id, p.post_key, p.title, p.body, p.created_at,
+       p.updated_at AS modified_at, p.spoofed_name, p.character_id, p.character_name
+FROM board_post_view_full p
+"""
+
+# Inserts a post and marks it read for its author in one statement. With $4 null it
+# starts a new thread numbered after the board's last; otherwise it replies to the
+# post keyed $4, numbered after the last reply in that thread and titled after it.
+# Returns nothing if the post replied to doesn't exist. Run it through insert_post.
+POST_INSERT = """
+WITH parent AS (
+    SELECT post_order, title
+    FROM board_post_view
+    WHERE board_id = $1 AND post_key = $4
+), numbered AS (
+    SELECT coalesce(max(post_order), 0) + 1 AS post_order, 0 AS sub_order, $2::text AS title
+    FROM board_posts
+    WHERE board_id = $1
+    HAVING $4::text IS NULL
+    UNION ALL
+    SELECT parent.post_order,
+           (SELECT max(sub_order) + 1
+            FROM board_posts
+            WHERE board_id = $1 AND post_order = parent.post_order),
+           'RE: ' || parent.title
+    FROM parent
+), p AS (
+    INSERT INTO board_posts (board_id, title, body, post_order, sub_order, spoof_id)
+    SELECT $1, n.title, $3, n.post_order, n.sub_order, $5
+    FROM numbered n
+    RETURNING *
+), r AS (
+    INSERT INTO board_posts_read (post_id, user_id)
+    SELECT p.id, $6 FROM p
+    ON CONFLICT (user_id, post_id) DO NOTHING
+)
+SELECT p.*,
+       CASE
+           WHEN p.sub_order = 0 THEN p.post_order::text
+           ELSE p.post_order::text || '.' || p.sub_order::text
+           END AS post_key
+FROM p
+"""
+
+# POST_INSERT numbers its post from what its snapshot holds, so two posts to a board
+# at once would both take the same number. Locking the board row first makes them
+# queue, and the statement run once the lock is granted sees the previous post. NO
+# KEY UPDATE leaves the board's foreign key checks unblocked.
+BOARD_LOCK = "SELECT id FROM boards WHERE id = $1 FOR NO KEY UPDATE"
+
+
+async def insert_post(
+    conn: asyncpg.Connection,
+    board_id: int,
+    title: Optional[str],
+    body: str,
+    post_key: Optional[str],
+    acting: ActiveAs,
+) -> Optional[asyncpg.Record]:
+    """
+    Insert a post or reply with POST_INSERT, one at a time per board. Call it inside
+    a transaction, which holds the board's lock until it ends.
+    """
+    await conn.execute(BOARD_LOCK, board_id)
+    try:
+        return await conn.fetchrow(
+            POST_INSERT, board_id, title, body, post_key, acting.spoofing_id, acting.user.id
+        )
+    except exceptions.UniqueViolationError:
+        # Only posts written around insert_post, by an import say, can get here.
+        raise HTTPException(
+            status_code=409, detail="Another post took that number; try again."
+        )
+
+
+@event_filter("board.created")
+@event_filter("board.post")
+async def filter_board_event(
+    event: dict, subscribers: list[Subscription]
+) -> list[Subscription]:
+    """
+    Board events reach only the characters who can read the board.
+    """
+    async with phantasm.PGPOOL.acquire() as conn:
+        board_data = await conn.fetchrow(
+            "SELECT * FROM board_view WHERE id = $1", event["board_id"]
+        )
+    if board_data is None:
+        return []
+    board = BoardModel(**board_data)
+    return [s for s in subscribers if await board.access(s.acting, "read")]
+
 
 class BoardCreate(BaseModel):
     name: str
@@ -52,16 +151,17 @@ class BoardCreate(BaseModel):
 async def create_board(
     board: Annotated[BoardCreate, Depends()],
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     character_id: int,
 ):
-    acting = await get_acting_character(user, character_id)
+    acting = await get_acting_character(user, character_id, db)
     if not (matched := RE_BOARD_ID.match(board.board_key)):
         raise HTTPException(status_code=400, detail="Invalid board ID format.")
     order = int(matched.group("order"))
     faction = None
     board_data = None
     faction_data = None
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with db.acquire() as conn:
         if abbr := matched.group("abbr"):
             if not (
                 faction_data := await conn.fetchrow(
@@ -100,16 +200,27 @@ async def create_board(
         board_data = await conn.fetchrow(
             "SELECT * FROM board_view WHERE id = $1", board_row["id"]
         )
+        await publish(
+            conn,
+            "board.created",
+            board_id=board_row["id"],
+            board_key=board_data["board_key"],
+            name=board_data["name"],
+        )
+    mark_write(user, db)
     return BoardModel(**board_data)
 
 
 @router.get("/", response_model=typing.List[BoardModel])
 async def list_boards(
-    user: Annotated[UserModel, Depends(get_current_user)], character_id: int
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
 ):
-    acting = await get_acting_character(user, character_id)
+    acting = await get_acting_character(user, character_id, db)
     boards = []
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with pool.acquire() as conn:
         for board_data in await conn.fetch("SELECT * FROM board_view"):
             board = BoardModel(**board_data)
             if await board.access(acting, "read"):
@@ -117,14 +228,126 @@ async def list_boards(
     return boards
 
 
+def mask_post(post: PostModel, board: BoardModel, admin: bool):
+    """
+    Hide who wrote a post on an anonymous board, except from its admins.
+    """
+    if not admin:
+        post.spoofed_name = board.anonymous_name
+        post.character_id = None
+        post.character_name = None
+    else:
+        post.spoofed_name = f"{board.anonymous_name} ({post.spoofed_name})"
+
+
+async def readable_boards(
+    conn: asyncpg.Connection, acting: ActiveAs
+) -> dict[int, tuple[BoardModel, bool]]:
+    """
+    Every board the acting character may read, by id, with whether they administer it.
+    """
+    out = dict()
+    for board_data in await conn.fetch("SELECT * FROM board_view"):
+        board = BoardModel(**board_data)
+        admin = await board.access(acting, "admin")
+        if admin or await board.access(acting, "read"):
+            out[board.id] = (board, admin)
+    return out
+
+
+@router.get("/new", response_model=list[NewPostModel])
+async def list_new_posts(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
+    before: Optional[int] = None,
+    limit: int = 50,
+):
+    """
+    Unread posts on every board the character can read, newest first.
+    For the next page, pass the id of the last post returned as `before`.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
+        boards = await readable_boards(conn, acting)
+        if not boards:
+            return []
+        posts_data = await conn.fetch(
+            """
+            SELECT p.id, p.post_key, p.title, p.body, p.created_at,
+                   p.updated_at AS modified_at, p.spoofed_name, p.character_id,
+                   p.character_name, p.board_id, p.board_key, p.board_name
+            FROM board_post_view_full p
+            WHERE p.board_id = ANY($1::int[])
+              AND ($3::bigint IS NULL OR p.id < $3)
+              AND NOT EXISTS (SELECT 1
+                              FROM board_posts_read r
+                              WHERE r.user_id = $2
+                                AND r.post_id = p.id)
+            ORDER BY p.id DESC
+            LIMIT $4
+            """,
+            list(boards),
+            acting.user.id,
+            before,
+            min(max(limit, 1), 200),
+        )
+    posts = list()
+    for post_data in posts_data:
+        post = NewPostModel(**post_data)
+        board, admin = boards[post_data["board_id"]]
+        if board.anonymous_name:
+            mask_post(post, board, admin)
+        posts.append(post)
+    return posts
+
+
+class MarkRead(BaseModel):
+    post_ids: list[int]
+
+
+@router.post("/new/read")
+async def mark_posts_read(
+    data: MarkRead,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Mark posts read, skipping any on boards the character can't read.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
+        boards = await readable_boards(conn, acting)
+        marked = await conn.fetch(
+            """
+            INSERT INTO board_posts_read (post_id, user_id)
+            SELECT p.id, $2
+            FROM board_posts p
+            WHERE p.id = ANY($1::bigint[])
+              AND p.board_id = ANY($3::int[])
+            ON CONFLICT (user_id, post_id) DO NOTHING
+            RETURNING post_id
+            """,
+            data.post_ids,
+            acting.user.id,
+            list(boards),
+        )
+    mark_write(user, db)
+    return {"marked": [row["post_id"] for row in marked]}
+
+
 @router.get("/{board_key}", response_model=BoardModel)
 async def get_board(
     board_key: str,
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
         board_data = await conn.fetchrow(
             "SELECT * FROM board_view WHERE board_key = $1", board_key
         )
@@ -142,10 +365,12 @@ async def get_board(
 async def list_posts(
     board_key: str,
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
         board_data = await conn.fetchrow(
             "SELECT * FROM board_view WHERE board_key = $1", board_key
         )
@@ -160,17 +385,13 @@ async def list_posts(
                     detail="You do not have permission to read this board.",
                 )
         posts_data = await conn.fetch(
-            "SELECT * FROM board_post_view WHERE board_id = $1", board.id
+            f"{POST_SELECT} WHERE p.board_id = $1 ORDER BY p.post_order, p.sub_order",
+            board.id,
         )
         posts = [PostModel(**post) for post in posts_data]
         if board.anonymous_name:
-            if not admin:
-                for post in posts:
-                    post.spoofed_name = board.anonymous_name
-                    post.character_id = None
-                    post.character_name = None
-                else:
-                    post.spoofed_name = f"{board.anonymous_name} ({post.spoofed_name})"
+            for post in posts:
+                mask_post(post, board, admin)
         return posts
 
 
@@ -179,10 +400,12 @@ async def get_post(
     board_key: str,
     post_key: str,
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
         board_data = await conn.fetchrow(
             "SELECT * FROM board_view WHERE board_key = $1", board_key
         )
@@ -197,7 +420,7 @@ async def get_post(
                     detail="You do not have permission to read this board.",
                 )
         post_data = await conn.fetchrow(
-            "SELECT * FROM board_post_view WHERE board_id = $1 AND post_key = $2",
+            f"{POST_SELECT} WHERE p.board_id = $1 AND p.post_key = $2",
             board.id,
             post_key,
         )
@@ -205,15 +428,23 @@ async def get_post(
             raise HTTPException(status_code=404, detail="Post not found.")
         post = PostModel(**post_data)
         if board.anonymous_name:
-            if not admin:
-                post.spoofed_name = board.anonymous_name
-                post.character_id = None
-                post.character_name = None
-            else:
-                post.spoofed_name = f"{board.anonymous_name} ({post.spoofed_name})"
+            mask_post(post, board, admin)
         return post
 
 
+def authored_post(post_data: asyncpg.Record, acting: ActiveAs) -> PostModel:
+    """
+    A post just written by the acting character, as its author sees it.
+    """
+    return PostModel(
+        modified_at=post_data["updated_at"],
+        spoofed_name=acting.spoofed_name,
+        character_id=acting.character.id,
+        character_name=acting.character.name,
+        **post_data,
+    )
+
+
 class PostCreate(BaseModel):
     title: str
     body: str
@@ -224,10 +455,11 @@ async def create_post(
     board_key: str,
     post: PostCreate,
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     character_id: int,
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
         async with conn.transaction():
             board_data = await conn.fetchrow(
                 "SELECT * FROM board_view WHERE board_key = $1", board_key
@@ -240,27 +472,19 @@ async def create_post(
                     status_code=403,
                     detail="You do not have permission to write to this board.",
                 )
-            max_order = await conn.fetchval(
-                "SELECT MAX(post_order) FROM board_posts WHERE board_id = $1", board.id
-            )
-            post_data = await conn.fetchrow(
-                "INSERT INTO board_posts (board_id, title, body, post_order, sub_order, spoof_id) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id",
-                board.id,
-                post.title,
-                post.body,
-                max_order + 1,
-                0,
-                acting.spoofing_id,
+            post_data = await insert_post(
+                conn, board.id, post.title, post.body, None, acting
             )
-            read = await conn.fetchrow(
-                "INSERT INTO board_posts_read (post_id, user_id) VALUES ($1, $2) RETURNING id",
-                post_data["id"],
-                acting.user.id,
+            await publish(
+                conn,
+                "board.post",
+                board_id=board.id,
+                board_key=board.board_key,
+                post_key=post_data["post_key"],
+                title=post_data["title"],
             )
-            post_data = await conn.fetchrow(
-                "SELECT * FROM board_post_view WHERE id = $1", post_data["id"]
-            )
-            return PostModel(**post_data)
+    mark_write(user, db)
+    return authored_post(post_data, acting)
 
 
 class ReplyCreate(BaseModel):
@@ -276,10 +500,11 @@ async def create_reply_post(
     post_key: str,
     reply: ReplyCreate,
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     character_id: int,
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
         async with conn.transaction():
             board_data = await conn.fetchrow(
                 "SELECT * FROM board_view WHERE board_key = $1", board_key
@@ -292,34 +517,16 @@ async def create_reply_post(
                     status_code=403,
                     detail="You do not have permission to write to this board.",
                 )
-            post_data = await conn.fetchrow(
-                "SELECT * FROM board_post_view WHERE board_id = $1 AND post_key = $2",
-                board.id,
-                post_key,
-            )
+            post_data = await insert_post(conn, board.id, None, reply.body, post_key, acting)
             if post_data is None:
                 raise HTTPException(status_code=404, detail="Post not found.")
-            post = PostModel(**post_data)
-            sub_order = await conn.fetchval(
-                "SELECT MAX(sub_order) FROM board_posts WHERE board_id = $1 AND post_order = $2",
-                board.id,
-                post.order,
-            )
-            post_data = await conn.fetchrow(
-                "INSERT INTO board_posts (board_id, title, body, post_order, sub_order, spoof_id) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id",
-                board.id,
-                f"RE: {post.title}",
-                reply.body,
-                post.order,
-                sub_order + 1,
-                acting.spoofing_id,
-            )
-            read = await conn.fetchrow(
-                "INSERT INTO board_posts_read (post_id, user_id) VALUES ($1, $2) RETURNING id",
-                post_data["id"],
-                acting.user.id,
-            )
-            post_data = await conn.fetchrow(
-                "SELECT * FROM board_post_view WHERE id = $1", post_data["id"]
+            await publish(
+                conn,
+                "board.post",
+                board_id=board.id,
+                board_key=board.board_key,
+                post_key=post_data["post_key"],
+                title=post_data["title"],
             )
-            return PostModel(**post_data)
+    mark_write(user, db)
+    return authored_post(post_data, acting)
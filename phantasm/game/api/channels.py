@@ -0,0 +1,213 @@
+from typing import Annotated, Optional
+
+import asyncpg
+import phantasm
+import pydantic
+
+from asyncpg import exceptions
+from fastapi import APIRouter, Depends, HTTPException
+
+from phantasm.game.events import publish, event_filter, Subscription
+from phantasm.game.channels import normalize_alias
+from .utils import (
+    get_current_user,
+    get_acting_character,
+    get_acting_read_pool,
+    mark_write,
+    RequestConnection,
+)
+from .models import UserModel, ChannelModel, ActiveAs
+
+router = APIRouter()
+
+CHANNEL_SELECT = """
+SELECT ch.*,
+       m.id IS NOT NULL AS member,
+       coalesce(m.listening, FALSE) AS listening,
+       coalesce(m.aliases, '{}') AS aliases
+FROM channels ch
+         LEFT JOIN channel_members m ON m.channel_id = ch.id AND m.character_id = $1
+"""
+
+
+@event_filter("channel.aliases")
+async def filter_channel_aliases(
+    event: dict, subscribers: list[Subscription]
+) -> list[Subscription]:
+    """
+    Alias changes only go to sessions of the character they belong to.
+    """
+    return [s for s in subscribers if s.acting.character.id == event["character_id"]]
+
+
+async def aliases_changed(
+    conn: asyncpg.Connection,
+    acting: ActiveAs,
+    channel_id: int,
+    aliases: Optional[list[str]],
+):
+    await publish(
+        conn,
+        "channel.aliases",
+        character_id=acting.character.id,
+        channel_id=channel_id,
+        aliases=aliases,
+    )
+
+
+@router.get("/", response_model=list[ChannelModel])
+async def list_channels(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
+):
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            CHANNEL_SELECT + " ORDER BY ch.category, ch.name", acting.character.id
+        )
+    return [ChannelModel(**row) for row in rows]
+
+
+@router.get("/aliases", response_model=dict[str, int])
+async def get_aliases(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Every channel alias of the acting character, lowercase, mapped to its channel id.
+    Clients keep this and apply "channel.aliases" events to it.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    return phantasm.CHANNELS.by_character.get(acting.character.id, dict())
+
+
+@router.get("/resolve")
+async def resolve_alias(
+    alias: str,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    The channel the acting character means by alias, from memory.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    if (channel_id := phantasm.CHANNELS.resolve(acting.character.id, alias)) is None:
+        raise HTTPException(status_code=404, detail="No channel has that alias.")
+    return {"alias": normalize_alias(alias), "channel_id": channel_id}
+
+
+class ChannelJoin(pydantic.BaseModel):
+    listening: Optional[bool] = None
+    aliases: Optional[list[str]] = None
+
+
+def check_aliases(acting: ActiveAs, channel_id: int, aliases: list[str]) -> list[str]:
+    """
+    Normalize aliases, refusing blank ones, ones with spaces and ones the character
+    already uses for another channel.
+    """
+    out = list()
+    for alias in aliases:
+        alias = normalize_alias(alias)
+        if not alias or any(c.isspace() for c in alias):
+            raise HTTPException(status_code=400, detail="Aliases must be single words.")
+        other = phantasm.CHANNELS.resolve(acting.character.id, alias)
+        if other is not None and other != channel_id:
+            raise HTTPException(
+                status_code=409, detail=f"Alias '{alias}' is already used for another channel."
+            )
+        if alias not in out:
+            out.append(alias)
+    return out
+
+
+@router.put("/{channel_id}/membership", response_model=ChannelModel)
+async def join_channel(
+    channel_id: int,
+    data: ChannelJoin,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Join a channel, or change whether the character listens to it and its aliases.
+    Fields left out keep their current values (or defaults, on joining).
+    """
+    acting = await get_acting_character(user, character_id, db)
+    aliases = None
+    if data.aliases is not None:
+        aliases = check_aliases(acting, channel_id, data.aliases)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            row = await conn.fetchrow(
+                CHANNEL_SELECT + " WHERE ch.id = $2", acting.character.id, channel_id
+            )
+            if row is None:
+                raise HTTPException(status_code=404, detail="Channel not found.")
+            channel = ChannelModel(**row)
+            if (
+                not channel.member
+                and channel.lock_data.get("join")
+                and acting.admin_level < 1
+                and not await channel.access(acting, "join")
+            ):
+                raise HTTPException(
+                    status_code=403, detail="You do not have permission to join this channel."
+                )
+            try:
+                member = await conn.fetchrow(
+                    """
+                    INSERT INTO channel_members (channel_id, character_id, listening, aliases)
+                    VALUES ($1, $2, coalesce($3::boolean, TRUE), coalesce($4::text[], '{}'))
+                    ON CONFLICT (character_id, channel_id)
+                        DO UPDATE SET listening  = coalesce($3::boolean, channel_members.listening),
+                                      aliases    = coalesce($4::text[], channel_members.aliases),
+                                      updated_at = now()
+                    RETURNING listening, aliases
+                    """,
+                    channel_id,
+                    acting.character.id,
+                    data.listening,
+                    aliases,
+                )
+            except exceptions.ForeignKeyViolationError:
+                raise HTTPException(status_code=404, detail="Channel not found.")
+            if not channel.member or aliases is not None:
+                await aliases_changed(conn, acting, channel_id, member["aliases"])
+    # The event updates every worker, this one included, once it arrives; don't let
+    # this character's next line beat it.
+    db.after_commit(
+        lambda: phantasm.CHANNELS.set(acting.character.id, channel_id, member["aliases"])
+    )
+    mark_write(user, db)
+    channel.member = True
+    channel.listening = member["listening"]
+    channel.aliases = member["aliases"]
+    return channel
+
+
+@router.delete("/{channel_id}/membership")
+async def leave_channel(
+    channel_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            deleted = await conn.fetchval(
+                "DELETE FROM channel_members WHERE channel_id = $1 AND character_id = $2 RETURNING id",
+                channel_id,
+                acting.character.id,
+            )
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Not a member of that channel.")
+            await aliases_changed(conn, acting, channel_id, None)
+    db.after_commit(lambda: phantasm.CHANNELS.set(acting.character.id, channel_id, None))
+    mark_write(user, db)
+    return {"left": channel_id}
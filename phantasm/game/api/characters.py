@@ -8,6 +8,8 @@ import jwt
 import uuid
 import phantasm
 import pydantic
+import asyncpg
+import time
 
 from asyncpg import exceptions
 from fastapi import APIRouter, Depends, HTTPException, status, Request
@@ -19,20 +21,39 @@ from .utils import (
     get_real_ip,
     get_current_user,
     get_acting_character,
+    get_acting_read_pool,
+    get_read_pool,
+    mark_write,
+    RequestConnection,
 )
-from .models import UserModel, CharacterModel, ActiveAs
+from .models import UserModel, CharacterModel, CharacterNameModel, PresenceModel, ActiveAs
+from phantasm.game.names import AmbiguousName
+from phantasm.game.events import publish, event_filter, Subscription
 
 router = APIRouter()
 
 
+@event_filter("character.active")
+async def filter_character_event(
+    event: dict, subscribers: list[Subscription]
+) -> list[Subscription]:
+    """
+    Changes to an active character only go to sessions of the same user.
+    """
+    return [s for s in subscribers if str(s.acting.user.id) == event["user_id"]]
+
+
 @router.get("/", response_model=typing.List[CharacterModel])
-async def get_characters(user: Annotated[UserModel, Depends(get_current_user)]):
+async def get_characters(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
     if not user.admin_level > 0:
         raise HTTPException(
             status_code=403, detail="You do not have permission to view all characters."
         )
 
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with pool.acquire() as conn:
         characters = await conn.fetch(
             "SELECT * FROM characters WHERE user_id = $1", user.id
         )
@@ -42,10 +63,13 @@ async def get_characters(user: Annotated[UserModel, Depends(get_current_user)]):
 
 @router.get("/active", response_model=typing.List[CharacterModel])
 async def get_characters_active(
-    user: Annotated[UserModel, Depends(get_current_user)], character_id: int
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
         characters = await conn.fetch(
             "SELECT * FROM characters_active_view WHERE user_id = $1", user.id
         )
@@ -53,70 +77,179 @@ async def get_characters_active(
     return [CharacterModel(**c) for c in characters]
 
 
+@router.get("/who", response_model=typing.List[PresenceModel])
+async def who(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Everyone online, from the in-memory presence registry. Whether to show the real
+    names comes from the registry too; the database is only asked about a character
+    which isn't online yet.
+    """
+    presence = phantasm.PRESENCE.online.get(character_id, None)
+    if presence is not None and presence.user_id == user.id:
+        admin = presence.admin_level > 0
+    else:
+        acting = await get_acting_character(user, character_id, db)
+        admin = acting.admin_level > 0
+    now = time.time()
+    return [
+        PresenceModel(
+            spoofed_name=p.spoofed_name,
+            online_seconds=now - p.connected_at,
+            idle_seconds=now - p.last_seen,
+            character_id=p.character_id if admin else None,
+            name=p.name if admin else None,
+        )
+        for p in phantasm.PRESENCE.who()
+    ]
+
+
+@router.post("/active/{character_id}/heartbeat", response_model=ActiveAs)
+async def heartbeat(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Keeps an otherwise idle client's character online.
+    """
+    return await get_acting_character(user, character_id, db)
+
+
+@router.delete("/active/{character_id}")
+async def deactivate_character(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            deleted = await conn.fetchval(
+                """
+                DELETE FROM characters_active a
+                USING characters c
+                WHERE a.id = c.id AND a.id = $1 AND c.user_id = $2
+                RETURNING a.id
+                """,
+                character_id,
+                user.id,
+            )
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Character is not active.")
+            await publish(conn, "presence.left", character_ids=[character_id])
+    db.after_commit(lambda: phantasm.PRESENCE.online.pop(character_id, None))
+    db.acting.pop(character_id, None)
+    return {"deactivated": character_id}
+
+
 class ActiveUpdate(pydantic.BaseModel):
     admin_level: Optional[int] = None
     spoofed_name: Optional[str] = None
     metadata: Optional[dict[typing.Any, typing.Any]] = None
 
 
+# Applies whichever of admin_level, metadata and spoofed name are not null in one
+# statement, creating the spoof on first use. get_acting_character has already
+# touched last_active_at.
+ACTIVE_UPDATE = """
+WITH spoof AS (
+    INSERT INTO character_spoofs (character_id, spoofed_name)
+    SELECT $1, $4::citext WHERE $4::citext IS NOT NULL
+    ON CONFLICT (character_id, spoofed_name)
+        DO UPDATE SET updated_at = character_spoofs.updated_at
+    RETURNING id, spoofed_name
+), updated AS (
+    UPDATE characters_active a
+    SET admin_level = coalesce($2::int, a.admin_level),
+        metadata    = coalesce($3::jsonb, a.metadata),
+        spoofing_id = coalesce((SELECT id FROM spoof), a.spoofing_id)
+    WHERE a.id = $1
+    RETURNING a.admin_level, a.metadata, a.spoofing_id
+)
+SELECT u.*, coalesce(spoof.spoofed_name, s.spoofed_name) AS spoofed_name
+FROM updated u
+         LEFT JOIN spoof ON spoof.id = u.spoofing_id
+         LEFT JOIN character_spoofs s ON s.id = u.spoofing_id
+"""
+
+
 @router.patch("/active/{character_id}", response_model=ActiveAs)
 async def set_active_character(
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     update: Annotated[ActiveUpdate, Depends()],
     character_id: int,
 ):
-    acting = await get_acting_character(user, character_id)
-    async with phantasm.PGPOOL.acquire() as conn:
+    acting = await get_acting_character(user, character_id, db)
+    admin_level = None
+    if update.admin_level is not None:
+        admin_level = min(user.admin_level, update.admin_level)
+    spoofed_name = None
+    if update.spoofed_name is not None and update.spoofed_name != acting.spoofed_name:
+        spoofed_name = update.spoofed_name
+    async with db.acquire() as conn:
         async with conn.transaction():
-            if update.admin_level is not None:
-                admin_level = min(user.admin_level, update.admin_level)
-                if admin_level != acting.admin_level:
-                    await conn.execute(
-                        "UPDATE characters_active SET admin_level = $1 WHERE id = $2",
-                        admin_level,
-                        character_id,
-                    )
-                    acting.admin_level = admin_level
-            if update.metadata is not None:
-                await conn.execute(
-                    "UPDATE characters_active SET metadata = $1 WHERE id = $2",
-                    orjson.dumps(update.metadata).decode(),
-                    character_id,
-                )
-                acting.metadata = update.metadata
-            if (
-                update.spoofed_name is not None
-                and update.spoofed_name != acting.spoofed_name
-            ):
-                spoof_id = await conn.fetchrow(
-                    "SELECT id FROM character_spoofs WHERE character_id=$1 AND spoofed_name=$2",
-                    character_id,
-                    update.spoofed_name,
-                )
-                if not spoof_id:
-                    spoof_id = await conn.fetchrow(
-                        "INSERT INTO character_spoofs (character_id, spoofed_name) VALUES ($1, $2) RETURNING id",
-                        character_id,
-                        update.spoofed_name,
-                    )
-                await conn.execute(
-                    "UPDATE characters_active SET spoofing_id = $1 WHERE id=$2",
-                    spoof_id,
-                    character_id,
-                )
-                acting.spoofing_id = spoof_id
-                acting.spoofed_name = update.spoofed_name
-            await conn.execute(
-                "UPDATE characters SET last_active_at=now() WHERE id=$1", character_id
+            row = await conn.fetchrow(
+                ACTIVE_UPDATE,
+                character_id,
+                admin_level,
+                update.metadata,
+                spoofed_name,
+            )
+            if row is None:
+                raise HTTPException(status_code=404, detail="Character is not active.")
+            # A copy, so the ActiveAs other code holds doesn't change before (or
+            # without) the commit; the rest of this request sees the new one.
+            acting = acting.model_copy(
+                update={
+                    "admin_level": row["admin_level"],
+                    "metadata": row["metadata"],
+                    "spoofing_id": row["spoofing_id"],
+                    "spoofed_name": row["spoofed_name"],
+                }
             )
+            db.acting[character_id] = acting
+            await publish(
+                conn,
+                "character.active",
+                character_id=character_id,
+                user_id=str(user.id),
+                spoofed_name=acting.spoofed_name,
+                admin_level=acting.admin_level,
+            )
+    mark_write(user, db)
     return acting
 
 
+@router.get("/resolve", response_model=CharacterNameModel)
+async def resolve_character_name(
+    name: str, user: Annotated[UserModel, Depends(get_current_user)]
+):
+    """
+    Resolve a full name or unique prefix, ignoring case, from the in-memory directory.
+    """
+    try:
+        entry = phantasm.NAMES.resolve(name)
+    except AmbiguousName as err:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Which did you mean? {', '.join(m.name for m in err.matches)}",
+        )
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Character not found")
+    return CharacterNameModel(id=entry.id, name=entry.name)
+
+
 @router.get("/{character_id}", response_model=CharacterModel)
 async def get_character(
-    user: Annotated[UserModel, Depends(get_current_user)], character_id: int
+    user: Annotated[UserModel, Depends(get_current_user)],
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
 ):
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with pool.acquire() as conn:
         character_data = await conn.fetchrow(
             "SELECT * FROM characters WHERE id = $1", character_id
         )
@@ -138,9 +271,10 @@ class CharacterCreate(pydantic.BaseModel):
 @router.post("/", response_model=CharacterModel)
 async def create_character(
     user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
     char_data: Annotated[CharacterCreate, Depends()],
 ):
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with db.acquire() as conn:
         try:
             character_id = await conn.fetchval(
                 "INSERT INTO characters (user_id, name) VALUES ($1, $2) RETURNING id",
@@ -153,4 +287,5 @@ async def create_character(
         character_data = await conn.fetchrow(
             "SELECT * FROM characters WHERE id = $1", character_id
         )
+    mark_write(user, db)
     return CharacterModel(**character_data)
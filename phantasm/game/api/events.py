@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import orjson
+import phantasm
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+
+from .utils import decode_token, user_from_payload, get_acting_character
+
+router = APIRouter()
+
+# How long a client has to send its token after connecting.
+AUTH_TIMEOUT = 10.0
+# How often an open socket checks that its token hasn't been revoked.
+REVOCATION_CHECK = 5.0
+
+
+@router.websocket("/ws")
+async def events_socket(websocket: WebSocket, character_id: int):
+    """
+    Realtime change events for one acting character.
+
+    The first message from the client must be {"token": "<access token>"}. After that,
+    the server pushes every event the character is allowed to see as a JSON object
+    with a "type" key, and clients no longer need to poll. The socket is closed when
+    the token expires or is revoked; clients reconnect with a fresh one.
+    """
+    await websocket.accept()
+    try:
+        message = await asyncio.wait_for(websocket.receive_json(), timeout=AUTH_TIMEOUT)
+        payload = decode_token(str(message.get("token", "")))
+        user = await user_from_payload(payload)
+        acting = await get_acting_character(user, character_id)
+    except (HTTPException, asyncio.TimeoutError, ValueError, AttributeError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    except WebSocketDisconnect:
+        return
+
+    subscription = phantasm.EVENTS.subscribe(acting)
+
+    async def sender():
+        await websocket.send_json({"type": "subscribed", "character_id": character_id})
+        while True:
+            event = await subscription.queue.get()
+            if subscription.overflowed:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await websocket.send_text(orjson.dumps(event).decode("utf-8"))
+
+    async def receiver():
+        # We don't expect anything from the client; this only notices disconnects.
+        while True:
+            await websocket.receive_text()
+
+    async def watchdog():
+        while not phantasm.REVOCATIONS.rejects(payload):
+            if (remaining := payload.get("exp", 0) - time.time()) <= 0:
+                break
+            await asyncio.sleep(min(remaining, REVOCATION_CHECK))
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+    tasks = {
+        asyncio.create_task(sender()),
+        asyncio.create_task(receiver()),
+        asyncio.create_task(watchdog()),
+    }
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        phantasm.EVENTS.unsubscribe(subscription)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
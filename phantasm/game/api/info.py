@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from typing import Annotated, Optional
+
+import typing
+import asyncpg
+import phantasm
+import pydantic
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from phantasm.game.events import publish, event_handler, reconnect_handler
+from .utils import get_current_user, RequestConnection, RequestDB
+from .models import UserModel, InfoFileModel
+
+router = APIRouter()
+
+# entity_type values of info_holders.
+ENTITY_CHARACTER = 0
+
+# (entity_type, entity_id) -> category (lowercased) -> files. Filled from the primary
+# so a refill right after a write can't cache replica-stale data. Every worker drops
+# an entity when any worker writes to it, via the "info.changed" event.
+INFO_CACHE: OrderedDict[tuple[int, int], dict[str, list[InfoFileModel]]] = OrderedDict()
+INFO_CACHE_SIZE = 4096
+# Bumped whenever entities are dropped, so a load which raced a write isn't cached.
+INFO_GENERATION = 0
+
+INFO_SELECT = """
+SELECT h.entity_type, h.entity_id, h.category,
+       f.id, f.name, f.description, f.metadata, f.created_at, f.updated_at
+FROM info_holders h
+         JOIN info_files f ON f.holder_id = h.id
+"""
+
+
+def forget_info(entity_type: int, entity_id: int):
+    global INFO_GENERATION
+    INFO_GENERATION += 1
+    INFO_CACHE.pop((entity_type, entity_id), None)
+
+
+@event_handler("info.changed")
+def invalidate_info(event: dict):
+    forget_info(event["entity_type"], event["entity_id"])
+
+
+@reconnect_handler
+async def clear_info(conn: asyncpg.Connection):
+    global INFO_GENERATION
+    INFO_GENERATION += 1
+    INFO_CACHE.clear()
+
+
+async def load_info(
+    entity_type: int, entity_ids: typing.Iterable[int], db: Optional[RequestDB] = None
+) -> dict[int, dict[str, list[InfoFileModel]]]:
+    """
+    Return the info files of every entity, loading all cache misses in one query on
+    the request's connection when given one. What was loaded is only cached if no
+    entity was dropped meanwhile, since the query may have read it from before the
+    write that dropped it.
+    """
+    found = dict()
+    missing = list()
+    for entity_id in entity_ids:
+        key = (entity_type, entity_id)
+        if (files := INFO_CACHE.get(key, None)) is not None:
+            INFO_CACHE.move_to_end(key)
+            found[entity_id] = files
+        else:
+            missing.append(entity_id)
+
+    if missing:
+        generation = INFO_GENERATION
+        async with (db or phantasm.PGPOOL).acquire() as conn:
+            rows = await conn.fetch(
+                f"{INFO_SELECT} WHERE h.entity_type = $1 AND h.entity_id = ANY($2::int[]) ORDER BY f.name",
+                entity_type,
+                missing,
+            )
+        loaded = {entity_id: dict() for entity_id in missing}
+        for row in rows:
+            loaded[row["entity_id"]].setdefault(row["category"].lower(), list()).append(
+                InfoFileModel(**row)
+            )
+        found.update(loaded)
+        if generation == INFO_GENERATION:
+            for entity_id, files in loaded.items():
+                INFO_CACHE[(entity_type, entity_id)] = files
+            while len(INFO_CACHE) > INFO_CACHE_SIZE:
+                INFO_CACHE.popitem(last=False)
+
+    return found
+
+
+def select_files(
+    info: dict[int, dict[str, list[InfoFileModel]]],
+    categories: Optional[list[str]],
+) -> list[InfoFileModel]:
+    wanted = {c.lower() for c in categories} if categories else None
+    out = list()
+    for entity_id, by_category in info.items():
+        for category, files in by_category.items():
+            if wanted is None or category in wanted:
+                out.extend(files)
+    return out
+
+
+class InfoBulkRequest(pydantic.BaseModel):
+    entity_type: int = ENTITY_CHARACTER
+    entity_ids: list[int]
+    categories: Optional[list[str]] = None
+
+
+@router.post("/bulk", response_model=list[InfoFileModel])
+async def get_info_bulk(
+    request: InfoBulkRequest,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    """
+    Every info file of a set of entities, optionally limited to some categories.
+    Uncached entities are loaded together in a single query.
+    """
+    if len(request.entity_ids) > 1000:
+        raise HTTPException(status_code=400, detail="Too many entities requested.")
+    info = await load_info(request.entity_type, request.entity_ids, db)
+    return select_files(info, request.categories)
+
+
+@router.get("/search", response_model=list[InfoFileModel])
+async def search_info(
+    name: str,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    entity_type: int = ENTITY_CHARACTER,
+    category: Optional[str] = None,
+    limit: int = 50,
+):
+    """
+    Case-insensitive substring search on info file names, backed by a trigram index.
+    """
+    pattern = "%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    async with db.acquire() as conn:
+        rows = await conn.fetch(
+            f"""{INFO_SELECT}
+            WHERE h.entity_type = $1 AND f.name::text ILIKE $2
+              AND ($3::citext IS NULL OR h.category = $3::citext)
+            ORDER BY f.name LIMIT $4""",
+            entity_type,
+            pattern,
+            category,
+            min(max(limit, 1), 200),
+        )
+    return [InfoFileModel(**row) for row in rows]
+
+
+@router.get("/{entity_type}/{entity_id}", response_model=list[InfoFileModel])
+async def get_info(
+    entity_type: int,
+    entity_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    categories: Annotated[Optional[list[str]], Query()] = None,
+):
+    info = await load_info(entity_type, [entity_id], db)
+    return select_files(info, categories)
+
+
+async def check_info_write(
+    db: RequestDB, user: UserModel, entity_type: int, entity_id: int
+):
+    if user.admin_level > 0:
+        return
+    if entity_type == ENTITY_CHARACTER:
+        async with db.acquire() as conn:
+            owner = await conn.fetchval(
+                "SELECT user_id FROM characters WHERE id = $1", entity_id
+            )
+        if owner == user.id:
+            return
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="You do not have permission to edit that info.",
+    )
+
+
+class InfoFileWrite(pydantic.BaseModel):
+    description: Optional[str] = None
+    metadata: dict[str, typing.Any] = pydantic.Field(default_factory=dict)
+
+
+@router.put("/{entity_type}/{entity_id}/{category}/{name}", response_model=InfoFileModel)
+async def set_info(
+    entity_type: int,
+    entity_id: int,
+    category: str,
+    name: str,
+    data: InfoFileWrite,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    await check_info_write(db, user, entity_type, entity_id)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            row = await conn.fetchrow(
+                """
+                WITH holder AS (
+                    INSERT INTO info_holders (entity_type, entity_id, category)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (entity_type, entity_id, category)
+                        DO UPDATE SET category = info_holders.category
+                    RETURNING id
+                )
+                INSERT INTO info_files (holder_id, name, description, metadata)
+                SELECT holder.id, $4, $5, $6 FROM holder
+                ON CONFLICT (holder_id, name)
+                    DO UPDATE SET description = EXCLUDED.description,
+                                  metadata = EXCLUDED.metadata,
+                                  updated_at = now()
+                RETURNING id, name, description, metadata, created_at, updated_at
+                """,
+                entity_type,
+                entity_id,
+                category,
+                name,
+                data.description,
+                data.metadata,
+            )
+            await publish(
+                conn, "info.changed", entity_type=entity_type, entity_id=entity_id
+            )
+    db.after_commit(lambda: forget_info(entity_type, entity_id))
+    return InfoFileModel(
+        entity_type=entity_type, entity_id=entity_id, category=category, **row
+    )
+
+
+@router.delete("/{entity_type}/{entity_id}/{category}/{name}")
+async def delete_info(
+    entity_type: int,
+    entity_id: int,
+    category: str,
+    name: str,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    await check_info_write(db, user, entity_type, entity_id)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            deleted = await conn.fetchval(
+                """
+                DELETE FROM info_files f
+                USING info_holders h
+                WHERE f.holder_id = h.id
+                  AND h.entity_type = $1 AND h.entity_id = $2 AND h.category = $3
+                  AND f.name = $4
+                RETURNING f.id
+                """,
+                entity_type,
+                entity_id,
+                category,
+                name,
+            )
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Info file not found.")
+            await publish(
+                conn, "info.changed", entity_type=entity_type, entity_id=entity_id
+            )
+    db.after_commit(lambda: forget_info(entity_type, entity_id))
+    return {"deleted": deleted}
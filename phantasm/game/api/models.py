@@ -30,6 +30,20 @@ class CharacterModel(BaseModel):
     deleted_at: Optional[datetime]
 
 
+class CharacterNameModel(BaseModel):
+    id: int
+    name: str
+
+
+class PresenceModel(BaseModel):
+    spoofed_name: str
+    online_seconds: float
+    idle_seconds: float
+    # Only shown to admins, since they would reveal who is behind a spoofed name.
+    character_id: Optional[int] = None
+    name: Optional[str] = None
+
+
 class ActiveAs(BaseModel):
     user: UserModel
     character: CharacterModel
@@ -41,6 +55,7 @@ class ActiveAs(BaseModel):
 
 
 class BoardModel(BaseModel, LockHandler):
+    id: int
     board_key: str
     name: str
     description: Optional[str]
@@ -62,6 +77,13 @@ class PostModel(BaseModel):
     character_id: typing.Optional[int] = None
     character_name: typing.Optional[str] = None
 
+
+class NewPostModel(PostModel):
+    id: int
+    board_key: str
+    board_name: str
+
+
 class FactionModel(BaseModel, LockHandler):
     id: int
     name: str
@@ -79,3 +101,82 @@ class FactionModel(BaseModel, LockHandler):
     member_permissions: set[str]
     public_permissions: set[str]
     lock_data: dict[str, str]
+
+
+class InfoFileModel(BaseModel):
+    id: int
+    entity_type: int
+    entity_id: int
+    category: str
+    name: str
+    description: Optional[str]
+    metadata: dict[str, typing.Any]
+    created_at: datetime
+    updated_at: datetime
+
+
+class ParticipantModel(BaseModel):
+    character_id: int
+    name: str
+    # Scenes: 3 owner, 2 co-owner, 1 tagged, 0 present. Plots: 2 runner, 1 co-runner, 0 helper.
+    role: int
+
+
+class SceneModel(BaseModel):
+    id: int
+    name: str
+    description: Optional[str]
+    resolution: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    scheduled_at: Optional[datetime]
+    started_at: Optional[datetime]
+    ended_at: Optional[datetime]
+    participant_count: int
+    participants: list[ParticipantModel]
+
+
+class PlotModel(BaseModel):
+    id: int
+    name: str
+    description: Optional[str]
+    resolution: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    started_at: Optional[datetime]
+    ended_at: Optional[datetime]
+    runner_count: int
+    runners: list[ParticipantModel]
+
+
+class RegionModel(BaseModel):
+    id: int
+    name: str
+    parent_id: Optional[int]
+    created_at: datetime
+    updated_at: datetime
+    # Distance from the region a listing was made for; 0 is that region itself.
+    depth: int = 0
+
+
+class RoomModel(BaseModel):
+    id: int
+    region_id: int
+    name: str
+    description: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+
+class ChannelModel(BaseModel, LockHandler):
+    id: int
+    category: str
+    name: str
+    description: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    lock_data: dict[str, str]
+    # The acting character's membership, if any.
+    member: bool = False
+    listening: bool = False
+    aliases: list[str] = pydantic.Field(default_factory=list)
@@ -0,0 +1,293 @@
+from datetime import datetime
+from typing import Annotated, Optional
+
+import asyncpg
+import phantasm
+import pydantic
+
+from asyncpg import exceptions
+from fastapi import APIRouter, Depends, HTTPException
+
+from .utils import (
+    get_current_user,
+    get_acting_character,
+    get_acting_read_pool,
+    get_read_pool,
+    mark_write,
+    RequestConnection,
+)
+from .models import UserModel, PlotModel, ParticipantModel, ActiveAs
+
+router = APIRouter()
+
+# Plots with their runners aggregated, one row per plot; see scenes.SCENE_SELECT.
+PLOT_SELECT = """
+SELECT pl.*,
+       count(r.id) AS runner_count,
+       coalesce(array_agg(r.character_id ORDER BY r.runner_type DESC, c.name)
+                FILTER (WHERE r.id IS NOT NULL), '{{}}') AS runner_ids,
+       coalesce(array_agg(c.name::text ORDER BY r.runner_type DESC, c.name)
+                FILTER (WHERE r.id IS NOT NULL), '{{}}') AS runner_names,
+       coalesce(array_agg(r.runner_type ORDER BY r.runner_type DESC, c.name)
+                FILTER (WHERE r.id IS NOT NULL), '{{}}') AS runner_types
+FROM plots pl
+         LEFT JOIN plot_runners r ON r.plot_id = pl.id
+         LEFT JOIN characters c ON c.id = r.character_id
+{where}
+GROUP BY pl.id
+"""
+
+RUNNER = 2
+CO_RUNNER = 1
+
+
+def plot_from_row(row: asyncpg.Record) -> PlotModel:
+    data = dict(row)
+    ids = data.pop("runner_ids")
+    names = data.pop("runner_names")
+    roles = data.pop("runner_types")
+    return PlotModel(
+        runners=[
+            ParticipantModel(character_id=i, name=n, role=r)
+            for i, n, r in zip(ids, names, roles)
+        ],
+        **data,
+    )
+
+
+@router.get("/", response_model=list[PlotModel])
+async def list_plots(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+    ended: bool = False,
+    offset: int = 0,
+    limit: int = 50,
+):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            PLOT_SELECT.format(where="WHERE $1 OR pl.ended_at IS NULL")
+            + " ORDER BY pl.created_at DESC OFFSET $2 LIMIT $3",
+            ended,
+            max(offset, 0),
+            min(max(limit, 1), 200),
+        )
+    return [plot_from_row(row) for row in rows]
+
+
+@router.get("/mine", response_model=list[PlotModel])
+async def my_plots(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
+):
+    """
+    Plots the acting character helps run.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            PLOT_SELECT.format(
+                where="WHERE pl.id IN (SELECT plot_id FROM plot_runners WHERE character_id = $1)"
+            )
+            + " ORDER BY pl.created_at DESC",
+            acting.character.id,
+        )
+    return [plot_from_row(row) for row in rows]
+
+
+@router.get("/{plot_id}", response_model=PlotModel)
+async def get_plot(
+    plot_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(PLOT_SELECT.format(where="WHERE pl.id = $1"), plot_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Plot not found.")
+    return plot_from_row(row)
+
+
+async def check_plot_admin(
+    conn: asyncpg.Connection, acting: ActiveAs, plot_id: int, minimum: int = CO_RUNNER
+):
+    """
+    Only a plot's runners, co-runners and admins may change it. Some changes take a
+    runner (minimum=RUNNER).
+    """
+    row = await conn.fetchrow(
+        """
+        SELECT pl.id, r.runner_type
+        FROM plots pl
+                 LEFT JOIN plot_runners r ON r.plot_id = pl.id AND r.character_id = $2
+        WHERE pl.id = $1
+        """,
+        plot_id,
+        acting.character.id,
+    )
+    if row is None:
+        raise HTTPException(status_code=404, detail="Plot not found.")
+    if (row["runner_type"] or 0) < minimum and acting.admin_level < 1:
+        raise HTTPException(
+            status_code=403, detail="You do not have permission to change this plot."
+        )
+
+
+async def runner_role(conn: asyncpg.Connection, plot_id: int, character_id: int) -> int:
+    role = await conn.fetchval(
+        "SELECT runner_type FROM plot_runners WHERE plot_id = $1 AND character_id = $2",
+        plot_id,
+        character_id,
+    )
+    return role or 0
+
+
+class PlotCreate(pydantic.BaseModel):
+    name: str
+    description: Optional[str] = None
+
+
+@router.post("/", response_model=PlotModel)
+async def create_plot(
+    plot: PlotCreate,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Create a plot run by the acting character.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            try:
+                plot_id = await conn.fetchval(
+                    """
+                    WITH pl AS (
+                        INSERT INTO plots (name, description)
+                        VALUES ($1, $2)
+                        RETURNING id
+                    ), r AS (
+                        INSERT INTO plot_runners (plot_id, character_id, runner_type)
+                        SELECT pl.id, $3, $4 FROM pl
+                    )
+                    SELECT id FROM pl
+                    """,
+                    plot.name,
+                    plot.description,
+                    acting.character.id,
+                    RUNNER,
+                )
+            except exceptions.UniqueViolationError:
+                raise HTTPException(status_code=409, detail="Plot name already taken.")
+            row = await conn.fetchrow(PLOT_SELECT.format(where="WHERE pl.id = $1"), plot_id)
+    mark_write(user, db)
+    return plot_from_row(row)
+
+
+class PlotUpdate(pydantic.BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    resolution: Optional[str] = None
+    started_at: Optional[datetime] = None
+    ended_at: Optional[datetime] = None
+
+
+@router.patch("/{plot_id}", response_model=PlotModel)
+async def update_plot(
+    plot_id: int,
+    update: PlotUpdate,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    acting = await get_acting_character(user, character_id, db)
+    fields = update.model_dump(exclude_unset=True)
+    if "name" in fields and not fields["name"]:
+        raise HTTPException(status_code=400, detail="Plots need a name.")
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            await check_plot_admin(conn, acting, plot_id)
+            if fields:
+                assignments = ", ".join(f"{k} = ${i}" for i, k in enumerate(fields, 2))
+                try:
+                    await conn.execute(
+                        f"UPDATE plots SET {assignments}, updated_at = now() WHERE id = $1",
+                        plot_id,
+                        *fields.values(),
+                    )
+                except exceptions.UniqueViolationError:
+                    raise HTTPException(status_code=409, detail="Plot name already taken.")
+            row = await conn.fetchrow(PLOT_SELECT.format(where="WHERE pl.id = $1"), plot_id)
+    mark_write(user, db)
+    return plot_from_row(row)
+
+
+@router.put("/{plot_id}/runners/{runner_id}", response_model=PlotModel)
+async def set_runner(
+    plot_id: int,
+    runner_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    role: int = 0,
+):
+    """
+    Add a runner to a plot or change their role. Runners, co-runners and admins may
+    add plain runners; making or unmaking co-runners and runners takes a runner or
+    admin.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    if not 0 <= role <= RUNNER:
+        raise HTTPException(status_code=400, detail="Invalid runner role.")
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            current = await runner_role(conn, plot_id, runner_id)
+            minimum = RUNNER if max(role, current) >= CO_RUNNER else CO_RUNNER
+            await check_plot_admin(conn, acting, plot_id, minimum)
+            try:
+                await conn.execute(
+                    """
+                    INSERT INTO plot_runners (plot_id, character_id, runner_type)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (plot_id, character_id)
+                        DO UPDATE SET runner_type = EXCLUDED.runner_type,
+                                      updated_at  = now()
+                    """,
+                    plot_id,
+                    runner_id,
+                    role,
+                )
+            except exceptions.ForeignKeyViolationError:
+                raise HTTPException(status_code=404, detail="Character not found.")
+            row = await conn.fetchrow(PLOT_SELECT.format(where="WHERE pl.id = $1"), plot_id)
+    mark_write(user, db)
+    return plot_from_row(row)
+
+
+@router.delete("/{plot_id}/runners/{runner_id}", response_model=PlotModel)
+async def remove_runner(
+    plot_id: int,
+    runner_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            if runner_id != acting.character.id:
+                current = await runner_role(conn, plot_id, runner_id)
+                minimum = RUNNER if current >= CO_RUNNER else CO_RUNNER
+                await check_plot_admin(conn, acting, plot_id, minimum)
+            deleted = await conn.fetchval(
+                "DELETE FROM plot_runners WHERE plot_id = $1 AND character_id = $2 RETURNING id",
+                plot_id,
+                runner_id,
+            )
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Not a runner of that plot.")
+            row = await conn.fetchrow(PLOT_SELECT.format(where="WHERE pl.id = $1"), plot_id)
+    mark_write(user, db)
+    return plot_from_row(row)
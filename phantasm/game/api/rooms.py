@@ -0,0 +1,246 @@
+from typing import Annotated, Optional
+
+import asyncpg
+import phantasm
+import pydantic
+
+from asyncpg import exceptions
+from fastapi import APIRouter, Depends, HTTPException
+
+from .utils import get_current_user, get_read_pool, mark_write, RequestConnection
+from .models import UserModel, RegionModel, RoomModel
+
+router = APIRouter()
+
+# Subtrees and ancestries come from region_closure (migration 009), which triggers on
+# regions keep current as regions are created and moved.
+
+
+def check_builder(user: UserModel):
+    if user.admin_level < 1:
+        raise HTTPException(
+            status_code=403, detail="You do not have permission to build."
+        )
+
+
+@router.get("/regions", response_model=list[RegionModel])
+async def list_root_regions(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT * FROM regions WHERE parent_id IS NULL ORDER BY name"
+        )
+    return [RegionModel(**row) for row in rows]
+
+
+@router.get("/regions/{region_id}/subtree", response_model=list[RegionModel])
+async def get_region_subtree(
+    region_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+    max_depth: Optional[int] = None,
+):
+    """
+    A region and every region under it, shallowest first.
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT g.*, c.depth
+            FROM region_closure c
+                     JOIN regions g ON g.id = c.descendant_id
+            WHERE c.ancestor_id = $1
+              AND ($2::int IS NULL OR c.depth <= $2)
+            ORDER BY c.depth, g.name
+            """,
+            region_id,
+            max_depth,
+        )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Region not found.")
+    return [RegionModel(**row) for row in rows]
+
+
+@router.get("/regions/{region_id}/rooms", response_model=list[RoomModel])
+async def get_region_rooms(
+    region_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    """
+    Every room in a region or any region under it.
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT r.*
+            FROM region_closure c
+                     JOIN region_rooms r ON r.region_id = c.descendant_id
+            WHERE c.ancestor_id = $1
+            ORDER BY c.depth, r.name
+            """,
+            region_id,
+        )
+        if not rows and not await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM regions WHERE id = $1)", region_id
+        ):
+            raise HTTPException(status_code=404, detail="Region not found.")
+    return [RoomModel(**row) for row in rows]
+
+
+@router.get("/regions/{region_id}/path", response_model=list[RegionModel])
+async def get_region_path(
+    region_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    """
+    The region's ancestors from the root down, ending with the region itself.
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT g.*, c.depth
+            FROM region_closure c
+                     JOIN regions g ON g.id = c.ancestor_id
+            WHERE c.descendant_id = $1
+            ORDER BY c.depth DESC
+            """,
+            region_id,
+        )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Region not found.")
+    return [RegionModel(**row) for row in rows]
+
+
+class RegionWrite(pydantic.BaseModel):
+    name: Optional[str] = None
+    parent_id: Optional[int] = None
+
+
+@router.post("/regions", response_model=RegionModel)
+async def create_region(
+    region: RegionWrite,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    check_builder(user)
+    if not region.name:
+        raise HTTPException(status_code=400, detail="Regions need a name.")
+    async with db.acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                "INSERT INTO regions (name, parent_id) VALUES ($1, $2) RETURNING *",
+                region.name,
+                region.parent_id,
+            )
+        except exceptions.ForeignKeyViolationError:
+            raise HTTPException(status_code=404, detail="Parent region not found.")
+    mark_write(user, db)
+    return RegionModel(**row)
+
+
+@router.patch("/regions/{region_id}", response_model=RegionModel)
+async def update_region(
+    region_id: int,
+    update: RegionWrite,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    """
+    Rename a region, or move it and everything under it by sending a new parent_id
+    (null makes it a root).
+    """
+    check_builder(user)
+    fields = update.model_dump(exclude_unset=True)
+    if not fields:
+        raise HTTPException(status_code=400, detail="Nothing to change.")
+    if "name" in fields and not fields["name"]:
+        raise HTTPException(status_code=400, detail="Regions need a name.")
+    assignments = ", ".join(f"{k} = ${i}" for i, k in enumerate(fields, 2))
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            try:
+                row = await conn.fetchrow(
+                    f"UPDATE regions SET {assignments}, updated_at = now() WHERE id = $1 RETURNING *",
+                    region_id,
+                    *fields.values(),
+                )
+            except exceptions.CheckViolationError:
+                raise HTTPException(
+                    status_code=400, detail="A region can't be moved under itself."
+                )
+            except exceptions.ForeignKeyViolationError:
+                raise HTTPException(status_code=404, detail="Parent region not found.")
+            if row is None:
+                raise HTTPException(status_code=404, detail="Region not found.")
+    mark_write(user, db)
+    return RegionModel(**row)
+
+
+@router.get("/{room_id}", response_model=RoomModel)
+async def get_room(
+    room_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM region_rooms WHERE id = $1", room_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Room not found.")
+    return RoomModel(**row)
+
+
+@router.get("/{room_id}/path", response_model=list[RegionModel])
+async def get_room_path(
+    room_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    """
+    Breadcrumbs for a room: its regions from the root down to the one holding it.
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT g.*, c.depth
+            FROM region_rooms r
+                     JOIN region_closure c ON c.descendant_id = r.region_id
+                     JOIN regions g ON g.id = c.ancestor_id
+            WHERE r.id = $1
+            ORDER BY c.depth DESC
+            """,
+            room_id,
+        )
+    if not rows:
+        raise HTTPException(status_code=404, detail="Room not found.")
+    return [RegionModel(**row) for row in rows]
+
+
+class RoomCreate(pydantic.BaseModel):
+    region_id: int
+    name: str
+    description: Optional[str] = None
+
+
+@router.post("/", response_model=RoomModel)
+async def create_room(
+    room: RoomCreate,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+):
+    check_builder(user)
+    async with db.acquire() as conn:
+        try:
+            row = await conn.fetchrow(
+                "INSERT INTO region_rooms (region_id, name, description) VALUES ($1, $2, $3) RETURNING *",
+                room.region_id,
+                room.name,
+                room.description,
+            )
+        except exceptions.ForeignKeyViolationError:
+            raise HTTPException(status_code=404, detail="Region not found.")
+    mark_write(user, db)
+    return RoomModel(**row)
@@ -0,0 +1,380 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Optional
+
+import asyncpg
+import phantasm
+import pydantic
+
+from asyncpg import exceptions
+from fastapi import APIRouter, Depends, HTTPException
+
+from phantasm.game.events import publish, event_handler, reconnect_handler
+from .utils import (
+    get_current_user,
+    get_acting_character,
+    get_acting_read_pool,
+    get_read_pool,
+    mark_write,
+    RequestConnection,
+    RequestDB,
+)
+from .models import UserModel, SceneModel, ParticipantModel, ActiveAs
+
+router = APIRouter()
+
+# Scenes with their participants aggregated, one row per scene. Callers add the WHERE
+# clause between the joins and the GROUP BY.
+SCENE_SELECT = """
+SELECT s.*,
+       count(p.id) AS participant_count,
+       coalesce(array_agg(p.character_id ORDER BY p.participant_type DESC, c.name)
+                FILTER (WHERE p.id IS NOT NULL), '{{}}') AS participant_ids,
+       coalesce(array_agg(c.name::text ORDER BY p.participant_type DESC, c.name)
+                FILTER (WHERE p.id IS NOT NULL), '{{}}') AS participant_names,
+       coalesce(array_agg(p.participant_type ORDER BY p.participant_type DESC, c.name)
+                FILTER (WHERE p.id IS NOT NULL), '{{}}') AS participant_types
+FROM scenes s
+         LEFT JOIN scene_participants p ON p.scene_id = s.id
+         LEFT JOIN characters c ON c.id = p.character_id
+{where}
+GROUP BY s.id
+"""
+
+OWNER = 3
+CO_OWNER = 2
+
+
+def scene_from_row(row: asyncpg.Record) -> SceneModel:
+    data = dict(row)
+    ids = data.pop("participant_ids")
+    names = data.pop("participant_names")
+    roles = data.pop("participant_types")
+    return SceneModel(
+        participants=[
+            ParticipantModel(character_id=i, name=n, role=r)
+            for i, n, r in zip(ids, names, roles)
+        ],
+        **data,
+    )
+
+
+class SceneCalendar:
+    """
+    Every scheduled scene that hasn't ended, soonest first, loaded in one query and
+    shared by all calendar requests. Every worker drops it when any scene changes,
+    through "scene.changed", and it is reloaded after ttl seconds regardless so that
+    scenes which have come and gone fall off.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.scenes: Optional[list[SceneModel]] = None
+        self.loaded_at = 0.0
+        # Bumped on invalidation, so a load which raced a write isn't kept.
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+        self.scenes = None
+
+    async def get(self, db: Optional[RequestDB] = None) -> list[SceneModel]:
+        if self.scenes is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return self.scenes
+        async with self.lock:
+            if self.scenes is not None and time.monotonic() - self.loaded_at < self.ttl:
+                return self.scenes
+            generation = self.generation
+            # Filled from the primary so a reload right after a write isn't stale, on
+            # the request's connection when given one.
+            async with (db or phantasm.PGPOOL).acquire() as conn:
+                rows = await conn.fetch(
+                    SCENE_SELECT.format(
+                        where="WHERE s.scheduled_at IS NOT NULL AND s.ended_at IS NULL"
+                    )
+                    + " ORDER BY s.scheduled_at"
+                )
+            scenes = [scene_from_row(row) for row in rows]
+            if generation == self.generation:
+                self.scenes = scenes
+                self.loaded_at = time.monotonic()
+            return scenes
+
+
+CALENDAR = SceneCalendar()
+
+
+@event_handler("scene.changed")
+def invalidate_calendar(event: dict):
+    CALENDAR.invalidate()
+
+
+@reconnect_handler
+async def reload_calendar(conn: asyncpg.Connection):
+    CALENDAR.invalidate()
+
+
+async def scene_changed(conn: asyncpg.Connection, scene_id: int):
+    await publish(conn, "scene.changed", scene_id=scene_id)
+
+
+@router.get("/calendar", response_model=list[SceneModel])
+async def scene_calendar(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    days: int = 30,
+    offset: int = 0,
+    limit: int = 50,
+):
+    """
+    Scenes scheduled over the next `days` days, soonest first, including any that
+    were scheduled earlier and haven't ended yet.
+    """
+    until = datetime.now(tz=timezone.utc) + timedelta(days=min(max(days, 1), 366))
+    scenes = [s for s in await CALENDAR.get(db) if s.scheduled_at <= until]
+    offset = max(offset, 0)
+    return scenes[offset : offset + min(max(limit, 1), 200)]
+
+
+@router.get("/mine", response_model=list[SceneModel])
+async def my_scenes(
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    pool: Annotated[asyncpg.Pool, Depends(get_acting_read_pool)],
+    ended: bool = False,
+    limit: int = 50,
+):
+    """
+    Scenes the acting character takes part in, latest first.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            SCENE_SELECT.format(
+                where="""WHERE s.id IN (SELECT scene_id FROM scene_participants WHERE character_id = $1)
+                      AND ($2 OR s.ended_at IS NULL)"""
+            )
+            + " ORDER BY coalesce(s.scheduled_at, s.created_at) DESC LIMIT $3",
+            acting.character.id,
+            ended,
+            min(max(limit, 1), 200),
+        )
+    return [scene_from_row(row) for row in rows]
+
+
+@router.get("/{scene_id}", response_model=SceneModel)
+async def get_scene(
+    scene_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    pool: Annotated[asyncpg.Pool, Depends(get_read_pool)],
+):
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(SCENE_SELECT.format(where="WHERE s.id = $1"), scene_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Scene not found.")
+    return scene_from_row(row)
+
+
+async def check_scene_admin(
+    conn: asyncpg.Connection, acting: ActiveAs, scene_id: int, minimum: int = CO_OWNER
+):
+    """
+    Only a scene's owners, co-owners and admins may change it. Some changes take an
+    owner (minimum=OWNER).
+    """
+    row = await conn.fetchrow(
+        """
+        SELECT s.id, p.participant_type
+        FROM scenes s
+                 LEFT JOIN scene_participants p ON p.scene_id = s.id AND p.character_id = $2
+        WHERE s.id = $1
+        """,
+        scene_id,
+        acting.character.id,
+    )
+    if row is None:
+        raise HTTPException(status_code=404, detail="Scene not found.")
+    if (row["participant_type"] or 0) < minimum and acting.admin_level < 1:
+        raise HTTPException(
+            status_code=403, detail="You do not have permission to change this scene."
+        )
+
+
+async def participant_role(
+    conn: asyncpg.Connection, scene_id: int, character_id: int
+) -> int:
+    role = await conn.fetchval(
+        "SELECT participant_type FROM scene_participants WHERE scene_id = $1 AND character_id = $2",
+        scene_id,
+        character_id,
+    )
+    return role or 0
+
+
+class SceneCreate(pydantic.BaseModel):
+    name: str
+    description: Optional[str] = None
+    scheduled_at: Optional[datetime] = None
+
+
+@router.post("/", response_model=SceneModel)
+async def create_scene(
+    scene: SceneCreate,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Create a scene owned by the acting character.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            try:
+                scene_id = await conn.fetchval(
+                    """
+                    WITH s AS (
+                        INSERT INTO scenes (name, description, scheduled_at)
+                        VALUES ($1, $2, $3)
+                        RETURNING id
+                    ), p AS (
+                        INSERT INTO scene_participants (scene_id, character_id, participant_type)
+                        SELECT s.id, $4, $5 FROM s
+                    )
+                    SELECT id FROM s
+                    """,
+                    scene.name,
+                    scene.description,
+                    scene.scheduled_at,
+                    acting.character.id,
+                    OWNER,
+                )
+            except exceptions.UniqueViolationError:
+                raise HTTPException(status_code=409, detail="Scene name already taken.")
+            await scene_changed(conn, scene_id)
+            row = await conn.fetchrow(SCENE_SELECT.format(where="WHERE s.id = $1"), scene_id)
+    CALENDAR.invalidate()
+    mark_write(user, db)
+    return scene_from_row(row)
+
+
+class SceneUpdate(pydantic.BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    resolution: Optional[str] = None
+    scheduled_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    ended_at: Optional[datetime] = None
+
+
+@router.patch("/{scene_id}", response_model=SceneModel)
+async def update_scene(
+    scene_id: int,
+    update: SceneUpdate,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    """
+    Change any of the fields sent. Fields other than name can be cleared by sending
+    null.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    fields = update.model_dump(exclude_unset=True)
+    if "name" in fields and not fields["name"]:
+        raise HTTPException(status_code=400, detail="Scenes need a name.")
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            await check_scene_admin(conn, acting, scene_id)
+            if fields:
+                assignments = ", ".join(f"{k} = ${i}" for i, k in enumerate(fields, 2))
+                try:
+                    await conn.execute(
+                        f"UPDATE scenes SET {assignments}, updated_at = now() WHERE id = $1",
+                        scene_id,
+                        *fields.values(),
+                    )
+                except exceptions.UniqueViolationError:
+                    raise HTTPException(status_code=409, detail="Scene name already taken.")
+                await scene_changed(conn, scene_id)
+            row = await conn.fetchrow(SCENE_SELECT.format(where="WHERE s.id = $1"), scene_id)
+    CALENDAR.invalidate()
+    mark_write(user, db)
+    return scene_from_row(row)
+
+
+@router.put("/{scene_id}/participants/{participant_id}", response_model=SceneModel)
+async def set_participant(
+    scene_id: int,
+    participant_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+    role: int = 0,
+):
+    """
+    Add a character to a scene or change their role. Anyone may join a scene, or tag
+    themselves for interest; adding others takes an owner, co-owner or admin, and
+    making or unmaking co-owners and owners takes an owner or admin.
+    """
+    acting = await get_acting_character(user, character_id, db)
+    if not 0 <= role <= OWNER:
+        raise HTTPException(status_code=400, detail="Invalid participant role.")
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            if participant_id != acting.character.id or role >= CO_OWNER:
+                current = await participant_role(conn, scene_id, participant_id)
+                minimum = OWNER if max(role, current) >= CO_OWNER else CO_OWNER
+                await check_scene_admin(conn, acting, scene_id, minimum)
+            try:
+                await conn.execute(
+                    """
+                    INSERT INTO scene_participants (scene_id, character_id, participant_type)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (scene_id, character_id)
+                        DO UPDATE SET participant_type = EXCLUDED.participant_type,
+                                      updated_at       = now()
+                    """,
+                    scene_id,
+                    participant_id,
+                    role,
+                )
+            except exceptions.ForeignKeyViolationError:
+                raise HTTPException(status_code=404, detail="Scene or character not found.")
+            await scene_changed(conn, scene_id)
+            row = await conn.fetchrow(SCENE_SELECT.format(where="WHERE s.id = $1"), scene_id)
+    CALENDAR.invalidate()
+    mark_write(user, db)
+    return scene_from_row(row)
+
+
+@router.delete("/{scene_id}/participants/{participant_id}", response_model=SceneModel)
+async def remove_participant(
+    scene_id: int,
+    participant_id: int,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+):
+    acting = await get_acting_character(user, character_id, db)
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            if participant_id != acting.character.id:
+                current = await participant_role(conn, scene_id, participant_id)
+                minimum = OWNER if current >= CO_OWNER else CO_OWNER
+                await check_scene_admin(conn, acting, scene_id, minimum)
+            deleted = await conn.fetchval(
+                "DELETE FROM scene_participants WHERE scene_id = $1 AND character_id = $2 RETURNING id",
+                scene_id,
+                participant_id,
+            )
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Not a participant.")
+            await scene_changed(conn, scene_id)
+            row = await conn.fetchrow(SCENE_SELECT.format(where="WHERE s.id = $1"), scene_id)
+    CALENDAR.invalidate()
+    mark_write(user, db)
+    return scene_from_row(row)
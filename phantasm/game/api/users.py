@@ -7,6 +7,7 @@ import jwt
 import uuid
 import phantasm
 import pydantic
+import asyncpg
 
 from asyncpg import exceptions
 from pydantic import BaseModel
@@ -15,28 +16,28 @@ from pydantic import BaseModel
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 
-from .utils import crypt_context, oauth2_scheme, get_real_ip, get_current_user
+from .utils import crypt_context, oauth2_scheme, get_real_ip, get_current_user, get_read_pool
 from .models import UserModel, CharacterModel, ActiveAs
 
 router = APIRouter()
 
 
 @router.get("/", response_model=typing.List[UserModel])
-async def get_users(user: Annotated[UserModel, Depends(get_current_user)]):
+async def get_users(user: Annotated[UserModel, Depends(get_current_user)], pool: Annotated[asyncpg.Pool, Depends(get_read_pool)]):
     if user.admin_level < 1:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions.")
 
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with pool.acquire() as conn:
         users = await conn.fetch("SELECT * FROM users")
     
     return [UserModel(**u) for u in users]
 
 @router.get("/{user_id}", response_model=UserModel)
-async def get_user(user_id: uuid.UUID, user: Annotated[UserModel, Depends(get_current_user)]):
+async def get_user(user_id: uuid.UUID, user: Annotated[UserModel, Depends(get_current_user)], pool: Annotated[asyncpg.Pool, Depends(get_read_pool)]):
     if user.admin_level < 1 and user.id != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions.")
 
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with pool.acquire() as conn:
         user = await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
     
     if not user:
@@ -45,11 +46,11 @@ async def get_user(user_id: uuid.UUID, user: Annotated[UserModel, Depends(get_cu
     return UserModel(**user)
 
 @router.get("/{user_id}/characters")
-async def get_user_characters(user_id: uuid.UUID, user: Annotated[UserModel, Depends(get_current_user)]):
+async def get_user_characters(user_id: uuid.UUID, user: Annotated[UserModel, Depends(get_current_user)], pool: Annotated[asyncpg.Pool, Depends(get_read_pool)]):
     if user.id != user_id and user.admin_level < 1:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions.")
 
-    async with phantasm.PGPOOL.acquire() as conn:
+    async with pool.acquire() as conn:
         u = await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
         if not u:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
@@ -1,12 +1,15 @@
 import mudpy
 import jwt
+import asyncpg
 import uuid
 import pydantic
 import phantasm
 import orjson
+import contextlib
+import time
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Annotated, Optional
+from typing import Annotated, AsyncIterator, Callable, Optional
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import Request, Depends, HTTPException, status
@@ -16,6 +19,7 @@ crypt_context = CryptContext(schemes=["argon2"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 from .models import UserModel, CharacterModel, ActiveAs
+from phantasm.game.replica import WROTE_SCOPE, wrote_at
 
 
 def get_real_ip(request: Request):
@@ -29,7 +33,127 @@ def get_real_ip(request: Request):
     return ip
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> UserModel:
+class RequestDB:
+    """
+    One primary connection per request, acquired from the pool the first time anything
+    asks for it and released when the handler returns. get_current_user,
+    get_acting_character and the handler all share it, so a request waits on the pool
+    at most once, and requests which never touch the database never wait at all.
+
+    acquire() mirrors asyncpg.Pool.acquire() so handlers use it the same way, but
+    leaving its block does not release the connection.
+
+    Changes to in-memory state which follow a write go through after_commit(), so a
+    request made one transaction (see begin()) doesn't leave them behind when it
+    rolls back.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, scope: Optional[dict] = None):
+        self.pool = pool
+        # The ASGI scope of the request, where mark_write leaves WROTE_SCOPE.
+        self.scope = scope
+        self.context = None
+        self.conn: Optional[asyncpg.Connection] = None
+        self.transaction = None
+        self.atomic = False
+        # get_acting_character results by character id, so a batch resolves each once.
+        self.acting: dict[int, ActiveAs] = dict()
+        # after_commit callbacks waiting on the request's transaction.
+        self.deferred: list[Callable[[], None]] = list()
+
+    async def connection(self) -> asyncpg.Connection:
+        if self.conn is None:
+            self.context = self.pool.acquire()
+            self.conn = await self.context.__aenter__()
+            if self.atomic:
+                await self.start_transaction()
+        return self.conn
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        yield await self.connection()
+
+    async def start_transaction(self):
+        self.transaction = self.conn.transaction()
+        await self.transaction.start()
+
+    async def begin(self):
+        """
+        Run the rest of the request in one transaction, committed when the handler
+        returns and rolled back if it raises, HTTPExceptions included. Transactions
+        handlers open themselves become savepoints inside it.
+        """
+        self.atomic = True
+        if self.conn is not None and self.transaction is None:
+            await self.start_transaction()
+
+    def after_commit(self, callback: Callable[[], None]):
+        """
+        Run callback once the request's writes are committed: right away, since
+        handlers commit their own transactions, unless the request is one
+        transaction, in which case when it commits. It is dropped on rollback.
+        """
+        if self.atomic:
+            self.deferred.append(callback)
+        else:
+            callback()
+
+    async def release_idle(self):
+        """
+        Hand the connection back early if nothing is pending on it. It is acquired
+        again should anything ask for it later.
+        """
+        if not self.atomic:
+            await self.release()
+
+    async def release(self, failed: bool = False):
+        deferred, self.deferred = self.deferred, list()
+        if self.conn is not None:
+            context, transaction = self.context, self.transaction
+            self.context, self.conn, self.transaction = None, None, None
+            try:
+                if transaction is not None:
+                    if failed:
+                        await transaction.rollback()
+                    else:
+                        await transaction.commit()
+            finally:
+                await context.__aexit__(None, None, None)
+        if not failed:
+            for callback in deferred:
+                callback()
+
+
+# Scope keys a batch sets on the sub-requests it dispatches, so they share its user
+# and RequestDB instead of resolving their own; see api/batch.py.
+BATCH_USER = "phantasm.batch.user"
+BATCH_DB = "phantasm.batch.db"
+
+
+async def get_db(request: Request) -> AsyncIterator[RequestDB]:
+    if (shared := request.scope.get(BATCH_DB, None)) is not None:
+        # The batch releases it once every operation has run.
+        yield shared
+        return
+    db = RequestDB(phantasm.PGPOOL, request.scope)
+    try:
+        yield db
+    except BaseException:
+        await db.release(failed=True)
+        raise
+    await db.release()
+
+
+# Scoped to the handler, so the connection goes back to the pool (and an atomic
+# request commits) before the response is sent rather than after. Always depend on
+# it through this alias so FastAPI hands every dependency the same RequestDB.
+RequestConnection = Annotated[RequestDB, Depends(get_db, scope="function")]
+
+
+def decode_token(token: str) -> dict:
+    """
+    Decode and check an access token. Raises a 401 HTTPException if it isn't valid.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -44,63 +168,172 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Use
             raise credentials_exception
     except jwt.PyJWTError as e:
         raise credentials_exception
+    # Refresh tokens are only good for /auth/refresh.
+    if payload.get("refresh", False) or phantasm.REVOCATIONS.rejects(payload):
+        raise credentials_exception
+    return payload
 
-    async with phantasm.PGPOOL.acquire() as conn:
-        user = await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
+
+async def user_from_payload(payload: dict, db: Optional[RequestDB] = None) -> UserModel:
+    """
+    Load the user of a decoded token. Raises a 401 HTTPException if they're gone.
+    Uses the request's connection when given one, otherwise a connection from the pool.
+    """
+    async with (db or phantasm.PGPOOL).acquire() as conn:
+        user = await conn.fetchrow("SELECT * FROM users WHERE id = $1", payload["sub"])
 
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
     return UserModel(**user)
 
 
-async def get_acting_character(user: UserModel, character_id: int) -> ActiveAs:
-    async with phantasm.PGPOOL.acquire() as conn:
-        async with conn.transaction():
-            character_data = await conn.fetchrow(
-                "SELECT * FROM characters WHERE id = $1", character_id
-            )
-            if character_data is None:
-                raise HTTPException(status_code=404, detail="Character not found")
-            character = CharacterModel(**character_data)
-            if character.user_id != user.id:
-                raise HTTPException(
-                    status_code=403, detail="Character does not belong to you."
-                )
-            active = await conn.fetchrow(
-                "SELECT * FROM characters_active_view WHERE id = $1", character.id
-            )
-            if not active:
-                spoof = await conn.fetchrow(
-                    "SELECT * from character_spoofs WHERE character_id = $1 AND spoofed_name = $2",
-                    character.id,
-                    character.name,
-                )
-                if not spoof:
-                    spoof = await conn.fetchrow(
-                        "INSERT INTO character_spoofs (character_id, spoofed_name) VALUES ($1, $2) RETURNING *",
-                        character.id,
-                        character.name,
-                    )
-                new_active = await conn.fetchrow(
-                    "INSERT INTO characters_active (id, spoofing_id) VALUES ($1, $2) RETURNING *",
-                    character.id,
-                    spoof["id"],
-                )
-                active = await conn.fetchrow(
-                    "SELECT * FROM characters_active_view WHERE id = $1", character.id
-                )
-            await conn.execute(
-                "UPDATE characters SET last_active_at=now() WHERE id=$1",
-                character_id,
-            )
-            act = ActiveAs(
-                user=user,
-                character=character,
-                admin_level=active["admin_level"],
-                spoofed_name=active["spoofed_name"],
-                spoofing_id=active["spoofing_id"],
-                metadata=active["metadata"],
-                active_created_at=active["active_created_at"],
-            )
-            return act
+async def user_from_token(token: str, db: Optional[RequestDB] = None) -> UserModel:
+    """
+    Decode an access token and load its user. Raises a 401 HTTPException if either fails.
+    """
+    return await user_from_payload(decode_token(token), db)
+
+
+async def get_current_user(
+    request: Request, token: Annotated[str, Depends(oauth2_scheme)], db: RequestConnection
+) -> UserModel:
+    if (user := request.scope.get(BATCH_USER, None)) is not None:
+        return user
+    return await user_from_token(token, db)
+
+
+async def get_read_pool(
+    request: Request,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+) -> asyncpg.Pool | RequestDB:
+    """
+    The pool read-only handlers should use. This is the replica unless the replica is
+    unhealthy, the user or client wrote recently (on any worker, going by the
+    WROTE_COOKIE it sends), or the client sent "Cache-Control: no-cache".
+    Reads which land on the primary reuse the request's connection; reads which go to
+    the replica give it back first, so they don't hold a primary slot while they run.
+    Handlers which act as a character depend on get_acting_read_pool instead, so the
+    character is resolved before the connection goes back. A request made one
+    transaction always reads inside it, so it sees its own writes.
+    """
+    if db.atomic:
+        return db
+    fresh = "no-cache" in request.headers.get("Cache-Control", "")
+    pool = phantasm.REPLICA.pool_for(
+        user.id, fresh=fresh, wrote_at=wrote_at(request.cookies)
+    )
+    if pool is db.pool:
+        return db
+    # A batch keeps its connection for the operations still to come.
+    if BATCH_DB not in request.scope:
+        await db.release_idle()
+    return pool
+
+
+def mark_write(user: UserModel, db: RequestDB):
+    """
+    Keep this user's reads on the primary for a while so they see their own writes,
+    here and, through the response's WROTE_COOKIE, on every other worker.
+    """
+
+    def mark():
+        phantasm.REPLICA.mark_write(user.id)
+        if db.scope is not None:
+            db.scope[WROTE_SCOPE] = time.time()
+
+    db.after_commit(mark)
+
+
+# Loads a character with its active row, activating it as itself on first use, and
+# touches last_active_at, all in one statement. A character which exists but belongs
+# to someone else comes back with a null user_match and nothing written. The active
+# row may have been inserted by a concurrent first login that this statement's
+# snapshot can't see; ON CONFLICT DO UPDATE still finds it and RETURNING hands it back.
+ACTING_UPSERT = """
+WITH c AS (
+    SELECT * FROM characters WHERE id = $1
+), spoof AS (
+    INSERT INTO character_spoofs (character_id, spoofed_name)
+    SELECT c.id, c.name FROM c
+    WHERE c.user_id = $2
+      AND NOT EXISTS (SELECT 1 FROM characters_active WHERE id = c.id)
+    ON CONFLICT (character_id, spoofed_name)
+        DO UPDATE SET updated_at = character_spoofs.updated_at
+    RETURNING id, spoofed_name
+), inserted AS (
+    INSERT INTO characters_active (id, spoofing_id)
+    SELECT $1, spoof.id FROM spoof
+    ON CONFLICT (id) DO UPDATE SET spoofing_id = characters_active.spoofing_id
+    RETURNING id, admin_level, created_at, metadata, spoofing_id
+), active AS (
+    SELECT * FROM inserted
+    UNION ALL
+    SELECT id, admin_level, created_at, metadata, spoofing_id
+    FROM characters_active
+    WHERE id = $1 AND NOT EXISTS (SELECT 1 FROM inserted)
+), touched AS (
+    UPDATE characters SET last_active_at = now()
+    WHERE id = $1 AND user_id = $2
+    RETURNING id
+)
+SELECT c.*,
+       t.id AS user_match,
+       a.admin_level,
+       a.created_at AS active_created_at,
+       a.metadata,
+       a.spoofing_id,
+       coalesce(spoof.spoofed_name, s.spoofed_name) AS spoofed_name
+FROM c
+         LEFT JOIN touched t ON t.id = c.id
+         LEFT JOIN active a ON a.id = c.id
+         LEFT JOIN spoof ON spoof.id = a.spoofing_id
+         LEFT JOIN character_spoofs s ON s.id = a.spoofing_id
+"""
+
+
+async def get_acting_character(
+    user: UserModel, character_id: int, db: Optional[RequestDB] = None
+) -> ActiveAs:
+    if db is not None and (act := db.acting.get(character_id, None)) is not None:
+        return act
+    async with (db or phantasm.PGPOOL).acquire() as conn:
+        row = await conn.fetchrow(ACTING_UPSERT, character_id, user.id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Character not found")
+        if row["user_match"] is None:
+            raise HTTPException(status_code=403, detail="Character does not belong to you.")
+        act = ActiveAs(
+            user=user,
+            character=CharacterModel(**row),
+            admin_level=row["admin_level"],
+            spoofed_name=row["spoofed_name"],
+            spoofing_id=row["spoofing_id"],
+            metadata=row["metadata"],
+            active_created_at=row["active_created_at"],
+        )
+        await phantasm.PRESENCE.heartbeat(conn, act)
+        await phantasm.CHANNELS.ensure(conn, act.character.id)
+    if db is not None:
+        db.acting[character_id] = act
+    return act
+
+
+async def get_acting_read_pool(
+    request: Request,
+    user: Annotated[UserModel, Depends(get_current_user)],
+    db: RequestConnection,
+    character_id: int,
+) -> asyncpg.Pool | RequestDB:
+    """
+    get_read_pool for handlers acting as character_id. The character is resolved on
+    the request's connection first, so the handler's own get_acting_character call
+    is answered from db.acting and the replica read runs holding no primary slot.
+    """
+    await get_acting_character(user, character_id, db)
+    return await get_read_pool(request, user, db)
@@ -1,15 +1,51 @@
+import asyncio
+import contextlib
+import logging
+import re
+import signal
+import time
+import typing
 import mudpy
 import phantasm
 import importlib
 import asyncpg
 import orjson
-from lark import Lark
 from pathlib import Path
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, JSONResponse
 from hypercorn import Config
 from hypercorn.asyncio import serve
 from mudpy.game.application import Application as OldApplication
 from mudpy.utils import callables_from_module
+from .metrics import Metrics, MetricsMiddleware
+from .tracing import QueryTracer, TracingMiddleware
+from .workers import Supervisor, worker_identity, pool_settings, bind_socket
+from .replica import ReplicaRouter, WriteMarkerMiddleware
+from .compression import CompressionMiddleware, CompressionCache
+from .locks.lockhandler import create_parser
+from .events import EventHub
+from .names import CharacterDirectory, NAMES_CHANNEL
+from .presence import PresenceRegistry
+from .channels import ChannelAliases
+from .tokens import TokenRevocations
+from .throttle import LoginThrottle
+from .retention import LoginRecordRetention
+from .scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+# Run on every pooled connection at startup, with every parameter null so nothing
+# comes back. This fills each connection's statement cache, paying the type
+# introspection and server-side catalog lookups for the hottest queries before the
+# first request does. The text must match the handlers' queries exactly. Only
+# statements filtered on a parameter belong here; one without would really run.
+WARM_STATEMENTS = (
+    "SELECT * FROM users WHERE id = $1",
+    "SELECT * FROM characters WHERE id = $1",
+    "SELECT * FROM characters_active_view WHERE id = $1",
+    "SELECT * FROM board_view WHERE board_key = $1",
+    "SELECT * FROM board_post_view WHERE board_id = $1",
+)
 
 
 async def init_connection(conn: asyncpg.Connection):
@@ -20,6 +56,16 @@ async def init_connection(conn: asyncpg.Connection):
         schema="pg_catalog",
         format="text",
     )
+    if phantasm.METRICS:
+        conn.add_query_logger(phantasm.METRICS.record_query)
+    if phantasm.TRACER:
+        conn.add_query_logger(phantasm.TRACER.record_query)
+
+
+async def metrics_endpoint():
+    return PlainTextResponse(
+        phantasm.METRICS.render(), media_type="text/plain; version=0.0.4"
+    )
 
 
 class Application(OldApplication):
@@ -28,12 +74,63 @@ class Application(OldApplication):
         super().__init__()
         self.fastapi_config = None
         self.fastapi_instance = None
+        self.metrics_task = None
+        self.warmup_task = None
+        self.scheduler: typing.Optional[Scheduler] = None
+        self.worker_index = None
+        self.worker_count = 1
+        self.listen_socket = None
+        self.shutdown_event = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.startup_timings: dict[str, float] = dict()
+
+    @property
+    def is_supervisor(self) -> bool:
+        return self.worker_count > 1 and self.worker_index is None
+
+    async def setup_metrics(self):
+        settings = mudpy.SETTINGS["GAME"].get("metrics", dict())
+        if settings.get("enabled", True):
+            phantasm.METRICS = Metrics()
+
+        settings = mudpy.SETTINGS["GAME"].get("tracing", dict())
+        if settings.get("enabled", False):
+            phantasm.TRACER = QueryTracer(
+                slow_query_ms=settings.get("slow_query_ms", 50.0),
+                repeat_threshold=settings.get("repeat_threshold", 3),
+                explain=settings.get("explain", True),
+            )
 
     async def setup_asyncpg(self):
-        settings = mudpy.SETTINGS["GAME"]["postgresql"]
+        # Less the EventHub's LISTEN connection, which every worker holds on the primary.
+        settings = pool_settings(
+            mudpy.SETTINGS["GAME"]["postgresql"], self.worker_count, reserved=1
+        )
         pool = await asyncpg.create_pool(init=init_connection, **settings)
+        if phantasm.METRICS:
+            pool = phantasm.METRICS.watch_pool("primary", pool)
         phantasm.PGPOOL = pool
 
+        replica = None
+        settings = mudpy.SETTINGS["GAME"].get("replica", dict())
+        if replica_settings := settings.get("postgresql", None):
+            try:
+                replica = await asyncpg.create_pool(
+                    init=init_connection,
+                    **pool_settings(replica_settings, self.worker_count),
+                )
+            except (OSError, asyncpg.PostgresError) as err:
+                logger.error("Could not connect to the replica, reads stay on primary: %s", err)
+            else:
+                if phantasm.METRICS:
+                    replica = phantasm.METRICS.watch_pool("replica", replica)
+        phantasm.REPLICA = ReplicaRouter(
+            pool,
+            replica,
+            max_lag=settings.get("max_lag", 5.0),
+            sticky_seconds=settings.get("sticky_seconds", 10.0),
+        )
+
     async def setup_fastapi(self):
         settings = mudpy.SETTINGS
         shared = settings["SHARED"]
@@ -45,6 +142,10 @@ class Application(OldApplication):
         external = shared["external"]
         bind_to = f"{external}:{networking['port']}"
         self.fastapi_config.bind = [bind_to]
+        if self.worker_index is not None:
+            # Every worker binds its own SO_REUSEPORT socket on the same port.
+            self.listen_socket = bind_socket(external, networking["port"])
+            self.fastapi_config.bind = [f"fd://{self.listen_socket.fileno()}"]
 
         if Path(tls["certificate"]).exists():
             self.fastapi_config.certfile = tls["cert"]
@@ -54,27 +155,293 @@ class Application(OldApplication):
         self.fastapi_instance = FastAPI()
         routers = settings["FASTAPI"]["routers"]
         for k, v in routers.items():
-            v = importlib.import_module(v)
-            self.fastapi_instance.include_router(v.router, prefix=f"/{k}", tags=[k])
+            module = importlib.import_module(v)
+            self.fastapi_instance.include_router(module.router, prefix=f"/{k}", tags=[k])
+        self.fastapi_instance.add_api_route(
+            "/ready", self.ready_endpoint, include_in_schema=False
+        )
 
-    async def setup_lark(self):
-        absolute_phantasm = Path(phantasm.__file__).parent
-        grammar = absolute_phantasm / "grammar.lark"
-        with open(grammar, "r") as f:
-            data = f.read()
-            parser = Lark(data)
-            phantasm.LOCKPARSER = parser
+        replica = settings["GAME"].get("replica", dict())
+        self.fastapi_instance.add_middleware(
+            WriteMarkerMiddleware, sticky_seconds=replica.get("sticky_seconds", 10.0)
+        )
 
-    async def setup(self):
-        await super().setup()
-        await self.setup_lark()
-        await self.setup_asyncpg()
-        await self.setup_fastapi()
+        compression = settings["FASTAPI"].get("compression", dict())
+        if compression.get("enabled", True):
+            self.fastapi_instance.add_middleware(
+                CompressionMiddleware,
+                minimum_size=compression.get("minimum_size", 1024),
+                routes=dict(compression.get("routes", dict())),
+                cache=CompressionCache(
+                    max_entries=compression.get("cache_entries", 256),
+                    max_bytes=compression.get("cache_bytes", 16 * 1024 * 1024),
+                ),
+            )
+
+        if phantasm.METRICS:
+            self.fastapi_instance.add_middleware(
+                MetricsMiddleware, metrics=phantasm.METRICS
+            )
+            self.fastapi_instance.add_api_route(
+                "/metrics", metrics_endpoint, include_in_schema=False
+            )
 
+        if phantasm.TRACER:
+            self.fastapi_instance.add_middleware(
+                TracingMiddleware, tracer=phantasm.TRACER
+            )
+
+    async def setup_lark(self):
+        settings = mudpy.SETTINGS["GAME"].get("lark", dict())
+        phantasm.LOCKPARSER = await asyncio.to_thread(
+            create_parser, cache=settings.get("cache", True)
+        )
+
+    async def setup_lockfuncs(self):
         for k, v in mudpy.SETTINGS["GAME"].get("lockfuncs", dict()).items():
-            lock_funcs = callables_from_module(v)
+            lock_funcs = await asyncio.to_thread(callables_from_module, v)
             for name, func in lock_funcs.items():
                 phantasm.LOCKFUNCS[name] = func
 
+    async def warm_pool(self, pool: asyncpg.Pool):
+        """
+        Check out min_size connections at once and run WARM_STATEMENTS on each.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            connections = [
+                await stack.enter_async_context(pool.acquire())
+                for _ in range(pool.get_min_size())
+            ]
+
+            async def warm(conn: asyncpg.Connection):
+                for query in WARM_STATEMENTS:
+                    # Through fetch rather than prepare(), which skips the cache.
+                    count = max(map(int, re.findall(r"\$(\d+)", query)), default=0)
+                    await conn.fetch(query, *([None] * count))
+
+            await asyncio.gather(*(warm(conn) for conn in connections))
+
+    async def setup_events(self):
+        phantasm.EVENTS = EventHub(mudpy.SETTINGS["GAME"]["postgresql"])
+        await phantasm.EVENTS.start()
+
+    async def setup_names(self):
+        phantasm.NAMES = CharacterDirectory()
+        await phantasm.EVENTS.listen(NAMES_CHANNEL, phantasm.NAMES.on_notify)
+        async with phantasm.PGPOOL.acquire() as conn:
+            await phantasm.NAMES.load(conn)
+
+    async def setup_presence(self):
+        settings = mudpy.SETTINGS["GAME"].get("presence", dict())
+        phantasm.PRESENCE = PresenceRegistry(
+            idle_timeout=settings.get("idle_timeout", 3600.0),
+            broadcast_interval=settings.get("broadcast_interval", 30.0),
+            reap_batch=settings.get("reap_batch", 500),
+        )
+        async with phantasm.PGPOOL.acquire() as conn:
+            await phantasm.PRESENCE.load(conn)
+
+    async def setup_channels(self):
+        phantasm.CHANNELS = ChannelAliases()
+        async with phantasm.PGPOOL.acquire() as conn:
+            await phantasm.CHANNELS.load(conn)
+
+    async def setup_revocations(self):
+        phantasm.REVOCATIONS = TokenRevocations()
+        async with phantasm.PGPOOL.acquire() as conn:
+            await phantasm.REVOCATIONS.load(conn)
+
+    async def setup_throttle(self):
+        settings = mudpy.SETTINGS["GAME"].get("login_throttle", dict())
+        phantasm.THROTTLE = LoginThrottle(
+            window=settings.get("window", 900.0),
+            ip_free=settings.get("ip_free", 20),
+            account_free=settings.get("account_free", 5),
+            base_delay=settings.get("base_delay", 1.0),
+            max_delay=settings.get("max_delay", 900.0),
+        )
+        async with phantasm.PGPOOL.acquire() as conn:
+            await phantasm.THROTTLE.load(conn)
+
+    async def setup_warmup(self):
+        await self.warm_pool(phantasm.PGPOOL)
+        if phantasm.REPLICA.replica is not None:
+            await self.warm_pool(phantasm.REPLICA.replica)
+
+    async def timed(self, stage: str, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.startup_timings[stage] = time.perf_counter() - start
+
+    async def ready_endpoint(self):
+        if self.ready.is_set():
+            return JSONResponse({"ready": True})
+        return JSONResponse({"ready": False}, status_code=503)
+
+    async def setup(self):
+        await super().setup()
+        self.worker_index, self.worker_count = worker_identity()
+        if self.is_supervisor:
+            # The supervisor only manages workers; they do all of the setup below.
+            return
+        start = time.perf_counter()
+        # Everything below depends on the metrics and tracing hooks existing.
+        await self.timed("metrics", self.setup_metrics())
+        await asyncio.gather(
+            self.timed("lark", self.setup_lark()),
+            self.timed("asyncpg", self.setup_asyncpg()),
+            self.timed("fastapi", self.setup_fastapi()),
+            self.timed("lockfuncs", self.setup_lockfuncs()),
+            self.timed("events", self.setup_events()),
+        )
+        await asyncio.gather(
+            self.timed("names", self.setup_names()),
+            self.timed("presence", self.setup_presence()),
+            self.timed("channels", self.setup_channels()),
+            self.timed("revocations", self.setup_revocations()),
+            self.timed("throttle", self.setup_throttle()),
+        )
+        self.startup_timings["total"] = time.perf_counter() - start
+
+        logger.info(
+            "Startup finished: %s",
+            ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in self.startup_timings.items()),
+        )
+        if phantasm.METRICS:
+            for stage, elapsed in self.startup_timings.items():
+                phantasm.METRICS.startup.set(elapsed, stage)
+
+    async def warm_up(self):
+        """
+        Warm the pools while already serving, then report ready. /ready answers 503
+        until then, so load balancers hold traffic back from a cold worker.
+        """
+        try:
+            await self.timed("warmup", self.setup_warmup())
+        except (OSError, asyncpg.PostgresError) as err:
+            logger.warning("Pool warmup failed, serving cold: %s", err)
+        elapsed = self.startup_timings["warmup"]
+        logger.info("Warmup finished: %.1fms", elapsed * 1000)
+        if phantasm.METRICS:
+            phantasm.METRICS.startup.set(elapsed, "warmup")
+        if not self.shutdown_event.is_set():
+            self.ready.set()
+
+    @property
+    def drain_timeout(self) -> float:
+        return mudpy.SETTINGS["GAME"].get("scheduler", dict()).get("drain_timeout", 30.0)
+
+    def create_scheduler(self) -> Scheduler:
+        """
+        The background jobs of a game process. Jobs marked single run in one worker
+        at a time; the rest keep each worker's own in-memory state tidy.
+        """
+        settings = mudpy.SETTINGS["GAME"]
+        scheduler = Scheduler(phantasm.PGPOOL)
+        if phantasm.REPLICA.replica is not None:
+            scheduler.every(
+                "replica.poll",
+                settings.get("replica", dict()).get("check_interval", 1.0),
+                phantasm.REPLICA.poll,
+            )
+
+        presence = settings.get("presence", dict())
+        interval = presence.get("reap_interval", 60.0)
+
+        async def expire_presence():
+            phantasm.CHANNELS.drop(phantasm.PRESENCE.expire())
+
+        async def reap_presence():
+            await phantasm.PRESENCE.reap(phantasm.PGPOOL)
+
+        scheduler.every("presence.expire", interval, expire_presence)
+        scheduler.every(
+            "presence.reap", interval, reap_presence, jitter=interval / 10, single=True
+        )
+
+        interval = settings.get("tokens", dict()).get("purge_interval", 3600.0)
+
+        async def prune_tokens():
+            phantasm.REVOCATIONS.prune()
+
+        async def purge_tokens():
+            await phantasm.REVOCATIONS.purge(phantasm.PGPOOL)
+
+        scheduler.every("tokens.prune", interval, prune_tokens)
+        scheduler.every(
+            "tokens.purge", interval, purge_tokens, jitter=interval / 10, single=True
+        )
+
+        async def prune_throttle():
+            phantasm.THROTTLE.prune()
+
+        scheduler.every("throttle.prune", 60.0, prune_throttle)
+
+        loginrecords = settings.get("loginrecords", dict())
+        retention = LoginRecordRetention(
+            loginrecords.get("archive_dir", "archive/loginrecords"),
+            retain_months=loginrecords.get("retain_months", 12),
+            months_ahead=loginrecords.get("months_ahead", 2),
+        )
+
+        async def retain_loginrecords():
+            await retention.run(phantasm.PGPOOL)
+
+        scheduler.cron(
+            "loginrecords.retention",
+            loginrecords.get("schedule", "15 4 * * *"),
+            retain_loginrecords,
+            single=True,
+        )
+        return scheduler
+
+    def begin_shutdown(self):
+        # Report unready first so load balancers stop routing here while we drain.
+        self.ready.clear()
+        self.shutdown_event.set()
+
     async def start(self):
-        await serve(self.fastapi_instance, self.fastapi_config)
+        if self.is_supervisor:
+            settings = mudpy.SETTINGS["GAME"].get("workers", dict())
+            await Supervisor(
+                self.worker_count,
+                restart_delay=settings.get("restart_delay", 1.0),
+                max_restart_delay=settings.get("max_restart_delay", 60.0),
+                max_restarts=settings.get("max_restarts", 5),
+                stable_after=settings.get("stable_after", 60.0),
+            ).run()
+            return
+        if phantasm.METRICS:
+            interval = mudpy.SETTINGS["GAME"].get("metrics", dict()).get(
+                "loop_lag_interval", 0.5
+            )
+            self.metrics_task = asyncio.create_task(
+                phantasm.METRICS.monitor_loop_lag(interval)
+            )
+        if phantasm.REPLICA.replica is not None:
+            await phantasm.REPLICA.check()
+        self.scheduler = self.create_scheduler()
+        self.scheduler.start()
+        self.warmup_task = asyncio.create_task(self.warm_up())
+        # Single process or worker, a signal reports unready before hypercorn drains.
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.begin_shutdown)
+        await serve(
+            self.fastapi_instance,
+            self.fastapi_config,
+            shutdown_trigger=self.shutdown_event.wait,
+        )
+        # hypercorn has drained in-flight requests; let running jobs finish, then
+        # release our connections.
+        self.warmup_task.cancel()
+        await self.scheduler.drain(self.drain_timeout)
+        if self.metrics_task:
+            self.metrics_task.cancel()
+        await phantasm.EVENTS.stop()
+        if phantasm.REPLICA.replica is not None:
+            await phantasm.REPLICA.replica.close()
+        await phantasm.PGPOOL.close()
+
@@ -0,0 +1,122 @@
+import logging
+import typing
+
+import asyncpg
+import phantasm
+
+from .events import event_handler, reconnect_handler
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_alias(alias: str) -> str:
+    return alias.strip().lower()
+
+
+class ChannelAliases:
+    """
+    The channel aliases of every character active in this process, held in memory so
+    that resolving the first word of an input line ("pub hello") never touches Postgres.
+
+    A character's aliases are loaded when it becomes active here (ensure(), called by
+    get_acting_character) and dropped when it leaves. Joins, leaves and alias changes
+    publish "channel.aliases", which every worker applies to characters it holds.
+    Aliases are unique per character, ignoring case, so each resolves to one channel.
+    """
+
+    def __init__(self):
+        # character_id -> alias -> channel_id
+        self.by_character: dict[int, dict[str, int]] = dict()
+        # Characters being loaded, and those of them changed while loading.
+        self.loading: set[int] = set()
+        self.changed: set[int] = set()
+
+    async def load(self, conn: asyncpg.Connection):
+        """
+        Load every character which is already active, so a restart doesn't leave them
+        waiting on a query each.
+        """
+        rows = await conn.fetch(
+            """
+            SELECT m.character_id, m.channel_id, m.aliases
+            FROM channel_members m
+                     JOIN characters_active a ON a.id = m.character_id
+            """
+        )
+        self.by_character.clear()
+        for row in rows:
+            aliases = self.by_character.setdefault(row["character_id"], dict())
+            for alias in row["aliases"]:
+                aliases[normalize_alias(alias)] = row["channel_id"]
+        logger.info("Loaded channel aliases for %d characters.", len(self.by_character))
+
+    async def ensure(self, conn: asyncpg.Connection, character_id: int) -> dict[str, int]:
+        """
+        The character's aliases, loading them on first use.
+        """
+        if (aliases := self.by_character.get(character_id, None)) is not None:
+            return aliases
+        self.loading.add(character_id)
+        try:
+            while True:
+                self.changed.discard(character_id)
+                rows = await conn.fetch(
+                    "SELECT channel_id, aliases FROM channel_members WHERE character_id = $1",
+                    character_id,
+                )
+                # Another request may have loaded it meanwhile; an event which arrived
+                # during the query may not be in what we read, so read again.
+                if (aliases := self.by_character.get(character_id, None)) is not None:
+                    return aliases
+                if character_id not in self.changed:
+                    break
+        finally:
+            self.loading.discard(character_id)
+            self.changed.discard(character_id)
+        aliases = {
+            normalize_alias(alias): row["channel_id"]
+            for row in rows
+            for alias in row["aliases"]
+        }
+        self.by_character[character_id] = aliases
+        return aliases
+
+    def resolve(self, character_id: int, alias: str) -> typing.Optional[int]:
+        if (aliases := self.by_character.get(character_id, None)) is None:
+            return None
+        return aliases.get(normalize_alias(alias), None)
+
+    def set(self, character_id: int, channel_id: int, aliases: typing.Optional[list[str]]):
+        """
+        Replace the aliases the character has for channel_id. None means they left it.
+        """
+        if (current := self.by_character.get(character_id, None)) is None:
+            if character_id in self.loading:
+                self.changed.add(character_id)
+            return
+        for alias in [k for k, v in current.items() if v == channel_id]:
+            del current[alias]
+        for alias in aliases or ():
+            current[normalize_alias(alias)] = channel_id
+
+    def drop(self, character_ids: typing.Iterable[int]):
+        for character_id in character_ids:
+            self.by_character.pop(character_id, None)
+
+
+@event_handler("channel.aliases")
+def on_channel_aliases(event: dict):
+    if phantasm.CHANNELS:
+        phantasm.CHANNELS.set(event["character_id"], event["channel_id"], event["aliases"])
+
+
+@event_handler("presence.left")
+def on_channel_presence_left(event: dict):
+    if phantasm.CHANNELS:
+        phantasm.CHANNELS.drop(event["character_ids"])
+
+
+@reconnect_handler
+async def reload_channel_aliases(conn: asyncpg.Connection):
+    if phantasm.CHANNELS:
+        await phantasm.CHANNELS.load(conn)
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import typing
+from collections import OrderedDict
+
+import brotli
+import zstandard
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# In order of preference when the client rates several encodings equally.
+ENCODERS: dict[str, typing.Callable[[bytes], bytes]] = {
+    "br": lambda data: brotli.compress(data, quality=5),
+    "zstd": lambda data: zstandard.ZstdCompressor(level=6).compress(data),
+    "gzip": lambda data: gzip.compress(data, compresslevel=6),
+}
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def negotiate(accept_encoding: str) -> typing.Optional[str]:
+    """
+    Pick the best encoding we support from an Accept-Encoding header.
+    """
+    ratings = dict()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        ratings[name] = q
+    best, best_q = None, 0.0
+    for name in ENCODERS:
+        q = ratings.get(name, ratings.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionCache:
+    """
+    LRU of compressed bodies keyed by (etag, encoding), bounded by entries and bytes.
+    A hot listing is compressed once and then served from here until it changes.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+    def get(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        if (data := self.entries.get(key, None)) is not None:
+            self.entries.move_to_end(key)
+            return data
+        data = ENCODERS[encoding](body)
+        self.entries[key] = data
+        self.size += len(data)
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+        return data
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware which compresses JSON and text responses with brotli, zstd or gzip.
+
+    Successful responses are tagged with an ETag derived from the body, which both
+    answers If-None-Match with a 304 and keys the cache of compressed bodies.
+    Responses below the size threshold of their route are sent as they are.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        routes: typing.Optional[dict[str, int]] = None,
+        cache: typing.Optional[CompressionCache] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.routes = routes or dict()
+        self.cache = cache or CompressionCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""))
+        if_none_match = request_headers.get("if-none-match", None)
+
+        start_message = None
+        buffering = False
+        chunks = []
+
+        async def send_wrapper(message):
+            nonlocal start_message, buffering
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                buffering = (
+                    message["status"] == 200
+                    and "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                )
+                if buffering:
+                    start_message = message
+                else:
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or not buffering:
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self.send_buffered(
+                scope, send, start_message, b"".join(chunks), encoding, if_none_match
+            )
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def send_buffered(
+        self, scope, send, start_message, body: bytes, encoding, if_none_match
+    ):
+        headers = MutableHeaders(scope=start_message)
+        if (etag := headers.get("etag", None)) is None:
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            headers["ETag"] = etag
+        headers.add_vary_header("Accept-Encoding")
+
+        # If-None-Match only short-circuits reads; a write must still be answered.
+        if (
+            if_none_match
+            and scope["method"] in ("GET", "HEAD")
+            and etag in (tag.strip() for tag in if_none_match.split(","))
+        ):
+            del headers["content-length"]
+            start_message["status"] = 304
+            await send(start_message)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        route = scope.get("route", None)
+        threshold = self.routes.get(getattr(route, "path", None), self.minimum_size)
+        if encoding and len(body) >= threshold:
+            body = self.cache.get(etag, encoding, body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import typing
+from collections import defaultdict
+
+import asyncpg
+import orjson
+import phantasm
+
+logger = logging.getLogger(__name__)
+
+EVENT_CHANNEL = "phantasm_events"
+
+# Keys of [game.postgresql] which configure the pool rather than a connection.
+POOL_ONLY_KEYS = (
+    "min_size",
+    "max_size",
+    "max_queries",
+    "max_inactive_connection_lifetime",
+    "setup",
+    "init",
+    "reset",
+)
+
+
+async def publish(conn: asyncpg.Connection, event_type: str, **data):
+    """
+    Publish a change event through Postgres NOTIFY. Inside a transaction, the event is
+    only delivered if and when the transaction commits.
+    """
+    data["type"] = event_type
+    await conn.execute(
+        "SELECT pg_notify($1, $2)", EVENT_CHANNEL, orjson.dumps(data).decode("utf-8")
+    )
+
+
+class Subscription:
+    """
+    One realtime client. Events are queued for its connection handler to send; a client
+    too slow to keep up with its queue is marked overflowed and should be disconnected.
+    """
+
+    def __init__(self, acting, max_queue: int = 256):
+        self.acting = acting
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def offer(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+# Given an event and the current subscribers, returns the subscribers allowed to see it.
+EventFilter = typing.Callable[[dict, list[Subscription]], typing.Awaitable[list[Subscription]]]
+
+# Registered at import time by the modules which own each kind of event.
+FILTERS: dict[str, EventFilter] = dict()
+HANDLERS: dict[str, list[typing.Callable[[dict], None]]] = defaultdict(list)
+RECONNECT_HANDLERS: list[typing.Callable[[asyncpg.Connection], typing.Awaitable[None]]] = list()
+
+
+def event_filter(event_type: str):
+    """
+    Decorator registering the filter which decides who may receive event_type.
+    """
+    def decorator(func: EventFilter) -> EventFilter:
+        FILTERS[event_type] = func
+        return func
+
+    return decorator
+
+
+def event_handler(event_type: str):
+    """
+    Decorator registering func(event) to run for every event_type, in every worker.
+    """
+    def decorator(func):
+        HANDLERS[event_type].append(func)
+        return func
+
+    return decorator
+
+
+def reconnect_handler(func):
+    """
+    Decorator registering func(conn) to run, in a worker whose listener has lost its
+    connection and got it back, to catch up on the events missed meanwhile. conn
+    comes from the primary pool.
+    """
+    RECONNECT_HANDLERS.append(func)
+    return func
+
+
+class EventHub:
+    """
+    Every worker holds one dedicated LISTEN connection. Notifications on EVENT_CHANNEL
+    are decoded once, passed to the HANDLERS for their type (for cache invalidation and
+    the like), then run through FILTERS and fanned out to this worker's realtime
+    subscribers. Event types without a registered filter are never sent to clients.
+    Other channels can be listened to with listen().
+
+    NOTIFYs sent while the listener is disconnected are lost, so after reconnecting it
+    runs the RECONNECT_HANDLERS, which reload or drop whatever those events maintain.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = {k: v for k, v in settings.items() if k not in POOL_ONLY_KEYS}
+        self.conn: typing.Optional[asyncpg.Connection] = None
+        self.channels: dict[str, typing.Callable[[str], None]] = dict()
+        self.subscribers: set[Subscription] = set()
+        self.closing = False
+        # Background tasks, held so they aren't collected before they finish.
+        self.tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        self.channels.setdefault(EVENT_CHANNEL, self.on_event)
+        await self.connect()
+
+    async def connect(self):
+        self.conn = await asyncpg.connect(**self.settings)
+        self.conn.add_termination_listener(self.on_terminated)
+        for channel in self.channels:
+            await self.conn.add_listener(channel, self.on_notify)
+
+    def on_terminated(self, conn):
+        if not self.closing:
+            logger.warning("Event listener connection lost, reconnecting.")
+            self.spawn(self.reconnect())
+
+    def spawn(self, coro: typing.Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def reconnect(self):
+        delay = 0.5
+        while not self.closing:
+            try:
+                await self.connect()
+                break
+            except (OSError, asyncpg.PostgresError) as err:
+                logger.warning("Event listener reconnect failed: %s", err)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        else:
+            return
+        await self.catch_up()
+
+    async def catch_up(self):
+        logger.info("Event listener reconnected, reloading what it missed.")
+        async with phantasm.PGPOOL.acquire() as conn:
+            for handler in RECONNECT_HANDLERS:
+                try:
+                    await handler(conn)
+                except Exception:
+                    logger.exception("Reconnect handler %s failed", handler.__qualname__)
+
+    async def stop(self):
+        self.closing = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.conn is not None:
+            await self.conn.close()
+
+    async def listen(self, channel: str, callback: typing.Callable[[str], None]):
+        """
+        Call callback(payload) for every NOTIFY on channel.
+        """
+        self.channels[channel] = callback
+        if self.conn is not None:
+            await self.conn.add_listener(channel, self.on_notify)
+
+    def on_notify(self, conn, pid, channel, payload):
+        self.channels[channel](payload)
+
+    def on_event(self, payload: str):
+        event = orjson.loads(payload)
+        for handler in HANDLERS.get(event["type"], ()):
+            handler(event)
+        # Only event types with a filter are ever pushed to clients.
+        if self.subscribers and (event_filter := FILTERS.get(event["type"], None)):
+            self.spawn(self.deliver(event, event_filter))
+
+    async def deliver(self, event: dict, event_filter: EventFilter):
+        try:
+            subscribers = await event_filter(event, list(self.subscribers))
+        except Exception:
+            logger.exception("Event filter for %s failed", event["type"])
+            return
+        for subscriber in subscribers:
+            subscriber.offer(event)
+
+    def subscribe(self, acting, max_queue: int = 256) -> Subscription:
+        subscription = Subscription(acting, max_queue)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
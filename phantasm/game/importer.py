@@ -0,0 +1,533 @@
+#!/usr/bin/env python
+"""
+Offline bulk import of legacy game data: characters, Myrddin BBS boards, posts and
+read state, and channel history.
+
+    python -m phantasm.game.importer --dsn postgresql://... dump.jsonl [dump2.tsv ...]
+
+Run it with the game stopped. Game processes keep in-memory copies of character names
+and the like which only catch up with this import when they restart.
+
+A source is JSON lines (.jsonl or .json), one object per line with a "kind", or a
+flatfile: tab separated lines whose first field is the kind and whose other fields are
+those listed for it in FLAT_FIELDS, with \\t, \\n and \\\\ escaped. Kinds are:
+
+    character        name, email, created_at
+    board            board, name, description, anonymous_name
+    post             board, post, author, spoofed_name, title, body, created_at
+    read             email, board, post, read_at
+    channel_message  channel, author, message, created_at
+
+`board` is a board key such as "3" or "HYD2" and `post` a post key such as "12" or
+"12.3". Users are matched by email and created if missing; channels by name, likewise.
+An author's spoofed_name defaults to their own name.
+
+Every kind is loaded in its own pass over each source, in the order above, in batches
+written with COPY. Each batch commits together with its checkpoint, so an interrupted
+import resumes after the last batch it finished. When a table starts out empty, its
+non-unique indexes and its triggers are set aside during its pass and rebuilt after.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+import typing
+from datetime import datetime, timezone
+
+import asyncpg
+import orjson
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("character", "board", "post", "read", "channel_message")
+
+FLAT_FIELDS = {
+    "character": ("name", "email", "created_at"),
+    "board": ("board", "name", "description", "anonymous_name"),
+    "post": ("board", "post", "author", "spoofed_name", "title", "body", "created_at"),
+    "read": ("email", "board", "post", "read_at"),
+    "channel_message": ("channel", "author", "message", "created_at"),
+}
+
+# The tables each kind is copied into.
+TABLES = {
+    "character": ("characters",),
+    "board": ("boards",),
+    "post": ("character_spoofs", "board_posts"),
+    "read": ("board_posts_read",),
+    "channel_message": ("channels", "channel_messages"),
+}
+
+RE_BOARD_KEY = re.compile(r"^(?P<abbr>[a-zA-Z]+)?(?P<order>\d+)$")
+RE_POST_KEY = re.compile(r"^(?P<order>\d+)(?:\.(?P<sub>\d+))?$")
+RE_ESCAPE = re.compile(r"\\(.)")
+ESCAPES = {"t": "\t", "n": "\n", "\\": "\\"}
+
+
+def unescape(value: str) -> str:
+    return RE_ESCAPE.sub(lambda m: ESCAPES.get(m[1], m[0]), value)
+
+
+def iter_records(path: str, kind: str) -> typing.Iterator[tuple[int, dict]]:
+    """
+    Yield (line number, record) for every record of one kind in a source.
+    """
+    flat = not path.endswith((".jsonl", ".json"))
+    with open(path, "rb") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue
+            if flat:
+                fields = line.decode("utf-8").split("\t")
+                if fields[0] != kind:
+                    continue
+                values = [unescape(v) if v else None for v in fields[1:]]
+                yield lineno, dict(zip(FLAT_FIELDS[kind], values))
+            else:
+                record = orjson.loads(line)
+                if record.get("kind", None) == kind:
+                    yield lineno, record
+
+
+def batched(records: typing.Iterator, size: int) -> typing.Iterator[list]:
+    batch = list()
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def timestamp(value: typing.Optional[str]) -> datetime:
+    if not value:
+        return datetime.now(tz=timezone.utc)
+    stamp = datetime.fromisoformat(value)
+    return stamp if stamp.tzinfo else stamp.replace(tzinfo=timezone.utc)
+
+
+def post_key(value: str) -> typing.Optional[tuple[int, int]]:
+    if not (matched := RE_POST_KEY.match(str(value).strip())):
+        return None
+    return int(matched["order"]), int(matched["sub"] or 0)
+
+
+class Importer:
+    """
+    Resolves names to ids from in-memory maps which are loaded once and extended as
+    rows are created, so a batch costs a COPY and at most a couple of bulk inserts.
+    """
+
+    def __init__(self, conn: asyncpg.Connection, batch_size: int = 10_000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.users: dict[str, typing.Any] = dict()
+        self.characters: dict[str, int] = dict()
+        self.spoofs: dict[tuple[int, str], int] = dict()
+        self.factions: dict[str, int] = dict()
+        self.boards: dict[str, int] = dict()
+        self.channels: dict[str, int] = dict()
+        self.skipped = 0
+
+    async def load_maps(self):
+        conn = self.conn
+        for row in await conn.fetch("SELECT id, email FROM users"):
+            self.users[row["email"].lower()] = row["id"]
+        for row in await conn.fetch(
+            "SELECT id, name FROM characters WHERE deleted_at IS NULL"
+        ):
+            self.characters[row["name"].lower()] = row["id"]
+        for row in await conn.fetch(
+            "SELECT id, character_id, spoofed_name FROM character_spoofs"
+        ):
+            self.spoofs[(row["character_id"], row["spoofed_name"].lower())] = row["id"]
+        for row in await conn.fetch("SELECT id, abbreviation FROM factions"):
+            self.factions[row["abbreviation"].lower()] = row["id"]
+        for row in await conn.fetch("SELECT id, board_key FROM board_view"):
+            self.boards[row["board_key"].lower()] = row["id"]
+        for row in await conn.fetch("SELECT id, name FROM channels"):
+            self.channels[row["name"].lower()] = row["id"]
+
+    # Checkpoints and deferred indexes, both kept in tables from migration 007.
+
+    async def checkpoint(self, source: str, kind: str) -> int:
+        line = await self.conn.fetchval(
+            "SELECT line FROM import_checkpoints WHERE source = $1 AND kind = $2",
+            source,
+            kind,
+        )
+        return line or 0
+
+    async def save_checkpoint(self, source: str, kind: str, line: int):
+        await self.conn.execute(
+            """
+            INSERT INTO import_checkpoints (source, kind, line)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (source, kind) DO UPDATE SET line = EXCLUDED.line, updated_at = now()
+            """,
+            source,
+            kind,
+            line,
+        )
+
+    async def defer(self, table: str):
+        """
+        Set aside the non-unique indexes and user triggers of an empty table. What was
+        set aside is recorded first, so a crashed import still restores it later.
+        """
+        conn = self.conn
+        if await conn.fetchval(f'SELECT EXISTS (SELECT 1 FROM "{table}")'):
+            return
+        async with conn.transaction():
+            indexes = await conn.fetch(
+                """
+                SELECT i.relname AS name, pg_get_indexdef(x.indexrelid) AS definition
+                FROM pg_index x
+                         JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = $1::regclass
+                  AND NOT x.indisunique
+                  AND NOT x.indisprimary
+                """,
+                table,
+            )
+            triggers = await conn.fetch(
+                """
+                SELECT tgname AS name
+                FROM pg_trigger
+                WHERE tgrelid = $1::regclass AND NOT tgisinternal AND tgenabled <> 'D'
+                """,
+                table,
+            )
+            for index in indexes:
+                await conn.execute(
+                    "INSERT INTO import_deferred (table_name, kind, name, definition) VALUES ($1, 'index', $2, $3)",
+                    table,
+                    index["name"],
+                    index["definition"],
+                )
+                await conn.execute(f'DROP INDEX "{index["name"]}"')
+            for trigger in triggers:
+                await conn.execute(
+                    "INSERT INTO import_deferred (table_name, kind, name) VALUES ($1, 'trigger', $2)",
+                    table,
+                    trigger["name"],
+                )
+                await conn.execute(
+                    f'ALTER TABLE "{table}" DISABLE TRIGGER "{trigger["name"]}"'
+                )
+        if indexes or triggers:
+            logger.info(
+                "Deferred %d indexes and %d triggers on %s.",
+                len(indexes),
+                len(triggers),
+                table,
+            )
+
+    async def restore(self, table: str):
+        conn = self.conn
+        deferred = await conn.fetch(
+            "SELECT id, kind, name, definition FROM import_deferred WHERE table_name = $1",
+            table,
+        )
+        for item in deferred:
+            start = time.perf_counter()
+            async with conn.transaction():
+                if item["kind"] == "index":
+                    await conn.execute(item["definition"])
+                else:
+                    await conn.execute(
+                        f'ALTER TABLE "{table}" ENABLE TRIGGER "{item["name"]}"'
+                    )
+                await conn.execute("DELETE FROM import_deferred WHERE id = $1", item["id"])
+            logger.info(
+                "Restored %s %s on %s in %.1fs.",
+                item["kind"],
+                item["name"],
+                table,
+                time.perf_counter() - start,
+            )
+        if deferred:
+            await conn.execute(f'ANALYZE "{table}"')
+
+    # One loader per kind. Each gets a batch of records and returns rows written.
+
+    async def ensure_users(self, emails: typing.Iterable[str]):
+        missing = sorted({e.lower() for e in emails if e.lower() not in self.users})
+        if not missing:
+            return
+        rows = await self.conn.fetch(
+            """
+            INSERT INTO users (email)
+            SELECT * FROM unnest($1::citext[])
+            ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+            RETURNING id, email
+            """,
+            missing,
+        )
+        for row in rows:
+            self.users[row["email"].lower()] = row["id"]
+
+    async def load_character(self, records: list[dict]) -> int:
+        await self.ensure_users(r["email"] for r in records if r.get("email"))
+        rows = list()
+        for record in records:
+            key = record["name"].lower()
+            if key in self.characters or not record.get("email"):
+                self.skipped += key not in self.characters
+                continue
+            stamp = timestamp(record.get("created_at"))
+            rows.append((self.users[record["email"].lower()], record["name"], stamp, stamp, stamp))
+            # Reserve the name so duplicates within the batch are skipped.
+            self.characters[key] = 0
+        if rows:
+            await self.conn.copy_records_to_table(
+                "characters",
+                records=rows,
+                columns=("user_id", "name", "created_at", "last_active_at", "updated_at"),
+            )
+            created = await self.conn.fetch(
+                "SELECT id, name FROM characters WHERE name = ANY($1::citext[]) AND deleted_at IS NULL",
+                [r[1] for r in rows],
+            )
+            for row in created:
+                self.characters[row["name"].lower()] = row["id"]
+        return len(rows)
+
+    async def load_board(self, records: list[dict]) -> int:
+        rows = list()
+        for record in records:
+            key = str(record["board"]).lower()
+            if key in self.boards or not (matched := RE_BOARD_KEY.match(key)):
+                self.skipped += key not in self.boards
+                continue
+            faction_id = None
+            if abbr := matched["abbr"]:
+                if (faction_id := self.factions.get(abbr, None)) is None:
+                    self.skipped += 1
+                    continue
+            rows.append(
+                (
+                    faction_id,
+                    int(matched["order"]),
+                    record["name"],
+                    record.get("description", None),
+                    record.get("anonymous_name", None),
+                )
+            )
+            self.boards[key] = 0
+        if rows:
+            await self.conn.copy_records_to_table(
+                "boards",
+                records=rows,
+                columns=("faction_id", "board_order", "name", "description", "anonymous_name"),
+            )
+            for row in await self.conn.fetch("SELECT id, board_key FROM board_view"):
+                self.boards[row["board_key"].lower()] = row["id"]
+        return len(rows)
+
+    async def ensure_spoofs(self, pairs: set[tuple[int, str]]):
+        """
+        Create every (character id, spoofed name) not already known, in one statement.
+        """
+        missing = [p for p in pairs if (p[0], p[1].lower()) not in self.spoofs]
+        if not missing:
+            return
+        rows = await self.conn.fetch(
+            """
+            INSERT INTO character_spoofs (character_id, spoofed_name)
+            SELECT * FROM unnest($1::int[], $2::citext[])
+            ON CONFLICT (character_id, spoofed_name) DO UPDATE SET updated_at = now()
+            RETURNING id, character_id, spoofed_name
+            """,
+            [p[0] for p in missing],
+            [p[1] for p in missing],
+        )
+        for row in rows:
+            self.spoofs[(row["character_id"], row["spoofed_name"].lower())] = row["id"]
+
+    def author(self, record: dict) -> typing.Optional[tuple[int, str]]:
+        if not (character_id := self.characters.get(str(record["author"]).lower(), None)):
+            return None
+        return character_id, record.get("spoofed_name", None) or record["author"]
+
+    async def load_post(self, records: list[dict]) -> int:
+        await self.ensure_spoofs(
+            {author for r in records if (author := self.author(r)) is not None}
+        )
+        rows = list()
+        for record in records:
+            board_id = self.boards.get(str(record["board"]).lower(), None)
+            author = self.author(record)
+            key = post_key(record["post"])
+            if not (board_id and author and key):
+                self.skipped += 1
+                continue
+            stamp = timestamp(record.get("created_at"))
+            rows.append(
+                (
+                    board_id,
+                    key[0],
+                    key[1],
+                    self.spoofs[(author[0], author[1].lower())],
+                    record.get("title", None) or "",
+                    record.get("body", None) or "",
+                    stamp,
+                    stamp,
+                )
+            )
+        if rows:
+            await self.conn.copy_records_to_table(
+                "board_posts",
+                records=rows,
+                columns=(
+                    "board_id",
+                    "post_order",
+                    "sub_order",
+                    "spoof_id",
+                    "title",
+                    "body",
+                    "created_at",
+                    "updated_at",
+                ),
+            )
+        return len(rows)
+
+    async def load_read(self, records: list[dict]) -> int:
+        wanted = dict()
+        for record in records:
+            user_id = self.users.get(str(record["email"]).lower(), None)
+            board_id = self.boards.get(str(record["board"]).lower(), None)
+            key = post_key(record["post"])
+            if not (user_id and board_id and key):
+                self.skipped += 1
+                continue
+            wanted[(user_id, board_id, *key)] = timestamp(record.get("read_at"))
+        if not wanted:
+            return 0
+        keys = list(wanted)
+        # Resolve post ids in bulk, leaving out reads which already exist.
+        found = await self.conn.fetch(
+            """
+            SELECT x.n, p.id
+            FROM unnest($1::uuid[], $2::int[], $3::int[], $4::int[])
+                     WITH ORDINALITY AS x(user_id, board_id, post_order, sub_order, n)
+                     JOIN board_posts p
+                          ON p.board_id = x.board_id
+                              AND p.post_order = x.post_order
+                              AND p.sub_order = x.sub_order
+            WHERE NOT EXISTS (SELECT 1
+                              FROM board_posts_read r
+                              WHERE r.user_id = x.user_id
+                                AND r.post_id = p.id)
+            """,
+            [k[0] for k in keys],
+            [k[1] for k in keys],
+            [k[2] for k in keys],
+            [k[3] for k in keys],
+        )
+        self.skipped += len(keys) - len(found)
+        rows = [(row["id"], keys[row["n"] - 1][0], wanted[keys[row["n"] - 1]]) for row in found]
+        if rows:
+            await self.conn.copy_records_to_table(
+                "board_posts_read", records=rows, columns=("post_id", "user_id", "read_at")
+            )
+        return len(rows)
+
+    async def ensure_channels(self, names: typing.Iterable[str]):
+        missing = sorted({n for n in names if n.lower() not in self.channels})
+        if not missing:
+            return
+        rows = await self.conn.fetch(
+            "INSERT INTO channels (name) SELECT * FROM unnest($1::citext[]) RETURNING id, name",
+            missing,
+        )
+        for row in rows:
+            self.channels[row["name"].lower()] = row["id"]
+
+    async def load_channel_message(self, records: list[dict]) -> int:
+        await self.ensure_channels(r["channel"] for r in records if r.get("channel"))
+        rows = list()
+        for record in records:
+            channel_id = self.channels.get(str(record.get("channel", "")).lower(), None)
+            character_id = self.characters.get(str(record["author"]).lower(), None)
+            if not (channel_id and character_id):
+                self.skipped += 1
+                continue
+            stamp = timestamp(record.get("created_at"))
+            rows.append((channel_id, character_id, record.get("message", None) or "", stamp, stamp))
+        if rows:
+            await self.conn.copy_records_to_table(
+                "channel_messages",
+                records=rows,
+                columns=("channel_id", "character_id", "message", "created_at", "updated_at"),
+            )
+        return len(rows)
+
+    async def run_kind(self, sources: list[str], kind: str):
+        loader = getattr(self, f"load_{kind}")
+        for table in TABLES[kind]:
+            await self.defer(table)
+        total = 0
+        self.skipped = 0
+        start = time.perf_counter()
+        for source in sources:
+            name = os.path.abspath(source)
+            done = await self.checkpoint(name, kind)
+            pending = ((n, r) for n, r in iter_records(source, kind) if n > done)
+            for batch in batched(pending, self.batch_size):
+                async with self.conn.transaction():
+                    total += await loader([r for n, r in batch])
+                    await self.save_checkpoint(name, kind, batch[-1][0])
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    "%s: %d rows, %.0f rows/sec.", kind, total, total / elapsed if elapsed else 0
+                )
+        for table in TABLES[kind]:
+            await self.restore(table)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "%s done: %d rows in %.1fs (%.0f rows/sec), %d skipped.",
+            kind,
+            total,
+            elapsed,
+            total / elapsed if elapsed else 0,
+            self.skipped,
+        )
+
+    async def run(self, sources: list[str], kinds: typing.Iterable[str] = KINDS):
+        await self.load_maps()
+        for kind in kinds:
+            await self.run_kind(sources, kind)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk import legacy game data.")
+    parser.add_argument("sources", nargs="+", help="JSON lines or flatfile dumps.")
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("PHANTASM_DSN", None),
+        help="Postgres connection string. Defaults to $PHANTASM_DSN.",
+    )
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--only", choices=KINDS, action="append", help="Import only these kinds."
+    )
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or $PHANTASM_DSN is required.")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        importer = Importer(conn, args.batch_size)
+        await importer.run(args.sources, [k for k in KINDS if not args.only or k in args.only])
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Compare startup time and parse throughput of the lock grammar under Earley and LALR.
+
+    python -m phantasm.game.locks.benchmark [iterations]
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import lark
+
+from .lockhandler import GRAMMAR_PATH, create_parser
+
+SAMPLE_LOCKS = [
+    "perm()",
+    'faction("Avengers", 3)',
+    '!faction("Hydra") and admin(2)',
+    '(faction("Avengers", 3) or faction("SHIELD", 2)) and !banned()',
+    'admin(4) or (faction("X-Men", 1) and !faction("Brotherhood") and level(10, "x"))',
+]
+
+
+def timed(func, repeat: int = 1) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with open(GRAMMAR_PATH, "r") as f:
+        grammar = f.read()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_file = str(Path(tmp) / "locks.lark.cache")
+        create_parser(cache=cache_file)
+        startup = {
+            "earley": timed(lambda: lark.Lark(grammar), 20),
+            "lalr": timed(lambda: create_parser(cache=False), 20),
+            "lalr (cached)": timed(lambda: create_parser(cache=cache_file), 20),
+        }
+
+    parsers = {
+        "earley": lark.Lark(grammar),
+        "lalr": create_parser(cache=False),
+    }
+
+    print("Startup (parser construction):")
+    for name, elapsed in startup.items():
+        print(f"  {name:<14} {elapsed * 1000:8.2f} ms")
+
+    print(f"Parse throughput ({iterations} x {len(SAMPLE_LOCKS)} locks):")
+    for name, parser in parsers.items():
+        def parse_all():
+            for lock in SAMPLE_LOCKS:
+                parser.parse(lock)
+
+        elapsed = timed(parse_all, iterations)
+        print(f"  {name:<14} {len(SAMPLE_LOCKS) / elapsed:10.0f} locks/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,29 @@
 import typing
 import phantasm
 import lark
+from pathlib import Path
 from dataclasses import dataclass
 from lark.exceptions import LarkError
 from fastapi import HTTPException, status
 
 PARSER_CACHE = dict()
 
+GRAMMAR_PATH = Path(phantasm.__file__).parent / "grammar.lark"
+
+
+def create_parser(cache: typing.Union[bool, str] = True) -> lark.Lark:
+    """
+    Build the lock parser. The grammar is LALR(1), which parses far faster than Earley,
+    and lets lark cache its grammar analysis on disk so startup skips rebuilding the tables.
+
+    Args:
+        cache: True to cache in lark's temporary directory, a filename to cache there,
+            or False to always rebuild.
+    """
+    with open(GRAMMAR_PATH, "r") as f:
+        data = f.read()
+    return lark.Lark(data, parser="lalr", cache=cache)
+
 @dataclass(slots=True)
 class LockArguments:
     object: typing.Any
@@ -0,0 +1,316 @@
+import asyncio
+import time
+import typing
+from bisect import bisect_left
+
+import asyncpg
+
+# Upper bounds (in seconds) shared by every histogram. Most of what we measure
+# lives between a fraction of a millisecond and a few seconds.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(names: typing.Sequence[str], values: typing.Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """
+    A monotonically increasing value, optionally split by labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: dict[tuple, float] = dict()
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> typing.Iterable[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down. If a callback is given, it is polled at render time.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: typing.Sequence[str] = (),
+        callback: typing.Optional[typing.Callable[[], float]] = None,
+    ):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def render(self) -> typing.Iterable[str]:
+        if self.callback:
+            self.values[()] = self.callback()
+        yield from super().render()
+
+
+class Histogram:
+    """
+    Pre-aggregated bucket counts. Observing is a bisect and a few additions, so it is
+    cheap enough to do on every request and every query.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list] = dict()
+
+    def observe(self, value: float, *labels):
+        if (data := self.values.get(labels, None)) is None:
+            data = [0] * (len(self.buckets) + 1) + [0.0]
+            self.values[labels] = data
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def render(self) -> typing.Iterable[str]:
+        label_names = self.labels + ("le",)
+        for labels, data in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(label_names, labels + (bound,))} {cumulative}"
+            cumulative += data[len(self.buckets)]
+            yield f"{self.name}_bucket{_format_labels(label_names, labels + ('+Inf',))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {data[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Metrics:
+    """
+    The registry of every metric the game process exposes on /metrics.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, typing.Union[Counter, Gauge, Histogram]] = dict()
+        self.request_latency = self.add(
+            Histogram(
+                "phantasm_http_request_seconds",
+                "Time spent handling HTTP requests.",
+                ("method", "route", "status"),
+            )
+        )
+        self.pool_wait = self.add(
+            Histogram(
+                "phantasm_db_pool_acquire_seconds",
+                "Time spent waiting for a connection from the pool.",
+                ("pool",),
+            )
+        )
+        self.query_latency = self.add(
+            Histogram(
+                "phantasm_db_query_seconds",
+                "Time spent executing queries, by statement verb.",
+                ("verb",),
+            )
+        )
+        self.query_errors = self.add(
+            Counter(
+                "phantasm_db_query_errors_total",
+                "Queries which raised an exception, by statement verb.",
+                ("verb",),
+            )
+        )
+        self.loop_lag = self.add(
+            Histogram(
+                "phantasm_event_loop_lag_seconds",
+                "How late the event loop woke up a sleeping task.",
+            )
+        )
+        self.pool_size = self.add(
+            Gauge(
+                "phantasm_db_pool_connections",
+                "Connections held by the pool, by state.",
+                ("pool", "state"),
+            )
+        )
+        self.startup = self.add(
+            Gauge(
+                "phantasm_startup_stage_seconds",
+                "How long each stage of Application.setup took.",
+                ("stage",),
+            )
+        )
+        self.job_latency = self.add(
+            Histogram(
+                "phantasm_job_seconds",
+                "Time spent running scheduled jobs.",
+                ("job",),
+            )
+        )
+        self.job_runs = self.add(
+            Counter(
+                "phantasm_job_runs_total",
+                "Scheduled job runs by outcome: ok, error, cancelled, or skipped because "
+                "of overlap or another worker (locked).",
+                ("job", "outcome"),
+            )
+        )
+        self.pools: dict[str, asyncpg.Pool] = dict()
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def watch_pool(self, name: str, pool: asyncpg.Pool) -> "InstrumentedPool":
+        """
+        Register a pool for size reporting and wrap it so acquire() waits are timed.
+        """
+        self.pools[name] = pool
+        return InstrumentedPool(pool, self, name)
+
+    def record_query(self, record: asyncpg.connection.LoggedQuery):
+        """
+        asyncpg query logger. Installed on every connection by init_connection.
+        """
+        verb = record.query.lstrip().split(None, 1)[0].upper() if record.query else ""
+        self.query_latency.observe(record.elapsed, verb)
+        if record.exception is not None:
+            self.query_errors.inc(verb)
+
+    def render(self) -> str:
+        for name, pool in self.pools.items():
+            size = pool.get_size()
+            idle = pool.get_idle_size()
+            self.pool_size.set(size - idle, name, "busy")
+            self.pool_size.set(idle, name, "idle")
+            self.pool_size.set(pool.get_max_size(), name, "max")
+
+        out = []
+        for metric in self.metrics.values():
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(metric.render())
+        out.append("")
+        return "\n".join(out)
+
+    async def monitor_loop_lag(self, interval: float = 0.5):
+        """
+        Sleeps for a fixed interval over and over and records how late each wakeup was.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+
+class _TimedAcquire:
+    __slots__ = ("pool", "metrics", "name", "timeout", "context")
+
+    def __init__(self, pool: asyncpg.Pool, metrics: Metrics, name: str, timeout):
+        self.pool = pool
+        self.metrics = metrics
+        self.name = name
+        self.timeout = timeout
+        self.context = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        start = time.perf_counter()
+        self.context = self.pool.acquire(timeout=self.timeout)
+        try:
+            return await self.context.__aenter__()
+        finally:
+            self.metrics.pool_wait.observe(time.perf_counter() - start, self.name)
+
+    async def __aexit__(self, *exc):
+        return await self.context.__aexit__(*exc)
+
+
+class InstrumentedPool:
+    """
+    A thin proxy around asyncpg.Pool which times how long acquire() waits.
+    Everything else is passed through to the real pool.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, metrics: Metrics, name: str):
+        self._pool = pool
+        self._metrics = metrics
+        self._name = name
+
+    def acquire(self, *, timeout=None) -> _TimedAcquire:
+        return _TimedAcquire(self._pool, self._metrics, self._name, timeout)
+
+    def __getattr__(self, item):
+        return getattr(self._pool, item)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency. Routes are labeled by their path
+    template (/boards/{board_key}) so the label set stays small.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route", None)
+            path = getattr(route, "path", "<unmatched>")
+            self.metrics.request_latency.observe(
+                time.perf_counter() - start, scope["method"], path, status_code
+            )
@@ -0,0 +1,144 @@
+import logging
+import typing
+import uuid
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+import asyncpg
+import orjson
+import phantasm
+
+from .events import reconnect_handler
+
+logger = logging.getLogger(__name__)
+
+# Sent by the characters_notify trigger (migration 003) on create, rename and delete.
+NAMES_CHANNEL = "phantasm_characters"
+
+
+@dataclass(slots=True)
+class CharacterName:
+    id: int
+    user_id: uuid.UUID
+    name: str
+
+
+class AmbiguousName(Exception):
+    def __init__(self, matches: list[CharacterName]):
+        super().__init__(f"Ambiguous name: {', '.join(m.name for m in matches)}")
+        self.matches = matches
+
+
+class CharacterDirectory:
+    """
+    Every non-deleted character name, held in memory for lookups without Postgres.
+
+    Names are keyed by their lowercase form (names are CITEXT and unique ignoring case),
+    and a sorted list of those keys answers prefix queries by bisection.
+    It is loaded at startup and kept current by NOTIFYs from a trigger on characters,
+    so every worker sees changes no matter where they were made.
+    """
+
+    def __init__(self):
+        self.by_key: dict[str, CharacterName] = dict()
+        self.by_id: dict[int, str] = dict()
+        self.keys: list[str] = list()
+        self.loaded = False
+        self.pending: list[str] = list()
+
+    async def load(self, conn: asyncpg.Connection):
+        """
+        Load every name. Call after the NOTIFY listener is attached, so that changes
+        made while loading are queued and applied on top of the snapshot.
+        """
+        rows = await conn.fetch(
+            "SELECT id, user_id, name FROM characters WHERE deleted_at IS NULL"
+        )
+        self.by_key.clear()
+        self.by_id.clear()
+        for row in rows:
+            entry = CharacterName(row["id"], row["user_id"], row["name"])
+            key = entry.name.lower()
+            self.by_key[key] = entry
+            self.by_id[entry.id] = key
+        self.keys = sorted(self.by_key)
+        self.loaded = True
+        pending, self.pending = self.pending, list()
+        for payload in pending:
+            self.on_notify(payload)
+        logger.info("Loaded %d character names.", len(self.keys))
+
+    def on_notify(self, payload: str):
+        if not self.loaded:
+            self.pending.append(payload)
+            return
+        data = orjson.loads(payload)
+        self.remove(data["id"])
+        if not data.get("deleted", False):
+            self.add(CharacterName(data["id"], uuid.UUID(data["user_id"]), data["name"]))
+
+    def add(self, entry: CharacterName):
+        key = entry.name.lower()
+        if key not in self.by_key:
+            insort(self.keys, key)
+        self.by_key[key] = entry
+        self.by_id[entry.id] = key
+
+    def remove(self, character_id: int):
+        if (key := self.by_id.pop(character_id, None)) is None:
+            return
+        self.by_key.pop(key, None)
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def find(self, name: str) -> typing.Optional[CharacterName]:
+        """
+        Case-insensitive exact match.
+        """
+        return self.by_key.get(name.strip().lower(), None)
+
+    def exact(self, name: str) -> typing.Optional[CharacterName]:
+        """
+        Case-sensitive exact match.
+        """
+        if (entry := self.find(name)) is not None and entry.name == name.strip():
+            return entry
+        return None
+
+    def prefix(self, prefix: str, limit: int = 0) -> list[CharacterName]:
+        """
+        Every name starting with prefix, ignoring case, in sorted order.
+        """
+        prefix = prefix.strip().lower()
+        out = list()
+        for index in range(bisect_left(self.keys, prefix), len(self.keys)):
+            key = self.keys[index]
+            if not key.startswith(prefix):
+                break
+            out.append(self.by_key[key])
+            if limit and len(out) >= limit:
+                break
+        return out
+
+    def resolve(self, name: str) -> typing.Optional[CharacterName]:
+        """
+        An exact (case-insensitive) match, or else the only name starting with `name`.
+        Raises AmbiguousName if several names share the prefix.
+        """
+        if not name.strip():
+            return None
+        if (entry := self.find(name)) is not None:
+            return entry
+        matches = self.prefix(name, limit=10)
+        if len(matches) > 1:
+            raise AmbiguousName(matches)
+        return matches[0] if matches else None
+
+
+@reconnect_handler
+async def reload_names(conn: asyncpg.Connection):
+    if phantasm.NAMES:
+        # Queue NOTIFYs which arrive during the reload, as at startup.
+        phantasm.NAMES.loaded = False
+        await phantasm.NAMES.load(conn)
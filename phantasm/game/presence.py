@@ -0,0 +1,196 @@
+import logging
+import time
+import typing
+import uuid
+from dataclasses import dataclass
+
+import asyncpg
+import phantasm
+
+from .events import publish, event_handler
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Presence:
+    character_id: int
+    user_id: uuid.UUID
+    name: str
+    spoofed_name: str
+    # Wall clock seconds, so they mean the same thing in every worker.
+    connected_at: float
+    last_seen: float
+    # The character's active admin level, so WHO can decide what to show without a query.
+    admin_level: int = 0
+    broadcast_at: float = 0.0
+
+
+class PresenceRegistry:
+    """
+    Who is online, held in memory by every game process so WHO never touches Postgres.
+
+    get_acting_character heartbeats the acting character on every request. A worker
+    tells the others about a heartbeat with a "presence.seen" event at most once per
+    broadcast_interval per character, so idle times agree across workers to within
+    that interval. Characters idle longer than idle_timeout are expired here and their
+    characters_active rows are reaped in batches by reap().
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = 3600.0,
+        broadcast_interval: float = 30.0,
+        reap_batch: int = 500,
+    ):
+        self.idle_timeout = idle_timeout
+        self.broadcast_interval = broadcast_interval
+        self.reap_batch = reap_batch
+        self.online: dict[int, Presence] = dict()
+
+    async def load(self, conn: asyncpg.Connection):
+        rows = await conn.fetch(
+            """
+            SELECT id, user_id, name, spoofed_name, admin_level, active_created_at,
+                   last_active_at
+            FROM characters_active_view
+            """
+        )
+        for row in rows:
+            self.online[row["id"]] = Presence(
+                character_id=row["id"],
+                user_id=row["user_id"],
+                name=row["name"],
+                spoofed_name=row["spoofed_name"],
+                connected_at=row["active_created_at"].timestamp(),
+                last_seen=row["last_active_at"].timestamp(),
+                admin_level=row["admin_level"],
+            )
+
+    async def heartbeat(self, conn: asyncpg.Connection, acting):
+        """
+        Mark the acting character as seen now, telling other workers if it's been a while.
+        """
+        now = time.time()
+        character = acting.character
+        if (presence := self.online.get(character.id, None)) is None:
+            presence = Presence(
+                character_id=character.id,
+                user_id=acting.user.id,
+                name=character.name,
+                spoofed_name=acting.spoofed_name,
+                connected_at=acting.active_created_at.timestamp(),
+                last_seen=now,
+            )
+            self.online[character.id] = presence
+        presence.last_seen = now
+        presence.spoofed_name = acting.spoofed_name
+        presence.admin_level = acting.admin_level
+        if now - presence.broadcast_at >= self.broadcast_interval:
+            presence.broadcast_at = now
+            await publish(
+                conn,
+                "presence.seen",
+                character_id=presence.character_id,
+                user_id=str(presence.user_id),
+                name=presence.name,
+                spoofed_name=presence.spoofed_name,
+                admin_level=presence.admin_level,
+                connected_at=presence.connected_at,
+                last_seen=now,
+            )
+
+    def seen(self, event: dict):
+        if (presence := self.online.get(event["character_id"], None)) is None:
+            self.online[event["character_id"]] = Presence(
+                character_id=event["character_id"],
+                user_id=uuid.UUID(event["user_id"]),
+                name=event["name"],
+                spoofed_name=event["spoofed_name"],
+                connected_at=event["connected_at"],
+                last_seen=event["last_seen"],
+                admin_level=event.get("admin_level", 0),
+                broadcast_at=event["last_seen"],
+            )
+            return
+        presence.spoofed_name = event["spoofed_name"]
+        presence.admin_level = event.get("admin_level", presence.admin_level)
+        presence.last_seen = max(presence.last_seen, event["last_seen"])
+        presence.broadcast_at = max(presence.broadcast_at, event["last_seen"])
+
+    def changed(self, event: dict):
+        """
+        An active character's spoofed name or admin level was changed on some worker.
+        """
+        if (presence := self.online.get(event["character_id"], None)) is not None:
+            presence.spoofed_name = event["spoofed_name"]
+            presence.admin_level = event.get("admin_level", presence.admin_level)
+
+    def left(self, event: dict):
+        for character_id in event["character_ids"]:
+            self.online.pop(character_id, None)
+
+    def expire(self) -> list[int]:
+        cutoff = time.time() - self.idle_timeout
+        expired = [k for k, v in self.online.items() if v.last_seen < cutoff]
+        for character_id in expired:
+            del self.online[character_id]
+        return expired
+
+    def who(self) -> list[Presence]:
+        return sorted(self.online.values(), key=lambda p: p.spoofed_name.lower())
+
+    async def reap(self, pool: asyncpg.Pool) -> int:
+        """
+        Expire idle characters and delete stale characters_active rows in batches,
+        including those left behind by processes which died.
+        """
+        self.expire()
+        total = 0
+        while True:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    reaped = await conn.fetch(
+                        """
+                        DELETE FROM characters_active
+                        WHERE id IN (
+                            SELECT a.id
+                            FROM characters_active a
+                                     JOIN characters c ON c.id = a.id
+                            WHERE c.last_active_at < now() - make_interval(secs => $1)
+                            LIMIT $2
+                            FOR UPDATE OF a SKIP LOCKED
+                        )
+                        RETURNING id
+                        """,
+                        self.idle_timeout,
+                        self.reap_batch,
+                    )
+                    if reaped:
+                        await publish(
+                            conn, "presence.left", character_ids=[r["id"] for r in reaped]
+                        )
+            total += len(reaped)
+            if len(reaped) < self.reap_batch:
+                break
+        if total:
+            logger.info("Reaped %d idle characters.", total)
+        return total
+
+
+@event_handler("presence.seen")
+def on_presence_seen(event: dict):
+    if phantasm.PRESENCE:
+        phantasm.PRESENCE.seen(event)
+
+
+@event_handler("character.active")
+def on_character_active(event: dict):
+    if phantasm.PRESENCE:
+        phantasm.PRESENCE.changed(event)
+
+
+@event_handler("presence.left")
+def on_presence_left(event: dict):
+    if phantasm.PRESENCE:
+        phantasm.PRESENCE.left(event)
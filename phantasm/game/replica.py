@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import math
+import time
+import typing
+import uuid
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Carries the time of a client's latest write (unix seconds) to whichever worker
+# serves its next request. Handlers which write leave the time under WROTE_SCOPE in
+# the ASGI scope, and WriteMarkerMiddleware turns it into the cookie.
+WROTE_COOKIE = "phantasm_wrote"
+WROTE_SCOPE = "phantasm.wrote"
+
+# Zero when the replica has replayed everything it received, so an idle primary
+# doesn't look like replication lag.
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReplicaRouter:
+    """
+    Decides whether a read may be served by the replica pool.
+
+    Reads stay on the primary when the replica is unhealthy or lagging by more than
+    max_lag seconds, when the caller asks for fresh data, or when the user wrote
+    something within the last sticky_seconds (read-your-writes).
+
+    Recent writers are tracked per worker process, and clients carry the time of
+    their latest write in WROTE_COOKIE, so a read landing on another worker than the
+    write did stays on the primary too. sticky_seconds should comfortably exceed
+    max_lag.
+    """
+
+    def __init__(
+        self,
+        primary: asyncpg.Pool,
+        replica: typing.Optional[asyncpg.Pool],
+        max_lag: float = 5.0,
+        sticky_seconds: float = 10.0,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.healthy = False
+        self.lag: typing.Optional[float] = None
+        self.recent_writers: dict[uuid.UUID, float] = dict()
+
+    def mark_write(self, user_id: uuid.UUID):
+        self.recent_writers[user_id] = time.monotonic() + self.sticky_seconds
+
+    def pool_for(
+        self,
+        user_id: typing.Optional[uuid.UUID] = None,
+        fresh: bool = False,
+        wrote_at: typing.Optional[float] = None,
+    ) -> asyncpg.Pool:
+        """
+        wrote_at is the unix time of the client's latest write, from WROTE_COOKIE.
+        """
+        if fresh or not self.healthy or self.replica is None:
+            return self.primary
+        if wrote_at is not None and time.time() - wrote_at < self.sticky_seconds:
+            return self.primary
+        if user_id is not None and (until := self.recent_writers.get(user_id, None)):
+            if until > time.monotonic():
+                return self.primary
+            del self.recent_writers[user_id]
+        return self.replica
+
+    async def check(self):
+        try:
+            async with self.replica.acquire(timeout=2.0) as conn:
+                self.lag = float(await conn.fetchval(LAG_QUERY, timeout=2.0))
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as err:
+            if self.healthy:
+                logger.warning("Replica unreachable, reading from primary: %s", err)
+            self.healthy = False
+            self.lag = None
+            return
+        healthy = self.lag <= self.max_lag
+        if healthy != self.healthy:
+            logger.warning(
+                "Replica lag is %.1fs, %s.",
+                self.lag,
+                "routing reads to it" if healthy else "reading from primary",
+            )
+        self.healthy = healthy
+
+    def prune(self):
+        now = time.monotonic()
+        for user_id, until in list(self.recent_writers.items()):
+            if until <= now:
+                del self.recent_writers[user_id]
+
+    async def poll(self):
+        await self.check()
+        self.prune()
+
+
+def wrote_at(cookies: dict[str, str]) -> typing.Optional[float]:
+    try:
+        return float(cookies[WROTE_COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+class WriteMarkerMiddleware:
+    """
+    ASGI middleware setting WROTE_COOKIE on the response to any request which wrote,
+    for as long as its reads should stay on the primary.
+    """
+
+    def __init__(self, app, sticky_seconds: float):
+        self.app = app
+        self.max_age = math.ceil(sticky_seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and (
+                at := scope.get(WROTE_SCOPE, None)
+            ):
+                cookie = (
+                    f"{WROTE_COOKIE}={at:.3f}; Max-Age={self.max_age}; Path=/; "
+                    "HttpOnly; SameSite=Lax"
+                )
+                headers = [*message.get("headers", ()), (b"set-cookie", cookie.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
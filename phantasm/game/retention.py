@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions made by loginrecords_ensure_partitions (migration 005).
+PARTITION_PATTERN = re.compile(r"^loginrecords_(\d{4})_(\d{2})$")
+
+def months_between(earlier: datetime, later: datetime) -> int:
+    return (later.year - earlier.year) * 12 + later.month - earlier.month
+
+
+class LoginRecordRetention:
+    """
+    Keeps loginrecords to a fixed number of months.
+
+    Each run creates the next few monthly partitions ahead of time, then detaches every
+    partition older than retain_months, writes it to a gzipped CSV in archive_dir, and
+    drops it. Dropping a whole month is instant and leaves nothing behind for vacuum,
+    unlike deleting rows from one big table. The scheduler runs it in one worker.
+    """
+
+    def __init__(self, archive_dir: str, retain_months: int = 12, months_ahead: int = 2):
+        self.archive_dir = archive_dir
+        self.retain_months = retain_months
+        self.months_ahead = months_ahead
+
+    async def run(self, pool: asyncpg.Pool) -> list[str]:
+        """
+        Perform one round of maintenance. Returns the names of archived partitions.
+        """
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "SELECT loginrecords_ensure_partitions(now(), $1)", self.months_ahead
+            )
+            archived = list()
+            for name in await self.expired(conn):
+                await self.archive(conn, name)
+                archived.append(name)
+            return archived
+
+    async def expired(self, conn: asyncpg.Connection) -> list[str]:
+        """
+        Monthly partitions past retention, attached or not. A partition is left
+        detached if archiving it was interrupted, so those are picked up again.
+        """
+        rows = await conn.fetch(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE 'loginrecords\\_%'"
+        )
+        now = datetime.now(tz=timezone.utc)
+        out = list()
+        for row in rows:
+            if not (match := PARTITION_PATTERN.match(row["relname"])):
+                continue
+            month = datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)
+            if months_between(month, now) > self.retain_months:
+                out.append(row["relname"])
+        return sorted(out)
+
+    async def archive(self, conn: asyncpg.Connection, name: str):
+        attached = await conn.fetchval(
+            "SELECT relispartition FROM pg_class WHERE relname = $1", name
+        )
+        if attached:
+            await conn.execute(f'ALTER TABLE loginrecords DETACH PARTITION "{name}"')
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        partial = path + ".partial"
+        out = await asyncio.to_thread(gzip.open, partial, "wb")
+        try:
+
+            async def sink(chunk: bytes):
+                await asyncio.to_thread(out.write, chunk)
+
+            await conn.copy_from_table(name, output=sink, format="csv", header=True)
+        finally:
+            await asyncio.to_thread(out.close)
+        # Only drop the table once its archive is safely in place.
+        await asyncio.to_thread(os.replace, partial, path)
+        await conn.execute(f'DROP TABLE "{name}"')
+        logger.info("Archived %s to %s.", name, path)
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import random
+import time
+import typing
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import phantasm
+
+logger = logging.getLogger(__name__)
+
+JobFunc = typing.Callable[[], typing.Awaitable[typing.Any]]
+
+
+def _parse_field(spec: str, low: int, high: int) -> frozenset[int]:
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid cron field {spec!r}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    """
+    A five field cron expression (minute hour day-of-month month day-of-week), in UTC.
+    Fields take *, lists, ranges and /steps. Day-of-week 0 and 7 are both Sunday. As
+    in cron, when both day fields are restricted a day matching either one is due.
+    """
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expressions need five fields: {expr!r}")
+        self.expr = expr
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        # Python counts Monday as 0; cron counts Sunday as 0 (or 7).
+        self.weekdays = frozenset((d - 1) % 7 for d in _parse_field(fields[4], 0, 7))
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def day_matches(self, when: datetime) -> bool:
+        in_days = when.day in self.days
+        in_weekdays = when.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, after: datetime) -> datetime:
+        """
+        The first matching minute strictly after `after`.
+        """
+        when = after.astimezone(timezone.utc).replace(second=0, microsecond=0)
+        when += timedelta(minutes=1)
+        # Skip whole months, days and hours at a time; a match is always within 5 years.
+        limit = when + timedelta(days=366 * 5)
+        while when < limit:
+            if when.month not in self.months:
+                year, month = divmod(when.month, 12)
+                when = when.replace(year=when.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self.day_matches(when):
+                when = (when + timedelta(days=1)).replace(hour=0, minute=0)
+            elif when.hour not in self.hours:
+                when = (when + timedelta(hours=1)).replace(minute=0)
+            elif when.minute not in self.minutes:
+                when += timedelta(minutes=1)
+            else:
+                return when
+        raise ValueError(f"Cron expression never matches: {self.expr!r}")
+
+
+@dataclass(eq=False)
+class Job:
+    name: str
+    func: JobFunc
+    interval: typing.Optional[float] = None
+    cron: typing.Optional[CronSchedule] = None
+    # Each run is delayed by up to this many extra seconds, so workers spread out.
+    jitter: float = 0.0
+    # Runs of this job allowed at once in this process; a due run beyond that is skipped.
+    max_running: int = 1
+    # Only one worker (of any process sharing the database) runs each due run.
+    single: bool = False
+    # Run as soon as the scheduler starts, rather than after the first interval.
+    immediate: bool = False
+    running: set[asyncio.Task] = field(default_factory=set)
+
+    @property
+    def lock_key(self) -> int:
+        return zlib.crc32(f"phantasm.scheduler.{self.name}".encode("utf-8"))
+
+    def next_due(self, now: float) -> float:
+        """
+        Wall clock seconds of the next run, before jitter.
+        """
+        if self.cron is not None:
+            return self.cron.next_after(datetime.fromtimestamp(now, tz=timezone.utc)).timestamp()
+        return now + self.interval
+
+
+class Scheduler:
+    """
+    Runs background jobs on intervals or cron schedules, inside the game process.
+
+    A job which is still running when it comes due again is skipped if max_running runs
+    are already going. Jobs marked single take a Postgres advisory lock for each run
+    and record when they last started in scheduled_job_runs (migration 010), so one
+    worker runs each due run and the others skip it. drain() stops scheduling and
+    waits for runs in progress, for graceful shutdown.
+    """
+
+    def __init__(self, pool: typing.Optional[asyncpg.Pool] = None):
+        self.pool = pool
+        self.jobs: dict[str, Job] = dict()
+        self.loops: list[asyncio.Task] = list()
+
+    def add(self, job: Job) -> Job:
+        if (job.interval is None) == (job.cron is None):
+            raise ValueError(f"Job {job.name} needs exactly one of interval or cron.")
+        if job.single and self.pool is None:
+            raise ValueError(f"Job {job.name} is single, which needs a database pool.")
+        self.jobs[job.name] = job
+        if self.loops:
+            self.loops.append(asyncio.create_task(self.schedule(job)))
+        return job
+
+    def every(self, name: str, interval: float, func: JobFunc, **kwargs) -> Job:
+        return self.add(Job(name, func, interval=interval, **kwargs))
+
+    def cron(self, name: str, expr: str, func: JobFunc, **kwargs) -> Job:
+        return self.add(Job(name, func, cron=CronSchedule(expr), **kwargs))
+
+    def start(self):
+        for job in self.jobs.values():
+            self.loops.append(asyncio.create_task(self.schedule(job)))
+
+    async def schedule(self, job: Job):
+        due = time.time() if job.immediate else job.next_due(time.time())
+        while True:
+            delay = due - time.time() + random.uniform(0.0, job.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(job.running) >= job.max_running:
+                self.record(job, "overlap")
+                logger.warning("Skipped %s: previous run still going.", job.name)
+            else:
+                task = asyncio.create_task(self.execute(job, due), name=f"job:{job.name}")
+                job.running.add(task)
+                task.add_done_callback(job.running.discard)
+            due = job.next_due(max(due, time.time()) if job.cron else time.time())
+
+    async def execute(self, job: Job, due: float):
+        if job.single:
+            async with self.pool.acquire() as conn:
+                if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", job.lock_key):
+                    self.record(job, "locked")
+                    return
+                try:
+                    # Another worker may have finished this run already. Interval jobs
+                    # count any start within the last half interval as this one.
+                    since = due if job.cron else time.time() - job.interval / 2
+                    claimed = await conn.fetchval(
+                        """
+                        INSERT INTO scheduled_job_runs (name, started_at)
+                        VALUES ($1, now())
+                        ON CONFLICT (name) DO UPDATE SET started_at = now()
+                        WHERE scheduled_job_runs.started_at < to_timestamp($2)
+                        RETURNING name
+                        """,
+                        job.name,
+                        since,
+                    )
+                    if claimed is None:
+                        self.record(job, "locked")
+                        return
+                    await self.run(job)
+                finally:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", job.lock_key)
+        else:
+            await self.run(job)
+
+    async def run(self, job: Job):
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            await job.func()
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            logger.exception("Scheduled job %s failed.", job.name)
+        finally:
+            self.record(job, outcome, time.perf_counter() - start)
+
+    def record(self, job: Job, outcome: str, elapsed: typing.Optional[float] = None):
+        if not phantasm.METRICS:
+            return
+        phantasm.METRICS.job_runs.inc(job.name, outcome)
+        if elapsed is not None:
+            phantasm.METRICS.job_latency.observe(elapsed, job.name)
+
+    async def drain(self, timeout: float = 30.0):
+        """
+        Stop starting runs, then give those in progress up to timeout seconds to finish
+        before cancelling them.
+        """
+        for loop in self.loops:
+            loop.cancel()
+        self.loops.clear()
+        running = [task for job in self.jobs.values() for task in job.running]
+        if not running:
+            return
+        done, pending = await asyncio.wait(running, timeout=timeout)
+        for task in pending:
+            logger.warning("Cancelling %s at shutdown.", task.get_name())
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
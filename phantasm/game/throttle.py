@@ -0,0 +1,171 @@
+import contextlib
+import time
+import typing
+import uuid
+from collections import deque
+
+import asyncpg
+import phantasm
+
+from .events import publish, event_handler
+
+
+class LoginThrottle:
+    """
+    Failed login attempts per IP address and per account, held in memory so that a
+    login can be refused before it costs a query or a password hash.
+
+    Each key remembers the times of its failures within a sliding window. Once a key
+    has more failures in the window than it is allowed for free, every further failure
+    doubles how long it must wait after the latest one, up to max_delay. A successful
+    login clears the account's failures but not the IP's.
+
+    Attempts still being checked (see attempt()) count as failures happening now, so
+    a burst of concurrent guesses can't all reach the password hash before the first
+    of them is counted.
+
+    Keys look like "ip:203.0.113.5", "user:<uuid>" or "email:<address>". Workers share
+    failures through "login.failed" events and seed themselves from loginrecords.
+    """
+
+    def __init__(
+        self,
+        window: float = 900.0,
+        ip_free: int = 20,
+        account_free: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 900.0,
+        max_failures: int = 64,
+        max_keys: int = 100_000,
+    ):
+        self.window = window
+        self.ip_free = ip_free
+        self.account_free = account_free
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Failures beyond this per key add nothing; the delay has long since capped.
+        self.max_failures = max_failures
+        self.failures: dict[str, deque[float]] = dict()
+        # In-flight attempts per key.
+        self.pending: dict[str, int] = dict()
+        # Stale keys are only swept once this many are held, so sweeping stays cheap.
+        self.next_prune = max_keys
+        self.max_keys = max_keys
+        # Tells this process's own events apart from other workers'.
+        self.origin = uuid.uuid4().hex
+
+    def free(self, key: str) -> int:
+        return self.ip_free if key.startswith("ip:") else self.account_free
+
+    def _recent(self, key: str, now: float) -> typing.Optional[deque[float]]:
+        if (times := self.failures.get(key, None)) is None:
+            return None
+        cutoff = now - self.window
+        while times and times[0] <= cutoff:
+            times.popleft()
+        if not times:
+            del self.failures[key]
+            return None
+        return times
+
+    def retry_after(self, *keys: str) -> float:
+        """
+        Seconds until every key may attempt another login, or 0 if they all may now.
+        """
+        now = time.time()
+        wait = 0.0
+        for key in keys:
+            times = self._recent(key, now)
+            pending = self.pending.get(key, 0)
+            if times is None and not pending:
+                continue
+            count = (len(times) if times else 0) + pending
+            if (excess := count - self.free(key)) <= 0:
+                continue
+            delay = min(self.base_delay * 2 ** (excess - 1), self.max_delay)
+            latest = now if pending else times[-1]
+            wait = max(wait, latest + delay - now)
+        return wait
+
+    @contextlib.contextmanager
+    def attempt(self, *keys: str):
+        """
+        Hold an attempt against keys while it is checked. Enter it straight after
+        retry_after() allows the attempt, with nothing awaited in between.
+        """
+        for key in keys:
+            self.pending[key] = self.pending.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            for key in keys:
+                if count := self.pending[key] - 1:
+                    self.pending[key] = count
+                else:
+                    del self.pending[key]
+
+    def failed(self, *keys: str, at: typing.Optional[float] = None):
+        at = time.time() if at is None else at
+        for key in keys:
+            times = self.failures.setdefault(key, deque(maxlen=self.max_failures))
+            times.append(at)
+        if len(self.failures) >= self.next_prune:
+            self.prune()
+            self.next_prune = max(self.max_keys, 2 * len(self.failures))
+
+    def succeeded(self, *keys: str):
+        for key in keys:
+            if not key.startswith("ip:"):
+                self.failures.pop(key, None)
+
+    def prune(self):
+        now = time.time()
+        for key in list(self.failures):
+            self._recent(key, now)
+
+    async def record_failure(self, conn: asyncpg.Connection, *keys: str):
+        """
+        Count a failure here at once, and tell the other workers about it.
+        """
+        now = time.time()
+        self.failed(*keys, at=now)
+        await publish(conn, "login.failed", keys=list(keys), at=now, origin=self.origin)
+
+    async def record_success(self, conn: asyncpg.Connection, *keys: str):
+        self.succeeded(*keys)
+        await publish(conn, "login.succeeded", keys=list(keys), origin=self.origin)
+
+    async def load(self, conn: asyncpg.Connection):
+        """
+        Replay the failures still inside the window, skipping any from before an
+        account's latest success.
+        """
+        rows = await conn.fetch(
+            """
+            SELECT l.ip_address, l.user_id, u.email, l.success,
+                   EXTRACT(EPOCH FROM l.created_at)::float8 AS at
+            FROM loginrecords l
+                     JOIN users u ON u.id = l.user_id
+            WHERE l.created_at > now() - make_interval(secs => $1)
+            ORDER BY l.created_at
+            """,
+            self.window,
+        )
+        for row in rows:
+            accounts = (f"user:{row['user_id']}", f"email:{row['email'].lower()}")
+            if row["success"]:
+                self.succeeded(*accounts)
+            else:
+                self.failed(f"ip:{row['ip_address']}", *accounts, at=row["at"])
+
+
+@event_handler("login.failed")
+def on_login_failed(event: dict):
+    if phantasm.THROTTLE and event["origin"] != phantasm.THROTTLE.origin:
+        phantasm.THROTTLE.failed(*event["keys"], at=event["at"])
+
+
+@event_handler("login.succeeded")
+def on_login_succeeded(event: dict):
+    if phantasm.THROTTLE and event["origin"] != phantasm.THROTTLE.origin:
+        phantasm.THROTTLE.succeeded(*event["keys"])
@@ -0,0 +1,85 @@
+import logging
+import time
+
+import asyncpg
+import phantasm
+
+from .events import event_handler, reconnect_handler
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRevocations:
+    """
+    Revoked refresh tokens and per-user "logged out everywhere" cutoffs, mirrored from
+    Postgres into memory so checking a token never needs a query.
+
+    Every worker loads the unexpired rows at startup and follows later revocations
+    through "token.revoked" and "token.logout_all" events.
+    """
+
+    def __init__(self):
+        # jti -> expiry (unix seconds), so entries can be dropped once useless.
+        self.revoked: dict[str, float] = dict()
+        # user id -> unix seconds; tokens issued at or before this are rejected.
+        self.cutoffs: dict[str, float] = dict()
+
+    async def load(self, conn: asyncpg.Connection):
+        rows = await conn.fetch(
+            "SELECT jti, expires_at FROM refresh_tokens_revoked WHERE expires_at > now()"
+        )
+        for row in rows:
+            self.revoked[str(row["jti"])] = row["expires_at"].timestamp()
+        rows = await conn.fetch(
+            "SELECT id, tokens_valid_after FROM users WHERE tokens_valid_after IS NOT NULL"
+        )
+        for row in rows:
+            self.cutoffs[str(row["id"])] = row["tokens_valid_after"].timestamp()
+
+    def rejects(self, payload: dict) -> bool:
+        """
+        True if a decoded token has been revoked, directly or by a logout-everywhere.
+        """
+        return self.reused(payload) or self.logged_out(payload)
+
+    def reused(self, payload: dict) -> bool:
+        return payload.get("jti", None) in self.revoked
+
+    def logged_out(self, payload: dict) -> bool:
+        if (cutoff := self.cutoffs.get(payload.get("sub", None), None)) is not None:
+            # iat is whole seconds, so a token from the same second as the cutoff
+            # is rejected too.
+            return payload.get("iat", 0) <= cutoff
+        return False
+
+    def prune(self):
+        now = time.time()
+        for jti, expires in list(self.revoked.items()):
+            if expires <= now:
+                del self.revoked[jti]
+
+    async def purge(self, pool: asyncpg.Pool):
+        """
+        Delete revocations of tokens which have expired anyway. Each worker prunes its
+        own memory with prune().
+        """
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM refresh_tokens_revoked WHERE expires_at <= now()")
+
+
+@event_handler("token.revoked")
+def on_token_revoked(event: dict):
+    if phantasm.REVOCATIONS:
+        phantasm.REVOCATIONS.revoked[event["jti"]] = event["expires"]
+
+
+@event_handler("token.logout_all")
+def on_logout_all(event: dict):
+    if phantasm.REVOCATIONS:
+        phantasm.REVOCATIONS.cutoffs[event["user_id"]] = event["after"]
+
+
+@reconnect_handler
+async def reload_revocations(conn: asyncpg.Connection):
+    if phantasm.REVOCATIONS:
+        await phantasm.REVOCATIONS.load(conn)
@@ -0,0 +1,172 @@
+import asyncio
+import contextvars
+import logging
+import re
+import time
+import typing
+import uuid
+from collections import Counter
+
+import asyncpg
+import phantasm
+
+logger = logging.getLogger(__name__)
+explain_logger = logging.getLogger("phantasm.explain")
+
+RE_NUMBER = re.compile(r"\b\d+\b")
+
+
+class RequestTrace:
+    """
+    Every query run while handling one request, tagged with that request's id and route.
+    """
+
+    __slots__ = ("request_id", "method", "path", "route", "queries", "started")
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.route = path
+        self.queries: list[tuple[str, float]] = list()
+        self.started = time.perf_counter()
+
+    @property
+    def label(self) -> str:
+        return f"{self.request_id} {self.method} {self.route}"
+
+    def db_time(self) -> float:
+        return sum(elapsed for query, elapsed in self.queries)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        counts = Counter(statement_shape(query) for query, elapsed in self.queries)
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+
+CURRENT_TRACE: contextvars.ContextVar[typing.Optional[RequestTrace]] = (
+    contextvars.ContextVar("phantasm_request_trace", default=None)
+)
+
+
+def statement_shape(query: str) -> str:
+    """
+    Collapse whitespace and inline numbers so that the same statement issued from a
+    loop always has the same shape.
+    """
+    return RE_NUMBER.sub("?", " ".join(query.split()))
+
+
+class QueryTracer:
+    """
+    Opt-in, per-request query tracing meant for development and test runs.
+
+    asyncpg runs query loggers through loop.call_soon(), which copies the current
+    context, so the logger sees the CURRENT_TRACE of the request that ran the query.
+    """
+
+    def __init__(
+        self,
+        slow_query_ms: float = 50.0,
+        repeat_threshold: int = 3,
+        explain: bool = True,
+    ):
+        self.slow_query = slow_query_ms / 1000.0
+        self.repeat_threshold = repeat_threshold
+        self.explain = explain
+        self.explained: set[str] = set()
+        # Running capture_explain tasks, held so they aren't collected part way.
+        self.tasks: set[asyncio.Task] = set()
+
+    def record_query(self, record: asyncpg.connection.LoggedQuery):
+        if (trace := CURRENT_TRACE.get()) is None:
+            return
+        trace.queries.append((record.query, record.elapsed))
+        if (
+            self.explain
+            and record.elapsed >= self.slow_query
+            and record.exception is None
+            and record.query.lstrip()[:6].upper() == "SELECT"
+        ):
+            shape = statement_shape(record.query)
+            if shape not in self.explained:
+                self.explained.add(shape)
+                task = asyncio.create_task(
+                    self.capture_explain(record.query, record.args, record.elapsed, trace.label)
+                )
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def capture_explain(self, query: str, args: tuple, elapsed: float, label: str):
+        # This task runs in a copy of the request's context; don't trace our own EXPLAIN.
+        CURRENT_TRACE.set(None)
+        try:
+            async with phantasm.PGPOOL.acquire() as conn:
+                # ANALYZE really runs the statement, so never let it commit anything.
+                tr = conn.transaction()
+                await tr.start()
+                try:
+                    rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+                finally:
+                    await tr.rollback()
+        except Exception as err:
+            explain_logger.warning("[%s] could not EXPLAIN slow query: %s", label, err)
+            return
+        plan = "\n".join(row[0] for row in rows)
+        explain_logger.warning(
+            "[%s] slow query (%.1fms):\n%s\n%s", label, elapsed * 1000, query.strip(), plan
+        )
+
+    def report(self, trace: RequestTrace):
+        total = time.perf_counter() - trace.started
+        logger.info(
+            "[%s] %d queries, %.1fms in database, %.1fms total",
+            trace.label,
+            len(trace.queries),
+            trace.db_time() * 1000,
+            total * 1000,
+        )
+        for shape, count in trace.repeated(self.repeat_threshold):
+            logger.warning("[%s] possible N+1: %d x %s", trace.label, count, shape)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware which opens a RequestTrace for every HTTP request, adds the query
+    count and database time as response headers, and reports the trace when done.
+    """
+
+    def __init__(self, app, tracer: QueryTracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for k, v in scope["headers"]:
+            if k == b"x-request-id":
+                request_id = v.decode("latin-1")
+                break
+        trace = RequestTrace(request_id or uuid.uuid4().hex, scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Give the query loggers queued by call_soon() a chance to run.
+                await asyncio.sleep(0)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", trace.request_id.encode("latin-1")))
+                headers.append((b"x-db-query-count", str(len(trace.queries)).encode()))
+                headers.append((b"x-db-time-ms", f"{trace.db_time() * 1000:.2f}".encode()))
+                message["headers"] = headers
+            await send(message)
+
+        token = CURRENT_TRACE.set(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            CURRENT_TRACE.reset(token)
+            if (route := scope.get("route", None)) is not None:
+                trace.route = route.path
+            await asyncio.sleep(0)
+            self.tracer.report(trace)
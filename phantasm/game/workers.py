@@ -0,0 +1,228 @@
+"""
+Multi-worker serving for the game API.
+
+When [game.workers] count is greater than 1, the process started by run_program becomes
+a supervisor. It does not open a database pool or serve HTTP itself; instead it spawns
+`count` worker processes, each running a complete Application which binds the same port
+with SO_REUSEPORT so the kernel spreads connections across them.
+
+Each worker gets its own asyncpg pool plus the EventHub's one LISTEN connection, sized
+so that all workers together stay within [game.workers] max_connections.
+
+In-process state is per worker and is NOT shared between them. Each cache converges
+through Postgres, mostly through events published with NOTIFY (phantasm.game.events);
+since NOTIFYs sent while a worker's listener is down are lost, the reconnect handlers
+noted below reload or drop what they maintain:
+  - phantasm.NAMES, the character directory, follows its own NOTIFY channel and is
+    reloaded on reconnect.
+  - phantasm.PRESENCE is loaded from characters_active_view at startup, then learns of
+    other workers' characters from "presence.seen", sent at most once per
+    broadcast_interval per character, so idle times agree to within that interval;
+    "character.active" and "presence.left" update and drop entries. It is not reloaded
+    on reconnect; anyone missed reappears with their next broadcast.
+  - phantasm.game.api.info.INFO_CACHE drops entries on "info.changed" and is emptied on
+    reconnect.
+  - phantasm.game.api.scenes.CALENDAR is invalidated by "scene.changed" and on reconnect.
+  - phantasm.CHANNELS follows "channel.aliases" and "presence.left" and is reloaded on
+    reconnect.
+  - phantasm.REVOCATIONS follows "token.revoked" and "token.logout_all" and is reloaded
+    on reconnect. It must be: a missed revocation would leave a token usable.
+  - phantasm.THROTTLE shares failures through "login.failed" and "login.succeeded" and
+    seeds itself from loginrecords at startup, so a worker may briefly allow a few
+    more guesses than its peers.
+  - phantasm.REPLICA remembers recent writers per worker; the WROTE_COOKIE carries a
+    client's latest write to whichever worker serves its next read.
+  - phantasm.game.locks.lockhandler.PARSER_CACHE only memoizes parse trees of lock
+    strings. It is a pure function of the lock text, so it never needs invalidating.
+  - /metrics reports the counters of whichever worker served the scrape.
+Anything which must be consistent across workers has to go through Postgres.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import typing
+
+import mudpy
+
+logger = logging.getLogger(__name__)
+
+ENV_WORKER_INDEX = "PHANTASM_WORKER_INDEX"
+ENV_WORKER_COUNT = "PHANTASM_WORKER_COUNT"
+
+# asyncpg's defaults, used when [game.postgresql] doesn't say otherwise.
+DEFAULT_MIN_SIZE = 10
+DEFAULT_MAX_SIZE = 10
+
+
+def worker_identity() -> tuple[typing.Optional[int], int]:
+    """
+    Returns (index, count). index is None for the supervisor or a single-process server.
+    """
+    if (index := os.environ.get(ENV_WORKER_INDEX, None)) is not None:
+        return int(index), int(os.environ[ENV_WORKER_COUNT])
+    settings = mudpy.SETTINGS["GAME"].get("workers", dict())
+    return None, max(1, int(settings.get("count", 1)))
+
+
+def pool_settings(settings: dict, count: int, reserved: int = 0) -> dict:
+    """
+    Divide the connection budget between `count` workers. The budget is
+    [game.workers] max_connections if set, otherwise the configured pool max_size.
+    `reserved` connections per worker are held outside the pool, like the EventHub's
+    LISTEN connection, and come out of the budget first.
+    """
+    settings = dict(settings)
+    if count <= 1:
+        return settings
+    worker_settings = mudpy.SETTINGS["GAME"].get("workers", dict())
+    budget = worker_settings.get("max_connections", None) or settings.get(
+        "max_size", DEFAULT_MAX_SIZE
+    )
+    max_size = max(1, (int(budget) - reserved * count) // count)
+    settings["max_size"] = max_size
+    settings["min_size"] = min(settings.get("min_size", DEFAULT_MIN_SIZE), max_size)
+    return settings
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """
+    Create a listening socket which other workers can bind too.
+    """
+    family, kind, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )[0]
+    sock = socket.socket(family, kind, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(socket.SOMAXCONN)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index: int, count: int):
+    """
+    Entrypoint of a spawned worker process.
+    """
+    os.environ[ENV_WORKER_INDEX] = str(index)
+    os.environ[ENV_WORKER_COUNT] = str(count)
+    from phantasm.game import main
+
+    asyncio.run(main())
+
+
+class Supervisor:
+    """
+    Spawns the workers, restarts any which die unexpectedly, and on SIGTERM/SIGINT
+    forwards SIGTERM to every worker and waits for them to drain.
+
+    A worker which dies before it has run stable_after seconds is restarted after a
+    delay that doubles with each such death in a row, from restart_delay up to
+    max_restart_delay. After max_restarts of them in a row it is given up on, so a
+    worker which can't start (bad config, database down) doesn't spin; once every
+    worker is given up on, the supervisor exits.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        shutdown_timeout: float = 30.0,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        max_restarts: int = 5,
+        stable_after: float = 60.0,
+    ):
+        self.count = count
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_restarts = max_restarts
+        self.stable_after = stable_after
+        self.context = multiprocessing.get_context("spawn")
+        self.processes: dict[int, multiprocessing.Process] = dict()
+        self.started_at: dict[int, float] = dict()
+        # Early deaths in a row per worker, and when dead workers are due back.
+        self.failures: dict[int, int] = dict()
+        self.restart_at: dict[int, float] = dict()
+        self.given_up: set[int] = set()
+        self.shutdown_event = asyncio.Event()
+
+    def spawn(self, index: int):
+        process = self.context.Process(
+            target=run_worker, args=(index, self.count), name=f"phantasm-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info("Started worker %d (pid %d)", index, process.pid)
+
+    def exited(self, index: int, exitcode: typing.Optional[int]):
+        """
+        Schedule the restart of a worker which died, or give up on it.
+        """
+        now = time.monotonic()
+        if now - self.started_at[index] >= self.stable_after:
+            self.failures[index] = 0
+        failures = self.failures[index] = self.failures.get(index, 0) + 1
+        if failures > self.max_restarts:
+            logger.critical(
+                "Worker %d exited with code %s, %d times in a row soon after starting; "
+                "giving up on it.",
+                index,
+                exitcode,
+                failures,
+            )
+            self.given_up.add(index)
+            return
+        delay = min(self.restart_delay * 2 ** (failures - 1), self.max_restart_delay)
+        logger.error(
+            "Worker %d exited with code %s, restarting in %.1fs.", index, exitcode, delay
+        )
+        self.restart_at[index] = now + delay
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.shutdown_event.set)
+
+        for index in range(self.count):
+            self.spawn(index)
+
+        while not self.shutdown_event.is_set():
+            try:
+                await asyncio.wait_for(self.shutdown_event.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            if self.shutdown_event.is_set():
+                break
+            for index, process in list(self.processes.items()):
+                if index in self.given_up or index in self.restart_at:
+                    continue
+                if not process.is_alive():
+                    self.exited(index, process.exitcode)
+            for index, at in list(self.restart_at.items()):
+                if at <= time.monotonic():
+                    del self.restart_at[index]
+                    self.spawn(index)
+            if len(self.given_up) == self.count:
+                logger.critical("Every worker has been given up on, exiting.")
+                break
+
+        await self.stop()
+
+    async def stop(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = asyncio.get_running_loop().time() + self.shutdown_timeout
+        for index, process in self.processes.items():
+            remaining = max(0.0, deadline - asyncio.get_running_loop().time())
+            await asyncio.to_thread(process.join, remaining)
+            if process.is_alive():
+                logger.warning("Worker %d did not drain in time, killing it.", index)
+                process.kill()
+                await asyncio.to_thread(process.join)
@@ -0,0 +1,4 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Substring / ILIKE search on info file names.
+CREATE INDEX info_files_name_trgm ON info_files USING gin ((name::text) gin_trgm_ops);
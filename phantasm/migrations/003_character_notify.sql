@@ -0,0 +1,24 @@
+-- Keep in-memory character name directories current in every game process.
+CREATE FUNCTION notify_character_change() RETURNS trigger AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('phantasm_characters',
+                          json_build_object('id', OLD.id, 'deleted', TRUE)::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('phantasm_characters',
+                      json_build_object('id', NEW.id,
+                                        'user_id', NEW.user_id,
+                                        'name', NEW.name,
+                                        'deleted', NEW.deleted_at IS NOT NULL)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Only name, owner and deletion changes matter; last_active_at updates don't fire this.
+CREATE TRIGGER characters_notify
+    AFTER INSERT OR DELETE OR UPDATE OF name, user_id, deleted_at
+    ON characters
+    FOR EACH ROW
+EXECUTE FUNCTION notify_character_change();
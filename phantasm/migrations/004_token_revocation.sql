@@ -0,0 +1,16 @@
+-- Refresh tokens are single use; each one is recorded here when it is rotated.
+CREATE TABLE refresh_tokens_revoked
+(
+    jti        UUID PRIMARY KEY,
+    user_id    UUID        NOT NULL,
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMPTZ NOT NULL,
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE INDEX refresh_tokens_revoked_expires ON refresh_tokens_revoked (expires_at);
+
+-- Set by logout-everywhere. Tokens issued at or before this are rejected.
+ALTER TABLE users
+    ADD COLUMN tokens_valid_after TIMESTAMPTZ NULL;
@@ -0,0 +1,83 @@
+-- loginrecords becomes range partitioned by month on created_at, so old months can be
+-- detached and archived whole instead of deleted row by row.
+DROP VIEW loginrecords_with_user;
+ALTER TABLE loginrecords RENAME TO loginrecords_old;
+ALTER TABLE loginrecords_old DROP CONSTRAINT loginrecords_pkey;
+ALTER SEQUENCE loginrecords_id_seq OWNED BY NONE;
+
+CREATE TABLE loginrecords
+(
+    id         BIGINT      NOT NULL DEFAULT nextval('loginrecords_id_seq'),
+    user_id    UUID        NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ip_address INET        NOT NULL,
+    user_agent TEXT        NOT NULL,
+    success    BOOLEAN     NOT NULL,
+    PRIMARY KEY (id, created_at),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE loginrecords_id_seq OWNED BY loginrecords.id;
+
+-- Recent attempts by IP or by user, newest first.
+CREATE INDEX loginrecords_ip_recent ON loginrecords (ip_address, created_at DESC);
+CREATE INDEX loginrecords_user_recent ON loginrecords (user_id, created_at DESC);
+
+-- Catches rows outside every monthly partition, so a lagging maintenance job can't
+-- make logins fail.
+CREATE TABLE loginrecords_default PARTITION OF loginrecords DEFAULT;
+
+-- Create the monthly partitions loginrecords_YYYY_MM from the month of start_at up to
+-- months_ahead months past the current one. Rows already caught by the default
+-- partition are moved into their new partition.
+CREATE FUNCTION loginrecords_ensure_partitions(start_at TIMESTAMPTZ, months_ahead INT)
+    RETURNS INT AS
+$$
+DECLARE
+    cur     TIMESTAMPTZ := date_trunc('month', start_at);
+    final   TIMESTAMPTZ := date_trunc('month', now()) + make_interval(months => months_ahead);
+    part    TEXT;
+    created INT         := 0;
+BEGIN
+    WHILE cur <= final
+        LOOP
+            part := 'loginrecords_' || to_char(cur, 'YYYY_MM');
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I (LIKE loginrecords INCLUDING DEFAULTS)', part);
+                EXECUTE format(
+                        'WITH moved AS (DELETE FROM loginrecords_default
+                                        WHERE created_at >= $1 AND created_at < $2
+                                        RETURNING *)
+                         INSERT INTO %I SELECT * FROM moved', part)
+                    USING cur, cur + INTERVAL '1 month';
+                EXECUTE format(
+                        'ALTER TABLE loginrecords ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                        part, cur, cur + INTERVAL '1 month');
+                created := created + 1;
+            END IF;
+            cur := cur + INTERVAL '1 month';
+        END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT loginrecords_ensure_partitions(coalesce((SELECT min(created_at) FROM loginrecords_old), now()), 2);
+
+INSERT INTO loginrecords (id, user_id, created_at, ip_address, user_agent, success)
+SELECT id, user_id, created_at, ip_address, user_agent, success
+FROM loginrecords_old;
+
+DROP TABLE loginrecords_old;
+
+CREATE VIEW loginrecords_with_user AS
+SELECT l.id,
+       l.user_id,
+       l.created_at,
+       l.ip_address,
+       l.user_agent,
+       l.success,
+       u.email,
+       u.display_name
+FROM loginrecords l
+         JOIN users u ON l.user_id = u.id;
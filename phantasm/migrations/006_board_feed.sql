@@ -0,0 +1,3 @@
+-- Lets the new posts feed walk each board's posts newest first. Read state is
+-- checked through unique_post_read (user_id, post_id).
+CREATE INDEX board_posts_board_recent ON board_posts (board_id, id DESC);
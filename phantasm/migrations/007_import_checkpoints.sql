@@ -0,0 +1,19 @@
+-- Progress of phantasm.game.importer: the last source line loaded for each kind.
+CREATE TABLE import_checkpoints
+(
+    source     TEXT        NOT NULL,
+    kind       TEXT        NOT NULL,
+    line       BIGINT      NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, kind)
+);
+
+-- Indexes dropped and triggers disabled by the importer, to be restored after loading.
+CREATE TABLE import_deferred
+(
+    id         SERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    name       TEXT NOT NULL,
+    definition TEXT NULL
+);
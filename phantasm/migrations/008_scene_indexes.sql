@@ -0,0 +1,4 @@
+-- Upcoming scene calendars, and "my scenes" / "my plots" listings.
+CREATE INDEX scenes_scheduled_at ON scenes (scheduled_at);
+CREATE INDEX scene_participants_character ON scene_participants (character_id);
+CREATE INDEX plot_runners_character ON plot_runners (character_id);
@@ -0,0 +1,100 @@
+-- Every (ancestor, descendant) pair of the region tree, including each region paired
+-- with itself at depth 0, so subtrees and ancestries are one indexed join.
+CREATE TABLE region_closure
+(
+    ancestor_id   INT NOT NULL,
+    descendant_id INT NOT NULL,
+    depth         INT NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id),
+    CONSTRAINT fk_ancestor
+        FOREIGN KEY (ancestor_id) REFERENCES regions (id) ON DELETE CASCADE,
+    CONSTRAINT fk_descendant
+        FOREIGN KEY (descendant_id) REFERENCES regions (id) ON DELETE CASCADE
+);
+
+CREATE INDEX region_closure_ancestry ON region_closure (descendant_id, depth);
+CREATE INDEX region_rooms_region ON region_rooms (region_id);
+
+INSERT INTO region_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree AS (SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth
+                        FROM regions
+                        UNION ALL
+                        SELECT t.ancestor_id, r.id, t.depth + 1
+                        FROM tree t
+                                 JOIN regions r ON r.parent_id = t.descendant_id)
+SELECT ancestor_id, descendant_id, depth
+FROM tree;
+
+-- Every trigger below first locks region_closure, serializing region tree writes. Two
+-- moves (or a move and an insert under the moved subtree) committing together could
+-- each pass the cycle check or copy ancestry the other was rewriting. SHARE ROW
+-- EXCLUSIVE conflicts with itself but not with reads, and each trigger statement after
+-- the lock sees what the previous writer committed.
+CREATE FUNCTION region_closure_insert() RETURNS trigger AS
+$$
+BEGIN
+    LOCK TABLE region_closure IN SHARE ROW EXCLUSIVE MODE;
+    INSERT INTO region_closure (ancestor_id, descendant_id, depth)
+    SELECT NEW.id, NEW.id, 0
+    UNION ALL
+    SELECT ancestor_id, NEW.id, depth + 1
+    FROM region_closure
+    WHERE descendant_id = NEW.parent_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION region_closure_check_move() RETURNS trigger AS
+$$
+BEGIN
+    LOCK TABLE region_closure IN SHARE ROW EXCLUSIVE MODE;
+    IF NEW.parent_id IS NOT NULL AND EXISTS (SELECT 1
+                                             FROM region_closure
+                                             WHERE ancestor_id = NEW.id
+                                               AND descendant_id = NEW.parent_id) THEN
+        RAISE EXCEPTION 'Region % cannot be moved under its own subtree.', NEW.id
+            USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Moves the whole subtree: its links to every outside ancestor are replaced by links
+-- to the new parent's ancestors. Also runs when a deleted parent sets parent_id NULL.
+CREATE FUNCTION region_closure_move() RETURNS trigger AS
+$$
+BEGIN
+    LOCK TABLE region_closure IN SHARE ROW EXCLUSIVE MODE;
+    DELETE
+    FROM region_closure c
+    WHERE c.descendant_id IN (SELECT descendant_id FROM region_closure WHERE ancestor_id = NEW.id)
+      AND c.ancestor_id NOT IN (SELECT descendant_id FROM region_closure WHERE ancestor_id = NEW.id);
+    INSERT INTO region_closure (ancestor_id, descendant_id, depth)
+    SELECT p.ancestor_id, s.descendant_id, p.depth + s.depth + 1
+    FROM region_closure p
+             CROSS JOIN region_closure s
+    WHERE p.descendant_id = NEW.parent_id
+      AND s.ancestor_id = NEW.id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER regions_closure_insert
+    AFTER INSERT
+    ON regions
+    FOR EACH ROW
+EXECUTE FUNCTION region_closure_insert();
+
+CREATE TRIGGER regions_closure_check_move
+    BEFORE UPDATE OF parent_id
+    ON regions
+    FOR EACH ROW
+    WHEN (NEW.parent_id IS DISTINCT FROM OLD.parent_id)
+EXECUTE FUNCTION region_closure_check_move();
+
+CREATE TRIGGER regions_closure_move
+    AFTER UPDATE OF parent_id
+    ON regions
+    FOR EACH ROW
+    WHEN (NEW.parent_id IS DISTINCT FROM OLD.parent_id)
+EXECUTE FUNCTION region_closure_move();
@@ -0,0 +1,7 @@
+-- When each single-runner scheduled job last started, so only one worker runs each
+-- due run of it.
+CREATE TABLE scheduled_job_runs
+(
+    name       TEXT PRIMARY KEY,
+    started_at TIMESTAMPTZ NOT NULL
+);
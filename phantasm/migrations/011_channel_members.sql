@@ -0,0 +1,9 @@
+-- One membership per character and channel, so joins can upsert, and an index for
+-- loading a character's memberships (and aliases) when it becomes active.
+DELETE FROM channel_members m
+    USING channel_members d
+WHERE m.character_id = d.character_id
+  AND m.channel_id = d.channel_id
+  AND m.id > d.id;
+
+CREATE UNIQUE INDEX unique_channel_member ON channel_members (character_id, channel_id);
@@ -1,6 +1,68 @@
 import typing
 
 
+class ChannelAliasMap:
+    """
+    A character's channel aliases (alias -> channel id), as served by the game's
+    GET /channels/aliases and kept current from its "channel.aliases" events, so that
+    every input line is checked against them without asking the game.
+    """
+
+    def __init__(self, aliases: typing.Optional[dict[str, int]] = None):
+        self.aliases: dict[str, int] = dict()
+        for alias, channel_id in (aliases or dict()).items():
+            self.aliases[alias.lower()] = channel_id
+
+    def apply(self, event: dict):
+        """
+        Apply a "channel.aliases" event: the character's aliases for one channel,
+        or null aliases if they left it.
+        """
+        channel_id = event["channel_id"]
+        for alias in [k for k, v in self.aliases.items() if v == channel_id]:
+            del self.aliases[alias]
+        for alias in event.get("aliases") or ():
+            self.aliases[alias.lower()] = channel_id
+
+    def resolve(self, command: str) -> typing.Optional[int]:
+        return self.aliases.get(command, None)
+
+
+class CommandMatch(typing.NamedTuple):
+    # The matching command class, or None when the input named a channel.
+    command: typing.Optional[type["Command"]]
+    match_cmd: str
+    channel_id: typing.Optional[int] = None
+
+
+def find_command(
+    command: str,
+    commands: typing.Iterable[type["Command"]],
+    channels: typing.Optional[ChannelAliasMap] = None,
+) -> typing.Optional[CommandMatch]:
+    """
+    Decide what the first word of an input line means. In order:
+
+    1. A command whose name or alias is exactly `command`.
+    2. One of the character's channel aliases, so "pub hello" talks on the channel
+       aliased "pub" rather than running a command that merely starts with "pub".
+    3. A command partially matching `command`.
+
+    Within steps 1 and 3 the command with the highest priority wins. `command` must
+    already be trimmed and lowercase, as for Command.check_match.
+    """
+    ordered = sorted(commands, key=lambda c: c.priority, reverse=True)
+    for cmd in ordered:
+        if (match := cmd.check_exact(command)) is not None:
+            return CommandMatch(cmd, match)
+    if channels is not None and (channel_id := channels.resolve(command)) is not None:
+        return CommandMatch(None, command, channel_id)
+    for cmd in ordered:
+        if (match := cmd.check_partial(command)) is not None:
+            return CommandMatch(cmd, match)
+    return None
+
+
 class Command:
     """
     Base class for commands/actions taken by characters.
@@ -26,11 +88,25 @@ class Command:
 
         IE: "north" should respond to "nort" but not "norb"
         """
+        return cls.check_exact(command) or cls.check_partial(command)
+
+    @classmethod
+    def check_exact(cls, command: str) -> typing.Optional[str]:
+        """
+        Match only the command's name or one of its aliases, exactly.
+        """
         if command == cls.name:
             return cls.name
+        if command in cls.aliases:
+            return command
+        return None
+
+    @classmethod
+    def check_partial(cls, command: str) -> typing.Optional[str]:
+        """
+        Match an alias partially, as allowed by its minimum length.
+        """
         for k, v in cls.aliases.items():
-            if command == k:
-                return k
             if len(command) >= v and command.startswith(k):
                 return k
         return None
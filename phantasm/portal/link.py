@@ -1,4 +1,7 @@
 import asyncio
+import functools
+import typing
+from collections import OrderedDict
 
 from rich.console import Console
 
@@ -6,45 +9,131 @@ import mudpy
 
 from mudpy.portal.link import Link as OldLink
 
-class Link(OldLink):
 
-    def __init__(self, session: "GameSession"):
-        super().__init__(session)
-        self.console = Console(color_system="standard", file=self, record=True,
-                               width=self.session.capabilities.width,
-                               height=self.session.capabilities.height)
-        self.console._color_system = self.session.capabilities.color
+@functools.cache
+def output_settings() -> tuple[float, int]:
+    """
+    Returns (coalesce window in seconds, max buffered characters) from [portal.output].
+    """
+    settings = mudpy.SETTINGS["PORTAL"].get("output", dict())
+    return settings.get("coalesce_us", 0) / 1_000_000, settings.get("max_buffer", 65536)
 
-    def flush(self):
-        """
-        Used for compatability.
-        """
+
+class _NullFile:
+    """
+    Render consoles only record; what they'd write to a terminal is thrown away.
+    """
 
     def write(self, data):
-        """
-        Used for compatability.
-        """
+        pass
+
+    def flush(self):
+        pass
+
+
+NULL_FILE = _NullFile()
+
+# Recording consoles shared by every link, keyed by (width, height, color system).
+# Rendering never awaits between print() and export_text(), so a console is only ever
+# used by one link at a time.
+CONSOLES: OrderedDict[tuple, Console] = OrderedDict()
+MAX_CONSOLES = 32
+
+
+def render_console(width: int, height: int, color_system: typing.Any) -> Console:
+    key = (width, height, color_system)
+    if (console := CONSOLES.get(key, None)) is not None:
+        CONSOLES.move_to_end(key)
+        return console
+    console = Console(color_system="standard", file=NULL_FILE, record=True,
+                      width=width, height=height)
+    console._color_system = color_system
+    CONSOLES[key] = console
+    while len(CONSOLES) > MAX_CONSOLES:
+        CONSOLES.popitem(last=False)
+    return console
+
+
+class Link(OldLink):
+
+    def __init__(self, session: "GameSession"):
+        super().__init__(session)
+        self.output_buffer: list[str] = list()
+        self.output_size = 0
+        self.output_handle = None
+        self.output_lock = asyncio.Lock()
+        # Flushes started by schedule_flush, held so they aren't collected mid-write.
+        self.flush_tasks: set[asyncio.Task] = set()
 
     def print(self, *args, **kwargs) -> str:
         """
         A thin wrapper around Rich.Console's print. Returns the exported data.
+
+        Rendering borrows a shared console matching the session's current size and
+        color support, so links hold no console of their own.
         """
         new_kwargs = {"highlight": False}
         new_kwargs.update(kwargs)
         new_kwargs["end"] = "\r\n"
         new_kwargs["crop"] = False
-        self.console.print(*args, **new_kwargs)
-        return self.console.export_text(clear=True, styles=True)
+        capabilities = self.session.capabilities
+        console = render_console(capabilities.width, capabilities.height, capabilities.color)
+        console.print(*args, **new_kwargs)
+        return console.export_text(clear=True, styles=True)
 
     async def send_rich(self, *args, **kwargs):
         """
         Sends a Rich message to the client.
         """
         out = self.print(*args, **kwargs)
-        await self.session.handle_send_text(out)
+        await self.send_text(out)
 
     async def send_text(self, text: str):
         """
         Sends plain text to the client.
+
+        Text is buffered and written as one message at the end of the current event
+        loop tick, or after [portal.output] coalesce_us microseconds if that is set.
+        The buffer is flushed early once it holds max_buffer characters.
+        """
+        window, max_buffer = output_settings()
+        self.output_buffer.append(text)
+        self.output_size += len(text)
+        if self.output_size >= max_buffer:
+            await self.flush_output()
+        elif self.output_handle is None:
+            loop = asyncio.get_running_loop()
+            if window > 0:
+                self.output_handle = loop.call_later(window, self.schedule_flush)
+            else:
+                self.output_handle = loop.call_soon(self.schedule_flush)
+
+    async def send_prompt(self, text: str):
+        """
+        Sends a prompt, flushing it and anything buffered before it immediately.
+        """
+        self.output_buffer.append(text)
+        self.output_size += len(text)
+        await self.flush_output()
+
+    def schedule_flush(self):
+        self.output_handle = None
+        task = asyncio.create_task(self.flush_output())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush_output(self):
+        """
+        Write out everything buffered so far as a single message.
         """
-        await self.session.handle_send_text(text)
\ No newline at end of file
+        if self.output_handle is not None:
+            self.output_handle.cancel()
+            self.output_handle = None
+        if not self.output_buffer:
+            return
+        out = "".join(self.output_buffer)
+        self.output_buffer.clear()
+        self.output_size = 0
+        # Keep writes in order even if the session's send yields part way through.
+        async with self.output_lock:
+            await self.session.handle_send_text(out)
@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+import os
+import uuid
+from pathlib import Path
+
+import asyncpg
+import pytest
+
+MIGRATIONS = Path(__file__).parent.parent / "phantasm" / "migrations"
+
+
+class MigratedDatabase:
+    """
+    A throwaway schema with every migration applied, in the database PHANTASM_TEST_DSN
+    names. Tests open pools on it inside their own event loop with pool().
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.schema = f"phantasm_test_{uuid.uuid4().hex[:12]}"
+
+    @property
+    def server_settings(self) -> dict:
+        return {"search_path": f"{self.schema},public"}
+
+    async def create(self):
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            await conn.execute(f"CREATE SCHEMA {self.schema}")
+            await conn.execute(f"SET search_path TO {self.schema},public")
+            for path in sorted(MIGRATIONS.glob("*.sql")):
+                await conn.execute(path.read_text())
+        finally:
+            await conn.close()
+
+    async def drop(self):
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            await conn.execute(f"DROP SCHEMA {self.schema} CASCADE")
+        finally:
+            await conn.close()
+
+    @contextlib.asynccontextmanager
+    async def pool(self, **kwargs):
+        pool = await asyncpg.create_pool(
+            self.dsn, server_settings=self.server_settings, **kwargs
+        )
+        try:
+            yield pool
+        finally:
+            await pool.close()
+
+
+@pytest.fixture
+def database():
+    if not (dsn := os.environ.get("PHANTASM_TEST_DSN", None)):
+        pytest.skip("PHANTASM_TEST_DSN is not set.")
+    database = MigratedDatabase(dsn)
+    asyncio.run(database.create())
+    try:
+        yield database
+    finally:
+        asyncio.run(database.drop())
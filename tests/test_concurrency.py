@@ -0,0 +1,122 @@
+"""
+Statements which must hold up when two requests run them at once. Each test starts
+one transaction, lets a second one run into it, then commits the first and checks
+what the second did. They need a Postgres, named by PHANTASM_TEST_DSN.
+"""
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import asyncpg
+import pytest
+
+pytest.importorskip("mudpy")
+pytest.importorskip("tortoise")
+
+from phantasm.game.api.utils import ACTING_UPSERT
+from phantasm.game.api.boards import insert_post
+
+
+async def wait_until_blocked(pool: asyncpg.Pool, pid: int):
+    """
+    Wait for the backend pid to be waiting on a lock.
+    """
+    async with pool.acquire() as conn:
+        for _ in range(200):
+            waiting = await conn.fetchval(
+                "SELECT wait_event_type = 'Lock' FROM pg_stat_activity WHERE pid = $1", pid
+            )
+            if waiting:
+                return
+            await asyncio.sleep(0.01)
+    pytest.fail("The second transaction never waited on the first.")
+
+
+async def make_character(conn: asyncpg.Connection, name: str) -> tuple[uuid.UUID, int]:
+    user_id = await conn.fetchval(
+        "INSERT INTO users (email) VALUES ($1) RETURNING id", f"{name}@example.com"
+    )
+    character_id = await conn.fetchval(
+        "INSERT INTO characters (user_id, name) VALUES ($1, $2) RETURNING id", user_id, name
+    )
+    return user_id, character_id
+
+
+async def race(pool: asyncpg.Pool, statement):
+    """
+    Run statement(conn) in two transactions, the second starting while the first is
+    still open. Returns both results.
+    """
+    async with pool.acquire() as first, pool.acquire() as second:
+        transaction = first.transaction()
+        await transaction.start()
+        try:
+            first_result = await statement(first)
+
+            async def run_second():
+                async with second.transaction():
+                    return await statement(second)
+
+            task = asyncio.create_task(run_second())
+            await wait_until_blocked(pool, second.get_server_pid())
+        except BaseException:
+            await transaction.rollback()
+            raise
+        await transaction.commit()
+        return first_result, await task
+
+
+def test_acting_upsert_activates_once(database):
+    async def scenario():
+        async with database.pool(min_size=3, max_size=3) as pool:
+            async with pool.acquire() as conn:
+                user_id, character_id = await make_character(conn, "Racer")
+
+            first, second = await race(
+                pool, lambda conn: conn.fetchrow(ACTING_UPSERT, character_id, user_id)
+            )
+
+            assert first["user_match"] == second["user_match"] == character_id
+            assert first["spoofing_id"] == second["spoofing_id"]
+            assert first["spoofed_name"] == second["spoofed_name"] == "Racer"
+            async with pool.acquire() as conn:
+                assert await conn.fetchval(
+                    "SELECT count(*) FROM characters_active WHERE id = $1", character_id
+                ) == 1
+                assert await conn.fetchval(
+                    "SELECT count(*) FROM character_spoofs WHERE character_id = $1",
+                    character_id,
+                ) == 1
+
+    asyncio.run(scenario())
+
+
+def test_simultaneous_posts_are_numbered_apart(database):
+    async def scenario():
+        async with database.pool(min_size=3, max_size=3) as pool:
+            async with pool.acquire() as conn:
+                user_id, character_id = await make_character(conn, "Poster")
+                spoof_id = await conn.fetchval(
+                    """
+                    INSERT INTO character_spoofs (character_id, spoofed_name)
+                    VALUES ($1, 'Poster') RETURNING id
+                    """,
+                    character_id,
+                )
+                board_id = await conn.fetchval(
+                    "INSERT INTO boards (name, board_order) VALUES ('Race', 1) RETURNING id"
+                )
+            acting = SimpleNamespace(spoofing_id=spoof_id, user=SimpleNamespace(id=user_id))
+
+            first, second = await race(
+                pool, lambda conn: insert_post(conn, board_id, "Hi", "Body", None, acting)
+            )
+            assert {first["post_key"], second["post_key"]} == {"1", "2"}
+
+            first, second = await race(
+                pool, lambda conn: insert_post(conn, board_id, None, "Reply", "1", acting)
+            )
+            assert {first["post_key"], second["post_key"]} == {"1.1", "1.2"}
+            assert first["title"] == second["title"] == "RE: Hi"
+
+    asyncio.run(scenario())
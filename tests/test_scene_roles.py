@@ -0,0 +1,169 @@
+"""
+Who may hand out and take away a scene's ownership roles. Only an owner or an admin
+may make or unmake owners and co-owners; co-owners run everything else. They need a
+Postgres, named by PHANTASM_TEST_DSN.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("mudpy")
+pytest.importorskip("tortoise")
+
+import phantasm
+from fastapi import HTTPException
+
+from phantasm.game.api.scenes import (
+    set_participant,
+    remove_participant,
+    OWNER,
+    CO_OWNER,
+)
+from phantasm.game.api.utils import RequestDB
+from phantasm.game.replica import ReplicaRouter
+
+
+async def make_scene(conn) -> SimpleNamespace:
+    """
+    A scene with an owner, a co-owner and a plain participant, plus a bystander.
+    """
+    scene = SimpleNamespace()
+    scene.id = await conn.fetchval("INSERT INTO scenes (name) VALUES ('Roles') RETURNING id")
+    roles = (("owner", OWNER), ("co_owner", CO_OWNER), ("guest", 0), ("bystander", None))
+    for name, role in roles:
+        user_id = await conn.fetchval(
+            "INSERT INTO users (email) VALUES ($1) RETURNING id", f"{name}@example.com"
+        )
+        character_id = await conn.fetchval(
+            "INSERT INTO characters (user_id, name) VALUES ($1, $2) RETURNING id",
+            user_id,
+            name,
+        )
+        if role is not None:
+            await conn.execute(
+                """
+                INSERT INTO scene_participants (scene_id, character_id, participant_type)
+                VALUES ($1, $2, $3)
+                """,
+                scene.id,
+                character_id,
+                role,
+            )
+        setattr(scene, name, SimpleNamespace(user_id=user_id, character_id=character_id))
+    return scene
+
+
+async def act(pool, who: SimpleNamespace, handler, *args, admin_level: int = 0, **kwargs):
+    """
+    Call handler as who, with the acting character already resolved.
+    """
+    user = SimpleNamespace(id=who.user_id)
+    db = RequestDB(pool)
+    db.acting[who.character_id] = SimpleNamespace(
+        user=user, character=SimpleNamespace(id=who.character_id), admin_level=admin_level
+    )
+    try:
+        return await handler(*args, user=user, db=db, character_id=who.character_id, **kwargs)
+    finally:
+        await db.release()
+
+
+async def role_of(pool, scene, who: SimpleNamespace):
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT participant_type FROM scene_participants WHERE scene_id = $1 AND character_id = $2",
+            scene.id,
+            who.character_id,
+        )
+
+
+def run(database, scenario):
+    async def setup():
+        async with database.pool(min_size=1, max_size=2) as pool:
+            async with pool.acquire() as conn:
+                scene = await make_scene(conn)
+            await scenario(pool, scene)
+
+    replica = phantasm.REPLICA
+    phantasm.REPLICA = ReplicaRouter(None, None)
+    try:
+        asyncio.run(setup())
+    finally:
+        phantasm.REPLICA = replica
+
+
+@pytest.mark.parametrize(
+    "target, role",
+    [
+        ("guest", OWNER),
+        ("guest", CO_OWNER),
+        ("co_owner", OWNER),
+        ("owner", 0),
+        ("owner", CO_OWNER),
+        ("bystander", CO_OWNER),
+    ],
+)
+def test_co_owner_cannot_change_ownership(database, target, role):
+    async def scenario(pool, scene):
+        who = getattr(scene, target)
+        before = await role_of(pool, scene, who)
+        with pytest.raises(HTTPException) as error:
+            await act(
+                pool, scene.co_owner, set_participant, scene.id, who.character_id, role=role
+            )
+        assert error.value.status_code == 403
+        assert await role_of(pool, scene, who) == before
+
+    run(database, scenario)
+
+
+def test_co_owner_cannot_remove_owner(database):
+    async def scenario(pool, scene):
+        with pytest.raises(HTTPException) as error:
+            await act(
+                pool, scene.co_owner, remove_participant, scene.id, scene.owner.character_id
+            )
+        assert error.value.status_code == 403
+        assert await role_of(pool, scene, scene.owner) == OWNER
+
+    run(database, scenario)
+
+
+def test_co_owner_manages_participants(database):
+    async def scenario(pool, scene):
+        await act(
+            pool, scene.co_owner, set_participant, scene.id, scene.bystander.character_id, role=1
+        )
+        assert await role_of(pool, scene, scene.bystander) == 1
+        await act(pool, scene.co_owner, remove_participant, scene.id, scene.guest.character_id)
+        assert await role_of(pool, scene, scene.guest) is None
+        # Stepping down needs nobody's permission.
+        await act(
+            pool, scene.co_owner, set_participant, scene.id, scene.co_owner.character_id, role=0
+        )
+        assert await role_of(pool, scene, scene.co_owner) == 0
+
+    run(database, scenario)
+
+
+def test_owner_and_admin_change_ownership(database):
+    async def scenario(pool, scene):
+        await act(
+            pool, scene.owner, set_participant, scene.id, scene.guest.character_id, role=CO_OWNER
+        )
+        assert await role_of(pool, scene, scene.guest) == CO_OWNER
+        await act(pool, scene.owner, remove_participant, scene.id, scene.co_owner.character_id)
+        assert await role_of(pool, scene, scene.co_owner) is None
+        await act(
+            pool,
+            scene.bystander,
+            set_participant,
+            scene.id,
+            scene.owner.character_id,
+            role=0,
+            admin_level=1,
+        )
+        assert await role_of(pool, scene, scene.owner) == 0
+
+    run(database, scenario)
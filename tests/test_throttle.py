@@ -0,0 +1,43 @@
+"""
+The login throttle's delays, at the edge of the free allowance and beyond it.
+"""
+import pytest
+
+pytest.importorskip("mudpy")
+
+from phantasm.game import throttle
+from phantasm.game.throttle import LoginThrottle
+
+NOW = 1_000_000.0
+
+
+def fail(limiter: LoginThrottle, key: str, times: int, at: float = NOW):
+    for _ in range(times):
+        limiter.failed(key, at=at)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(throttle.time, "time", lambda: NOW)
+
+
+def test_free_failures_cost_nothing(clock):
+    limiter = LoginThrottle(account_free=5, base_delay=1.0)
+    fail(limiter, "user:a", 5)
+    assert limiter.retry_after("user:a") == 0
+
+
+@pytest.mark.parametrize("failures, delay", [(6, 1.0), (7, 2.0), (8, 4.0), (30, 900.0)])
+def test_each_failure_past_the_allowance_doubles_the_delay(clock, failures, delay):
+    limiter = LoginThrottle(account_free=5, base_delay=1.0, max_delay=900.0)
+    fail(limiter, "user:a", failures)
+    assert limiter.retry_after("user:a") == delay
+
+
+def test_pending_attempts_count_as_failures(clock):
+    limiter = LoginThrottle(account_free=5, base_delay=1.0)
+    fail(limiter, "user:a", 5, at=NOW - 10)
+    assert limiter.retry_after("user:a") == 0
+    with limiter.attempt("user:a"):
+        assert limiter.retry_after("user:a") == 1.0
+    assert limiter.retry_after("user:a") == 0